@@ -0,0 +1,310 @@
+"""
+批量写入模式
+
+进入时记录目标索引当前设置并应用高吞吐配置（关闭刷新、去掉副本、异步 translog、
+提高 flush 阈值），退出时恢复原设置、刷新并等待副本恢复。
+
+会话异常结束时同样会恢复：
+- 进程正常退出或收到 SIGTERM 时通过 atexit 恢复
+- 每次进入带租约，超过租约未退出时后台自动恢复
+- 状态写入本地文件，进程被强制结束后，下次启动时恢复遗留的索引。
+  每个会话是一个独立进程，读写状态文件时加文件锁并重新读取，不会覆盖其他会话的记录
+
+环境变量:
+    EASYSEARCH_BULK_STATE: 状态文件路径（默认系统临时目录下 easysearch-mcp-bulk-mode.json）
+"""
+
+import atexit
+import fnmatch
+import json
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Generator
+from .client import get_client
+
+try:
+    import fcntl
+except ImportError:  # Windows：只有进程内的锁
+    fcntl = None
+
+BULK_PROFILES = {
+    # 最大吞吐：数据可从源头重放时使用
+    "throughput": {
+        "index.refresh_interval": "-1",
+        "index.number_of_replicas": 0,
+        "index.translog.durability": "async",
+        "index.translog.flush_threshold_size": "1gb"
+    },
+    # 保留副本和同步 translog，只减少刷新和 flush
+    "safe": {
+        "index.refresh_interval": "-1",
+        "index.translog.flush_threshold_size": "1gb"
+    }
+}
+
+_lock = threading.RLock()
+_timers = {}
+_hooks_installed = False
+# 本进程的标识：PID 可能被复用（容器中每次重启通常都是 1），不能单独用 PID 判断记录归属
+_token = uuid.uuid4().hex
+
+
+def _state_path() -> str:
+    return os.getenv("EASYSEARCH_BULK_STATE",
+                     os.path.join(tempfile.gettempdir(), "easysearch-mcp-bulk-mode.json"))
+
+
+def _load(path: str) -> dict:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save(path: str, active: dict):
+    """原子写入状态文件，无记录时删除"""
+    if not active:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".bulk-mode-")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(active, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+@contextmanager
+def _state() -> Generator[dict, None, None]:
+    """
+    加锁读取处于批量模式的索引 {状态键: 记录}，有修改时退出前写回
+
+    同一状态文件由多个会话进程共享：每次都在文件锁内重新读取，只修改自己涉及的记录
+    """
+    path = _state_path()
+    with _lock, open(f"{path}.lock", "a") as lock:
+        if fcntl:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        active = _load(path)
+        before = json.dumps(active, sort_keys=True)
+        yield active
+        if json.dumps(active, sort_keys=True) != before:
+            _save(path, active)
+
+
+def _normalize(settings: dict, prefix: str = "") -> dict:
+    """展开嵌套设置并补全 index. 前缀，与 flat_settings 返回的键一致"""
+    flat = {}
+    for key, value in settings.items():
+        key = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_normalize(value, f"{key}."))
+        else:
+            flat[key if key.startswith("index.") else f"index.{key}"] = value
+    return flat
+
+
+def _key(index: str) -> str:
+    """状态键，区分不同集群"""
+    return f"{get_client().url}|{index}"
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def _read(path: str):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _boot_id():
+    """本次开机的 ID（Linux），不可用时为 None"""
+    boot = _read("/proc/sys/kernel/random/boot_id")
+    return boot.strip() if boot else None
+
+
+def _proc_start(pid: int):
+    """进程启动时间（Linux /proc，开机以来的时钟周期），不可用时为 None"""
+    stat = _read(f"/proc/{pid}/stat")
+    if not stat:
+        return None
+    # 第 2 列 comm 可能包含空格，从最后一个 ")" 之后开始计数，starttime 为第 22 列
+    fields = stat[stat.rfind(")") + 2:].split()
+    return int(fields[19]) if len(fields) > 19 else None
+
+
+def _owner_alive(entry: dict) -> bool:
+    """记录所属的进程是否仍在运行（比较进程标识，而不只是 PID）"""
+    if entry.get("token") == _token:
+        return True
+    pid = entry.get("pid")
+    # 与本进程 PID 相同但标识不同：记录来自之前使用同一 PID 的进程
+    if not pid or pid == os.getpid() or not _pid_alive(pid):
+        return False
+    if entry.get("boot") and entry["boot"] != _boot_id():
+        return False
+    return entry.get("proc_start") is None or entry["proc_start"] == _proc_start(pid)
+
+
+def _arm(key: str, lease: float):
+    """设置租约到期后自动恢复的定时器"""
+    timer = _timers.pop(key, None)
+    if timer:
+        timer.cancel()
+    if lease:
+        timer = threading.Timer(lease, _expire, args=(key,))
+        timer.daemon = True
+        _timers[key] = timer
+        timer.start()
+
+
+def _expire(key: str):
+    """租约到期：恢复该索引"""
+    with _state() as active:
+        entry = active.get(key)
+    if entry:
+        exit_bulk(entry["index"], wait_for_green=False)
+
+
+def install_exit_hooks():
+    """注册退出时自动恢复（atexit + SIGTERM），只需调用一次"""
+    global _hooks_installed
+    if _hooks_installed:
+        return
+    _hooks_installed = True
+    atexit.register(restore_all)
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+
+def enter_bulk(index: str, profile: str = "throughput", settings: dict = None, lease: float = 3600) -> dict:
+    """记录当前设置并应用批量写入配置；重复进入时保留最初记录的原设置并续租"""
+    if profile not in BULK_PROFILES:
+        raise ValueError(f"不支持的配置: {profile}，可选 {', '.join(BULK_PROFILES)}")
+    applied = dict(BULK_PROFILES[profile])
+    applied.update(_normalize(settings or {}))
+    client = get_client()
+    current = client.get(f"/{index}/_settings", {"flat_settings": "true"})
+    if not current:
+        raise ValueError(f"索引不存在: {index}")
+
+    install_exit_hooks()
+    with _state() as active:
+        now = time.time()
+        for name, body in current.items():
+            values = body.get("settings", {})
+            key = _key(name)
+            entry = active.get(key) or {"index": name, "url": client.url, "previous": {}, "entered": now}
+            for setting in applied:
+                # 已在批量模式中的索引，原设置以首次进入时为准
+                entry["previous"].setdefault(setting, values.get(setting))
+            entry.update(pid=os.getpid(), token=_token, boot=_boot_id(), proc_start=_proc_start(os.getpid()),
+                         profile=profile, applied=applied, expires=now + lease if lease else None)
+            active[key] = entry
+            _arm(key, lease)
+        previous = {name: active[_key(name)]["previous"] for name in current}
+    names = list(current)
+    client.put(f"/{','.join(names)}/_settings", applied)
+    return {"indices": names, "applied": applied, "lease_s": lease, "previous": previous}
+
+
+def _matching(active: dict, index: str = None) -> list:
+    """当前集群处于批量模式、且匹配索引表达式的状态键"""
+    url = get_client().url
+    keys = [k for k, e in active.items() if e.get("url") == url]
+    if index is None:
+        return keys
+    patterns = index.split(",")
+    return [k for k in keys if any(fnmatch.fnmatchcase(active[k]["index"], p) for p in patterns)]
+
+
+def exit_bulk(index: str = None, wait_for_green: bool = True, timeout: str = "20s") -> dict:
+    """恢复原设置、刷新并触发副本恢复；index 为空时恢复全部"""
+    client = get_client()
+    with _state() as active:
+        entries = [active.pop(k) for k in _matching(active, index)]
+        for entry in entries:
+            timer = _timers.pop(_key(entry["index"]), None)
+            if timer:
+                timer.cancel()
+    restored, errors = [], {}
+    for entry in entries:
+        try:
+            client.put(f"/{entry['index']}/_settings", entry["previous"])
+            restored.append(entry["index"])
+        except Exception as e:
+            errors[entry["index"]] = str(e)
+    result = {"restored": restored}
+    if restored:
+        names = ",".join(restored)
+        client.post(f"/{names}/_refresh")
+        if wait_for_green:
+            # 设置已恢复；副本从 0 恢复可能超过 timeout，此时返回 green: false 而不是报错
+            health = client.health(names, {"wait_for_status": "green", "timeout": timeout})
+            result["green"] = health.get("status") == "green" and not health.get("timed_out")
+            result["health"] = {k: health.get(k) for k in
+                                ("status", "timed_out", "active_shards", "initializing_shards",
+                                 "unassigned_shards")}
+    if errors:
+        result["errors"] = errors
+    return result
+
+
+def status() -> list:
+    """当前集群处于批量模式的索引"""
+    now = time.time()
+    result = []
+    with _state() as active:
+        entries = [active[key] for key in _matching(active)]
+    for entry in entries:
+        result.append({
+            "index": entry["index"],
+            "profile": entry.get("profile"),
+            "applied": entry.get("applied"),
+            "previous": entry["previous"],
+            "entered_s_ago": round(now - entry["entered"], 1),
+            "lease_remaining_s": round(entry["expires"] - now, 1) if entry.get("expires") else None
+        })
+    return result
+
+
+def restore_all():
+    """恢复本进程进入批量模式的全部索引（进程退出时调用）"""
+    with _state() as active:
+        mine = [e["index"] for e in active.values() if e.get("token") == _token]
+    for index in mine:
+        try:
+            exit_bulk(index, wait_for_green=False)
+        except Exception:
+            pass
+
+
+def recover() -> dict:
+    """启动时恢复遗留记录：所属进程已不存在或租约已过期的索引"""
+    now = time.time()
+    with _state() as active:
+        stale = [e["index"] for e in active.values() if e.get("url") == get_client().url and (
+            not _owner_alive(e) or (e.get("expires") and e["expires"] < now))]
+    if not stale:
+        return {"restored": []}
+    return exit_bulk(",".join(stale), wait_for_green=False)
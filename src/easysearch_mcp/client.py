@@ -3,8 +3,10 @@ Easysearch HTTP 客户端
 """
 
 import os
+import json
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
-from typing import Generator, Any
+from typing import Callable, Generator, Any, Iterable
 import httpx
 
 
@@ -72,6 +74,45 @@ class EasysearchClient:
         with self._client() as client:
             r = client.head(path)
             return r.status_code == 200
+    
+    def health(self, index: str = None, params: dict = None) -> dict:
+        """_cluster/health；wait_for_* 等待超时（HTTP 408）时返回 timed_out 为 true 的响应而不抛出异常"""
+        path = f"/_cluster/health/{index}" if index else "/_cluster/health"
+        with self._client() as client:
+            r = client.get(path, params=params)
+            if r.status_code != 408:
+                r.raise_for_status()
+            return r.json()
+    
+    def cat_rows(self, path: str, columns: list, params: dict = None) -> Generator[list, None, None]:
+        """流式读取 _cat 文本输出，逐行产出指定列的值（缺失值为 None），不在内存中构造 JSON"""
+        params = dict(params or {}, h=",".join(columns))
+        with self._client() as client:
+            with client.stream("GET", path, params=params) as r:
+                r.raise_for_status()
+                for line in r.iter_lines():
+                    values = line.split()
+                    if values:
+                        yield values + [None] * (len(columns) - len(values))
+    
+    def msearch(self, searches: list, index: str = None) -> Any:
+        """_msearch 请求，searches 为 [(header, body), ...]"""
+        lines = []
+        for header, body in searches:
+            lines.append(json.dumps(header))
+            lines.append(json.dumps(body))
+        path = f"/{index}/_msearch" if index else "/_msearch"
+        return self.post(path, content="\n".join(lines) + "\n",
+                         headers={"Content-Type": "application/x-ndjson"})
+
+
+def parallel_map(func: Callable, items: Iterable, max_workers: int = 4) -> list:
+    """以有限并发执行 func(item)，按输入顺序返回结果"""
+    items = list(items)
+    if max_workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as pool:
+        return list(pool.map(func, items))
 
 
 # 全局客户端实例
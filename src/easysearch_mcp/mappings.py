@@ -0,0 +1,178 @@
+"""
+索引映射缓存
+
+按索引缓存展开后的字段信息（字段路径 → 类型/可搜索/可聚合），
+供查询成本评估、本地查询校验等本地分析使用，避免每次请求都访问集群。
+
+映射相同的索引（如按天滚动的索引）共享同一张字段表；
+通配符/逗号表达式解析出的具体索引列表也会缓存，表达式内索引均未过期时不访问集群
+"""
+
+import fnmatch
+import json
+import os
+import threading
+import time
+from typing import Any
+from .client import get_client
+
+# 可聚合（默认开启 doc_values）的字段类型
+AGGREGATABLE_TYPES = {
+    "keyword", "constant_keyword", "wildcard", "long", "integer", "short", "byte", "double",
+    "float", "half_float", "scaled_float", "unsigned_long", "date", "date_nanos", "boolean",
+    "ip", "version", "geo_point", "geo_shape"
+}
+
+
+def _flatten_properties(properties: dict, prefix: str, fields: dict):
+    """递归展开 properties 和多字段（如 name.keyword）"""
+    for name, spec in properties.items():
+        path = f"{prefix}{name}"
+        field_type = spec.get("type", "object" if "properties" in spec else None)
+        if field_type:
+            aggregatable = (field_type in AGGREGATABLE_TYPES and spec.get("doc_values", True)) \
+                or (field_type == "text" and spec.get("fielddata", False))
+            fields[path] = {
+                "type": field_type,
+                "searchable": field_type not in ("object", "nested") and spec.get("index", True),
+                "aggregatable": bool(aggregatable)
+            }
+            if field_type == "alias":
+                fields[path]["path"] = spec.get("path")
+        if "properties" in spec:
+            _flatten_properties(spec["properties"], f"{path}.", fields)
+        if "fields" in spec:
+            _flatten_properties(spec["fields"], f"{path}.", fields)
+
+
+def _resolve_aliases(fields: dict):
+    """字段别名（type: alias）继承目标字段的类型和能力"""
+    for info in fields.values():
+        if info["type"] == "alias":
+            target = fields.get(info.get("path"))
+            if target and target["type"] != "alias":
+                info.update(type=target["type"], searchable=target["searchable"],
+                            aggregatable=target["aggregatable"])
+
+
+class MappingCache:
+    """按具体索引缓存展开后的字段映射"""
+
+    def __init__(self, ttl: float = None):
+        self.ttl = ttl if ttl is not None else float(os.getenv("EASYSEARCH_MAPPING_CACHE_TTL", "300"))
+        self._lock = threading.Lock()
+        self._indices = {}      # 具体索引 -> (过期时间, 字段表指纹)
+        self._tables = {}       # 字段表指纹 -> {字段: 信息}（映射相同的索引共享）
+        self._expressions = {}  # 索引表达式 -> (过期时间, [具体索引])
+        self._merged = {}       # frozenset(字段表对象 id) -> 合并后的字段信息（只读共享）
+
+    def _lookup(self, index: str, now: float):
+        """从缓存解析表达式，任一索引过期或未知时返回 None"""
+        entry = self._expressions.get(index)
+        if not entry or entry[0] <= now:
+            return None
+        result = {}
+        for name in entry[1]:
+            cached = self._indices.get(name)
+            if not cached or cached[0] <= now:
+                return None
+            result[name] = self._tables[cached[1]]
+        return result
+
+    def get(self, index: str) -> dict:
+        """获取索引表达式（支持通配符/逗号）匹配的各具体索引的字段信息"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._lookup(index, now)
+            if cached is not None:
+                return cached
+
+        result = get_client().get(f"/{index}/_mapping")
+        per_index = {}
+        created = False
+        with self._lock:
+            for name, body in result.items():
+                mappings = body.get("mappings", {})
+                # 兼容带 type 名称的旧版映射
+                if "properties" not in mappings and len(mappings) == 1:
+                    mappings = next(iter(mappings.values()))
+                fingerprint = json.dumps(mappings.get("properties", {}), sort_keys=True)
+                if fingerprint not in self._tables:
+                    fields = {}
+                    _flatten_properties(mappings.get("properties", {}), "", fields)
+                    _resolve_aliases(fields)
+                    self._tables[fingerprint] = fields
+                    created = True
+                self._indices[name] = (now + self.ttl, fingerprint)
+                per_index[name] = self._tables[fingerprint]
+            self._expressions[index] = (now + self.ttl, list(per_index))
+            if created:
+                self._prune()
+        return per_index
+
+    def fields(self, index: str) -> dict:
+        """合并各具体索引的字段信息，类型冲突时记录 conflicts"""
+        per_index = self.get(index)
+        key = frozenset(id(fields) for fields in per_index.values())
+        with self._lock:
+            merged = self._merged.get(key)
+        if merged is not None:
+            return merged
+        merged = {}
+        # 共享的字段表只合并一次
+        for fields in {id(f): f for f in per_index.values()}.values():
+            for path, info in fields.items():
+                current = merged.get(path)
+                if current is None:
+                    merged[path] = dict(info)
+                elif current["type"] != info["type"]:
+                    conflicts = current.setdefault("conflicts", [current["type"]])
+                    if info["type"] not in conflicts:
+                        conflicts.append(info["type"])
+        with self._lock:
+            self._merged[key] = merged
+        return merged
+
+    def field_type(self, index: str, field: str) -> Any:
+        """获取字段类型，未知字段返回 None"""
+        info = self.fields(index).get(field)
+        return info["type"] if info else None
+
+    def invalidate(self, index: str = None):
+        """清除缓存（映射变更后调用）"""
+        with self._lock:
+            if index is None:
+                self._indices.clear()
+                self._tables.clear()
+                self._expressions.clear()
+                self._merged.clear()
+                return
+            patterns = index.split(",")
+            stale = {name for name in self._indices if any(fnmatch.fnmatchcase(name, p) for p in patterns)}
+            for name in stale:
+                del self._indices[name]
+            for key in list(self._expressions):
+                if key == index or stale & set(self._expressions[key][1]) \
+                        or any(fnmatch.fnmatchcase(p, key) for p in patterns):
+                    del self._expressions[key]
+            self._prune()
+
+    def _prune(self):
+        """清理不再被引用的字段表；合并结果以字段表对象为键，一并清除"""
+        used = {fingerprint for _, fingerprint in self._indices.values()}
+        for fingerprint in list(self._tables):
+            if fingerprint not in used:
+                del self._tables[fingerprint]
+        self._merged.clear()
+
+
+# 全局缓存实例
+_cache = None
+
+
+def get_mapping_cache() -> MappingCache:
+    """获取全局映射缓存实例"""
+    global _cache
+    if _cache is None:
+        _cache = MappingCache()
+    return _cache
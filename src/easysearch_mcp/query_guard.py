@@ -0,0 +1,259 @@
+"""
+查询成本评估与保护
+
+在执行前遍历查询 DSL，结合缓存的映射估算成本（前导通配符、脚本、
+text/keyword 误用、深分页、大 size、无界 terms 聚合等），超出预算时
+按配置拒绝、改写或限流
+
+环境变量:
+    EASYSEARCH_QUERY_GUARD: off/warn/reject/rewrite/throttle（默认 off）。
+        开启后每次搜索/聚合前都会估算成本，每个索引表达式在映射缓存过期后需要重新获取一次映射
+    EASYSEARCH_QUERY_BUDGET: 成本预算（默认 100）
+    EASYSEARCH_QUERY_THROTTLE: throttle 模式下超预算查询的并发上限（默认 1）
+"""
+
+import copy
+import os
+import re
+import threading
+from contextlib import contextmanager
+from typing import Generator
+from .mappings import get_mapping_cache
+
+GUARD_MODES = ("off", "warn", "reject", "rewrite", "throttle")
+
+# 以 {类型: {字段: 参数}} 形式出现的叶子查询
+FIELD_QUERIES = {
+    "term", "terms", "match", "match_phrase", "match_phrase_prefix", "match_bool_prefix",
+    "prefix", "wildcard", "regexp", "fuzzy", "range"
+}
+# 对 text 字段做精确匹配通常是误用
+EXACT_QUERIES = {"term", "terms", "prefix", "wildcard", "regexp", "fuzzy", "range"}
+
+LEADING_WILDCARD = re.compile(r"(^|[\s:(\"])[*?]")
+MAX_RESULT_WINDOW = 10000
+REWRITE_MAX_SIZE = 1000
+REWRITE_MAX_BUCKETS = 1000
+
+_throttle = None
+_throttle_lock = threading.Lock()
+
+
+def guard_mode() -> str:
+    """当前保护模式"""
+    mode = os.getenv("EASYSEARCH_QUERY_GUARD", "off")
+    return mode if mode in GUARD_MODES else "off"
+
+
+def query_budget() -> float:
+    """当前成本预算"""
+    return float(os.getenv("EASYSEARCH_QUERY_BUDGET", "100"))
+
+
+class _Estimate:
+    """成本明细累加器"""
+
+    def __init__(self, fields: dict):
+        self.fields = fields
+        self.cost = 1.0
+        self.items = []
+
+    def add(self, cost: float, reason: str, path: str):
+        self.cost += cost
+        self.items.append({"cost": round(cost, 1), "reason": reason, "path": path})
+
+    def field_type(self, field: str):
+        info = self.fields.get(field)
+        return info["type"] if info else None
+
+
+def _field_of(params) -> tuple:
+    """取出叶子查询的字段名和参数"""
+    if not isinstance(params, dict):
+        return None, None
+    for key, value in params.items():
+        if key not in ("boost", "_name", "boost_mode", "score_mode"):
+            return key, value
+    return None, None
+
+
+def _walk_query(query, path: str, est: _Estimate):
+    """递归遍历查询 DSL 累加成本"""
+    if isinstance(query, list):
+        for i, item in enumerate(query):
+            _walk_query(item, f"{path}[{i}]", est)
+        return
+    if not isinstance(query, dict):
+        return
+    for qtype, params in query.items():
+        here = f"{path}.{qtype}" if path else qtype
+        if qtype in FIELD_QUERIES:
+            field, value = _field_of(params)
+            field_type = est.field_type(field)
+            if qtype in ("wildcard", "regexp", "prefix"):
+                pattern = value.get("value", value.get(qtype, "")) if isinstance(value, dict) else value
+                pattern = str(pattern)
+                if qtype == "wildcard" and pattern[:1] in ("*", "?"):
+                    est.add(100, f"前导通配符 wildcard 需要遍历整个词典: {field}", here)
+                elif qtype == "regexp" and pattern.startswith(".*"):
+                    est.add(100, f"以 .* 开头的正则需要遍历整个词典: {field}", here)
+                else:
+                    est.add(10, f"{qtype} 查询需要展开多个词项: {field}", here)
+            elif qtype == "fuzzy":
+                est.add(5, f"fuzzy 查询需要展开编辑距离内的词项: {field}", here)
+            if field_type == "text" and qtype in EXACT_QUERIES:
+                est.add(10, f"{qtype} 作用于 text 字段 {field}（已分词），应使用 {field}.keyword 或 match", here)
+            if field and field_type is None and est.fields:
+                est.add(2, f"字段 {field} 不在映射中", here)
+        elif qtype == "query_string" or qtype == "simple_query_string":
+            text = str(params.get("query", "")) if isinstance(params, dict) else ""
+            if LEADING_WILDCARD.search(text):
+                est.add(100, "query_string 包含前导通配符", here)
+            elif "*" in text or "?" in text or "~" in text:
+                est.add(10, "query_string 包含通配符或模糊匹配", here)
+            if isinstance(params, dict) and not (params.get("default_field") or params.get("fields")):
+                est.add(5, "query_string 未指定字段，将搜索全部字段", here)
+        elif qtype in ("script", "script_score"):
+            est.add(30, f"{qtype} 需要对每个候选文档执行脚本", here)
+            if isinstance(params, dict) and "query" in params:
+                _walk_query(params["query"], here, est)
+        elif qtype in ("nested", "has_child", "has_parent"):
+            est.add(5, f"{qtype} 需要关联查询", here)
+            _walk_query(params, here, est)
+        elif isinstance(params, (dict, list)):
+            # bool/function_score/dis_max/constant_score 等复合查询
+            _walk_query(params, here, est)
+
+
+def _walk_aggs(aggs: dict, path: str, multiplier: int, est: _Estimate):
+    """递归遍历聚合定义，multiplier 为上层桶数乘积"""
+    for name, agg in (aggs or {}).items():
+        if not isinstance(agg, dict):
+            continue
+        here = f"{path}.{name}" if path else name
+        buckets = 1
+        for atype, params in agg.items():
+            if atype in ("aggs", "aggregations") or not isinstance(params, dict):
+                continue
+            field = params.get("field")
+            if est.field_type(field) == "text":
+                info = est.fields.get(field, {})
+                if not info.get("aggregatable"):
+                    est.add(50, f"{atype} 聚合作用于 text 字段 {field}（需要 fielddata），应使用 {field}.keyword", here)
+            if "script" in params:
+                est.add(20, f"{atype} 聚合使用脚本", here)
+            if atype in ("terms", "multi_terms", "significant_terms", "rare_terms"):
+                buckets = int(params.get("size", 10))
+                total = buckets * multiplier
+                if total > REWRITE_MAX_BUCKETS:
+                    est.add(total / 100, f"terms 聚合最多产生 {total} 个桶（含上层桶数乘积）", here)
+            elif atype == "composite":
+                buckets = int(params.get("size", 10))
+            elif atype == "top_hits" and int(params.get("size", 3)) * multiplier > REWRITE_MAX_SIZE:
+                est.add(int(params.get("size", 3)) * multiplier / 100, "top_hits 返回大量文档", here)
+        _walk_aggs(agg.get("aggs") or agg.get("aggregations"), here, multiplier * max(buckets, 1), est)
+
+
+def estimate_cost(index: str, body: dict) -> dict:
+    """估算搜索请求的成本，返回总分和明细"""
+    try:
+        fields = get_mapping_cache().fields(index)
+    except Exception:
+        fields = {}
+    est = _Estimate(fields)
+    size = int(body.get("size", 10))
+    from_ = int(body.get("from", 0))
+    if from_ + size > MAX_RESULT_WINDOW:
+        est.add(100, f"from + size = {from_ + size} 超过 {MAX_RESULT_WINDOW}，应改用 search_after/scroll", "from")
+    elif from_ > 1000:
+        est.add(from_ / 200, f"深分页 from={from_}，每个分片需要排序 from + size 条", "from")
+    if size > REWRITE_MAX_SIZE:
+        est.add(size / 200, f"size={size} 返回大量文档", "size")
+    for i, clause in enumerate(body.get("sort") or []):
+        field = clause if isinstance(clause, str) else next(iter(clause), None)
+        if field == "_script":
+            est.add(30, "脚本排序", f"sort[{i}]")
+        elif est.field_type(field) == "text" and not est.fields.get(field, {}).get("aggregatable"):
+            est.add(50, f"对 text 字段 {field} 排序（需要 fielddata），应使用 {field}.keyword", f"sort[{i}]")
+    _walk_query(body.get("query"), "query", est)
+    _walk_aggs(body.get("aggs") or body.get("aggregations"), "aggs", 1, est)
+    if "script_fields" in body:
+        est.add(10, "script_fields 需要对每个返回文档执行脚本", "script_fields")
+    budget = query_budget()
+    return {
+        "cost": round(est.cost, 1),
+        "budget": budget,
+        "over_budget": est.cost > budget,
+        "breakdown": sorted(est.items, key=lambda i: i["cost"], reverse=True)
+    }
+
+
+def _cap_terms(aggs: dict, changes: list, path: str = "aggs"):
+    """限制 terms 类聚合的桶数"""
+    for name, agg in (aggs or {}).items():
+        if not isinstance(agg, dict):
+            continue
+        for atype in ("terms", "multi_terms", "significant_terms"):
+            params = agg.get(atype)
+            if isinstance(params, dict) and int(params.get("size", 10)) > REWRITE_MAX_BUCKETS:
+                changes.append(f"{path}.{name}.{atype}.size: {params['size']} -> {REWRITE_MAX_BUCKETS}")
+                params["size"] = REWRITE_MAX_BUCKETS
+        _cap_terms(agg.get("aggs") or agg.get("aggregations"), changes, f"{path}.{name}")
+
+
+def rewrite_body(body: dict) -> tuple:
+    """对超预算请求做安全改写（限制 size、深分页和 terms 桶数），返回 (新 body, 改动列表)"""
+    body = copy.deepcopy(body)
+    changes = []
+    if int(body.get("size", 10)) > REWRITE_MAX_SIZE:
+        changes.append(f"size: {body['size']} -> {REWRITE_MAX_SIZE}")
+        body["size"] = REWRITE_MAX_SIZE
+    if int(body.get("from", 0)) + int(body.get("size", 10)) > MAX_RESULT_WINDOW:
+        new_from = MAX_RESULT_WINDOW - int(body.get("size", 10))
+        changes.append(f"from: {body['from']} -> {new_from}")
+        body["from"] = new_from
+    _cap_terms(body.get("aggs") or body.get("aggregations"), changes)
+    return body, changes
+
+
+def _semaphore() -> threading.BoundedSemaphore:
+    """throttle 模式使用的全局信号量"""
+    global _throttle
+    with _throttle_lock:
+        if _throttle is None:
+            _throttle = threading.BoundedSemaphore(int(os.getenv("EASYSEARCH_QUERY_THROTTLE", "1")))
+        return _throttle
+
+
+@contextmanager
+def guard(index: str, body: dict) -> Generator[tuple, None, None]:
+    """
+    执行前检查请求成本，产出 (实际执行的 body, 成本报告)
+
+    reject 模式下超预算抛出 ValueError；rewrite 模式改写后仍超预算也会拒绝；
+    throttle 模式下超预算的请求排队执行
+    """
+    mode = guard_mode()
+    if mode == "off":
+        yield body, None
+        return
+    report = estimate_cost(index, body)
+    if not report["over_budget"]:
+        yield body, None
+        return
+    report["mode"] = mode
+    if mode == "reject":
+        raise ValueError(f"查询成本 {report['cost']} 超过预算 {report['budget']}: {report['breakdown']}")
+    if mode == "rewrite":
+        body, changes = rewrite_body(body)
+        report["rewrites"] = changes
+        after = estimate_cost(index, body)
+        report["cost_after_rewrite"] = after["cost"]
+        if after["over_budget"]:
+            raise ValueError(
+                f"查询成本 {after['cost']} 改写后仍超过预算 {after['budget']}: {after['breakdown']}")
+    if mode == "throttle":
+        with _semaphore():
+            yield body, report
+        return
+    yield body, report
@@ -0,0 +1,147 @@
+"""
+基于映射的查询改写
+
+结合缓存的映射对查询 DSL 做等价或近似等价的优化：
+- 不影响评分的子句从 must 移到 filter（可缓存、跳过评分）
+- keyword/数值/日期等精确字段上的 match 改为 term
+- 无法改写的问题（text 字段上的 term、未索引字段上的 range、未知字段）仅标记
+"""
+
+import copy
+from .mappings import get_mapping_cache
+
+# 不分词的字段类型，match 等价于 term
+EXACT_TYPES = {
+    "keyword", "constant_keyword", "long", "integer", "short", "byte", "double", "float",
+    "half_float", "scaled_float", "unsigned_long", "date", "date_nanos", "boolean", "ip", "version"
+}
+# 本身就是常数评分的查询，移入 filter 不改变结果排序
+CONSTANT_SCORE_QUERIES = {"range", "exists", "ids"}
+# 评分无关时可以移入 filter 的查询
+FILTER_QUERIES = CONSTANT_SCORE_QUERIES | {"term", "terms", "prefix", "wildcard", "regexp", "geo_distance",
+                                            "geo_bounding_box", "geo_shape", "match_none", "match_all"}
+MATCH_OPTIONS = {"query", "boost", "_name"}
+
+
+class _Context:
+    """改写过程中的映射和改写记录"""
+
+    def __init__(self, fields: dict):
+        self.fields = fields
+        self.changes = []
+        self.flags = []
+
+    def field(self, name: str) -> dict:
+        """字段信息，未知字段返回 None"""
+        return self.fields.get(name)
+
+
+def _leaf(params) -> tuple:
+    """取出叶子查询的字段名和参数"""
+    if not isinstance(params, dict):
+        return None, None
+    for key, value in params.items():
+        if key not in ("boost", "_name"):
+            return key, value
+    return None, None
+
+
+def _as_list(clauses) -> list:
+    """bool 子句可以是单个对象或列表"""
+    if clauses is None:
+        return []
+    return clauses if isinstance(clauses, list) else [clauses]
+
+
+def _rewrite(query, path: str, scoring: bool, ctx: _Context):
+    """递归改写查询，scoring 表示当前位置的评分是否影响结果"""
+    if not isinstance(query, dict) or len(query) != 1:
+        return query
+    qtype, params = next(iter(query.items()))
+    here = f"{path}.{qtype}"
+
+    if qtype == "bool" and isinstance(params, dict):
+        new = dict(params)
+        for occur in ("must", "should", "filter", "must_not"):
+            if occur in params:
+                occur_scoring = scoring and occur in ("must", "should")
+                new[occur] = [_rewrite(c, f"{here}.{occur}[{i}]", occur_scoring, ctx)
+                              for i, c in enumerate(_as_list(params[occur]))]
+        keep, move = [], []
+        for clause in new.get("must", []):
+            ctype = next(iter(clause), None) if isinstance(clause, dict) else None
+            movable = ctype in CONSTANT_SCORE_QUERIES if scoring else ctype in FILTER_QUERIES | {"bool"}
+            (move if movable else keep).append(clause)
+        if move:
+            ctx.changes.append(f"{here}: {len(move)} 个 must 子句移入 filter（{', '.join(next(iter(c)) for c in move)}）")
+            new["filter"] = new.get("filter", []) + move
+            if keep:
+                new["must"] = keep
+            else:
+                new.pop("must")
+        return {"bool": new}
+
+    if qtype == "constant_score" and isinstance(params, dict):
+        return {qtype: dict(params, filter=_rewrite(params.get("filter"), f"{here}.filter", False, ctx))}
+    if qtype in ("nested", "has_child", "has_parent", "function_score", "script_score") \
+            and isinstance(params, dict) and "query" in params:
+        inner_scoring = scoring and params.get("score_mode") != "none"
+        return {qtype: dict(params, query=_rewrite(params["query"], f"{here}.query", inner_scoring, ctx))}
+    if qtype == "dis_max" and isinstance(params, dict):
+        queries = [_rewrite(q, f"{here}.queries[{i}]", scoring, ctx)
+                   for i, q in enumerate(params.get("queries", []))]
+        return {qtype: dict(params, queries=queries)}
+
+    field, value = _leaf(params)
+    if field is None:
+        return query
+    info = ctx.field(field)
+    if info is None:
+        if ctx.fields and qtype not in ("ids", "exists", "match_all", "match_none"):
+            ctx.flags.append(f"{here}: 字段 {field} 不在映射中")
+        return query
+
+    if qtype in ("match", "match_phrase") and info["type"] in EXACT_TYPES:
+        options = value if isinstance(value, dict) else {"query": value}
+        if set(options) <= MATCH_OPTIONS:
+            term = dict(options)
+            term["value"] = term.pop("query")
+            ctx.changes.append(f"{here}: {info['type']} 字段 {field} 上的 {qtype} 改为 term")
+            return {"term": {field: term if len(term) > 1 else term["value"]}}
+        ctx.flags.append(f"{here}: {field} 是 {info['type']} 字段，但 {qtype} 带有额外参数，未改写为 term")
+    elif qtype in ("term", "terms", "prefix", "wildcard", "regexp") and info["type"] == "text":
+        keyword = next((f"{field}.{sub}" for sub in ("keyword", "raw")
+                        if (ctx.field(f"{field}.{sub}") or {}).get("type") == "keyword"), None)
+        hint = f"，精确匹配应使用 {keyword}" if keyword else ""
+        ctx.flags.append(f"{here}: {qtype} 作用于已分词的 text 字段 {field}，结果可能不符合预期{hint}（语义不同，未自动改写）")
+    elif qtype == "range" and not info.get("searchable", True):
+        ctx.flags.append(f"{here}: 字段 {field} 未建立索引（index: false），range 只能扫描 doc_values 或直接失败，无法通过改写优化")
+    return query
+
+
+def rewrite_query(index: str, query: dict, scoring: bool = True) -> dict:
+    """
+    改写查询，返回 {"query": 新查询, "changes": [...], "flags": [...]}
+
+    scoring 为 False（计数、聚合、按非 _score 字段排序）时，所有可过滤子句都会移入 filter；
+    否则只移动本身就是常数评分的子句（range/exists/ids），保证排序不变
+    """
+    try:
+        fields = get_mapping_cache().fields(index)
+    except Exception:
+        fields = {}
+    ctx = _Context(fields)
+    new = _rewrite(copy.deepcopy(query), "query", scoring, ctx)
+    if not scoring and isinstance(new, dict) and next(iter(new), None) in FILTER_QUERIES - {"match_all"}:
+        ctx.changes.append(f"query: 顶层 {next(iter(new))} 包装为 bool.filter（跳过评分并可缓存）")
+        new = {"bool": {"filter": [new]}}
+    return {"query": new, "changes": ctx.changes, "flags": ctx.flags}
+
+
+def scoring_matters(size: int, sort: list = None) -> bool:
+    """判断评分是否影响搜索结果"""
+    if not size:
+        return False
+    if not sort:
+        return True
+    return any((c if isinstance(c, str) else next(iter(c), None)) == "_score" for c in sort)
@@ -0,0 +1,287 @@
+"""
+基于映射的本地查询校验
+
+用缓存的字段索引检查查询 DSL、聚合和排序中引用的字段：
+字段是否存在（给出相近字段或 .keyword 建议）、查询/聚合类型与字段类型是否匹配、
+nested 字段是否在 nested 上下文中使用、数值/布尔字段上的取值是否合法。
+不访问集群（映射已缓存时）
+"""
+
+import difflib
+import fnmatch
+from .mappings import get_mapping_cache
+
+NUMERIC_TYPES = {"long", "integer", "short", "byte", "double", "float", "half_float",
+                 "scaled_float", "unsigned_long"}
+DATE_TYPES = {"date", "date_nanos"}
+TEXT_TYPES = {"text", "match_only_text", "search_as_you_type"}
+GEO_TYPES = {"geo_point", "geo_shape"}
+CONTAINER_TYPES = {"object", "nested"}
+META_FIELDS = {"_id", "_index", "_routing", "_score", "_doc", "_seq_no", "_primary_term",
+               "_type", "_ignored", "_tier", "_source", "_version"}
+
+# 以 {类型: {字段: 参数}} 形式出现的叶子查询
+TERM_QUERIES = {"term", "terms", "terms_set"}
+PATTERN_QUERIES = {"prefix", "wildcard", "regexp", "fuzzy"}
+MATCH_QUERIES = {"match", "match_phrase", "match_phrase_prefix", "match_bool_prefix"}
+GEO_QUERIES = {"geo_distance", "geo_bounding_box", "geo_polygon", "geo_shape"}
+# 叶子查询中不是字段名的参数
+QUERY_OPTIONS = {"boost", "_name", "distance", "distance_type", "validation_method", "ignore_unmapped",
+                 "type", "minimum_should_match_field", "minimum_should_match_script"}
+# 只有一个 query 子查询的复合查询
+WRAPPER_QUERIES = {"constant_score": "filter", "function_score": "query", "script_score": "query",
+                   "boosting": None, "dis_max": None}
+
+METRIC_AGGS = {"avg", "sum", "min", "max", "stats", "extended_stats", "percentiles",
+               "percentile_ranks", "median_absolute_deviation"}
+EXACT_AGGS = {"terms", "significant_terms", "rare_terms", "cardinality", "value_count", "top_metrics"}
+
+
+class _Validator:
+    """校验过程中的映射和问题记录"""
+
+    def __init__(self, fields: dict):
+        self.fields = fields
+        self.nested_paths = sorted((p for p, f in fields.items() if f["type"] == "nested"),
+                                   key=len, reverse=True)
+        self.errors = []
+        self.warnings = []
+        self.checked = set()
+
+    def report(self, level: str, path: str, field: str, message: str, suggestion=None):
+        entry = {"path": path, "field": field, "message": message}
+        if suggestion:
+            entry["suggestion"] = suggestion
+        (self.errors if level == "error" else self.warnings).append(entry)
+
+    def suggest(self, field: str):
+        """相近字段建议：优先 .keyword 子字段，其次按名称相似度"""
+        for sub in ("keyword", "raw"):
+            candidate = f"{field}.{sub}"
+            if (self.fields.get(candidate) or {}).get("aggregatable"):
+                return [candidate]
+        matches = difflib.get_close_matches(field, [f for f in self.fields if f != field], n=3, cutoff=0.6)
+        return matches or None
+
+    def nested_parent(self, field: str):
+        return next((p for p in self.nested_paths if field.startswith(f"{p}.")), None)
+
+    def field(self, field, path: str, nested: str):
+        """检查字段是否存在及 nested 上下文，返回字段信息（未知或通配符时为 None）"""
+        if not isinstance(field, str) or field in META_FIELDS or not self.fields:
+            return None
+        self.checked.add(field)
+        if "*" in field:
+            if not any(fnmatch.fnmatchcase(f, field) for f in self.fields):
+                self.report("warning", path, field, "通配符没有匹配到任何字段")
+            return None
+        info = self.fields.get(field)
+        if info is None:
+            self.report("error", path, field, "字段不在映射中", self.suggest(field))
+            return None
+        parent = self.nested_parent(field)
+        if parent and not (nested and (parent == nested or parent.startswith(f"{nested}."))):
+            self.report("error", path, field, f"字段位于 nested 路径 {parent} 下，需要包在 nested 查询/聚合中")
+        if info.get("conflicts"):
+            self.report("warning", path, field, f"字段在不同索引中类型不一致: {', '.join(info['conflicts'])}")
+        return info
+
+
+def _leaf(params):
+    """取出叶子查询的字段名和参数"""
+    if not isinstance(params, dict):
+        return None, None
+    for key, value in params.items():
+        if key not in QUERY_OPTIONS:
+            return key, value
+    return None, None
+
+
+def _values(qtype: str, value) -> list:
+    """term/terms/range 中需要按字段类型检查的取值"""
+    if qtype == "terms":
+        return value if isinstance(value, list) else []
+    if qtype == "range" and isinstance(value, dict):
+        return [value[k] for k in ("gt", "gte", "lt", "lte", "from", "to") if value.get(k) is not None]
+    if isinstance(value, dict):
+        value = value.get("value", value.get("query"))
+    return [value] if value is not None else []
+
+
+def _check_values(v: _Validator, qtype: str, value, info: dict, path: str, field: str):
+    """数值和布尔字段上的取值是否可解析"""
+    for item in _values(qtype, value):
+        if info["type"] in NUMERIC_TYPES and isinstance(item, str):
+            try:
+                float(item)
+            except ValueError:
+                v.report("error", path, field, f"{info['type']} 字段无法解析取值 {item!r}")
+        elif info["type"] == "boolean" and str(item).lower() not in ("true", "false"):
+            v.report("error", path, field, f"boolean 字段无法解析取值 {item!r}")
+
+
+def _walk_query(v: _Validator, query, path: str, nested: str):
+    """递归校验查询 DSL"""
+    if isinstance(query, list):
+        for i, item in enumerate(query):
+            _walk_query(v, item, f"{path}[{i}]", nested)
+        return
+    if not isinstance(query, dict):
+        return
+    for qtype, params in query.items():
+        here = f"{path}.{qtype}"
+        if qtype == "bool" and isinstance(params, dict):
+            for occur in ("must", "should", "filter", "must_not"):
+                if occur in params:
+                    _walk_query(v, params[occur], f"{here}.{occur}", nested)
+        elif qtype == "nested" and isinstance(params, dict):
+            nested_path = params.get("path")
+            info = v.fields.get(nested_path)
+            if v.fields and (info is None or info["type"] != "nested"):
+                v.report("error", here, nested_path, "nested 查询的 path 必须是 nested 类型字段",
+                         v.nested_paths or None)
+            _walk_query(v, params.get("query"), f"{here}.query", nested_path)
+        elif qtype in ("has_child", "has_parent"):
+            continue  # 子/父文档的字段属于关联类型，不在此检查
+        elif qtype in WRAPPER_QUERIES and isinstance(params, dict):
+            for key in ("query", "filter", "positive", "negative", "queries"):
+                if key in params:
+                    _walk_query(v, params[key], f"{here}.{key}", nested)
+        elif qtype in ("multi_match", "query_string", "simple_query_string") and isinstance(params, dict):
+            names = list(params.get("fields") or [])
+            if params.get("default_field"):
+                names.append(params["default_field"])
+            for name in names:
+                v.field(str(name).split("^")[0], here, nested)
+        elif qtype == "exists" and isinstance(params, dict):
+            field = params.get("field")
+            if v.fields and isinstance(field, str) and "*" not in field and field not in v.fields:
+                v.checked.add(field)
+                v.report("warning", here, field, "字段不在映射中，exists 不会匹配任何文档", v.suggest(field))
+        elif qtype in TERM_QUERIES | PATTERN_QUERIES | MATCH_QUERIES | GEO_QUERIES | {"range"}:
+            field, value = _leaf(params)
+            info = v.field(field, here, nested)
+            if info is None:
+                continue
+            ftype = info["type"]
+            if ftype in CONTAINER_TYPES:
+                v.report("error", here, field, f"{ftype} 字段不能直接查询，应指定其子字段")
+            elif qtype in GEO_QUERIES and ftype not in GEO_TYPES:
+                v.report("error", here, field, f"{qtype} 需要 geo_point/geo_shape 字段，实际为 {ftype}")
+            elif qtype in TERM_QUERIES and ftype in TEXT_TYPES:
+                v.report("warning", here, field, f"{qtype} 作用于已分词的 {ftype} 字段，精确匹配通常不会命中",
+                         v.suggest(field))
+            elif qtype in PATTERN_QUERIES and (ftype in NUMERIC_TYPES | DATE_TYPES or ftype == "boolean"):
+                v.report("error", here, field, f"{qtype} 只支持字符串字段，实际为 {ftype}")
+            elif qtype in PATTERN_QUERIES and ftype in TEXT_TYPES:
+                v.report("warning", here, field, f"{qtype} 在 {ftype} 字段上按分词后的词项匹配", v.suggest(field))
+            elif qtype == "range" and ftype in TEXT_TYPES | {"boolean"} | GEO_TYPES:
+                v.report("error" if ftype != "text" else "warning", here, field,
+                         f"range 不适用于 {ftype} 字段", v.suggest(field) if ftype in TEXT_TYPES else None)
+            elif qtype == "range" and ftype in ("keyword", "constant_keyword", "wildcard"):
+                v.report("warning", here, field, "keyword 字段上的 range 按字典序比较")
+            elif qtype in ("match_phrase", "match_phrase_prefix") and ftype not in TEXT_TYPES:
+                v.report("warning", here, field, f"{qtype} 只对 text 字段有意义，{ftype} 字段上等价于 term")
+            if not info.get("searchable", True) and ftype not in CONTAINER_TYPES:
+                v.report("warning", here, field, "字段未建立索引（index: false），查询只能依赖 doc_values 或失败")
+            if qtype in TERM_QUERIES | {"range"}:
+                _check_values(v, qtype, value, info, here, field)
+
+
+def _agg_field(v: _Validator, atype: str, params: dict, path: str, nested: str):
+    """校验单个聚合的字段"""
+    field = params.get("field")
+    if field is None:
+        return
+    info = v.field(field, path, nested)
+    if info is None:
+        return
+    ftype = info["type"]
+    if atype == "significant_text":
+        # 从 _source 重新分词，不依赖 doc_values
+        if nested:
+            v.report("error", path, field, "significant_text 不支持 nested 字段")
+        elif ftype not in TEXT_TYPES | {"keyword"} and not params.get("source_fields"):
+            v.report("error", path, field, f"significant_text 需要 text 字段，实际为 {ftype}")
+        elif not info.get("searchable", True):
+            v.report("error", path, field, "significant_text 的字段必须建立索引（index: false）")
+    elif atype in METRIC_AGGS | {"histogram", "range"} and ftype not in NUMERIC_TYPES | DATE_TYPES:
+        v.report("error", path, field, f"{atype} 聚合需要数值字段，实际为 {ftype}")
+    elif atype in ("date_histogram", "auto_date_histogram", "date_range") and ftype not in DATE_TYPES:
+        v.report("error", path, field, f"{atype} 聚合需要 date 字段，实际为 {ftype}")
+    elif atype.startswith("geo") and ftype not in GEO_TYPES:
+        v.report("error", path, field, f"{atype} 聚合需要 geo 字段，实际为 {ftype}")
+    elif not info.get("aggregatable"):
+        v.report("error", path, field, f"{ftype} 字段不可聚合（无 doc_values）", v.suggest(field))
+
+
+def _walk_aggs(v: _Validator, aggs, path: str, nested: str):
+    """递归校验聚合定义"""
+    for name, agg in (aggs or {}).items():
+        if not isinstance(agg, dict):
+            continue
+        here = f"{path}.{name}"
+        inner_nested = nested
+        for atype, params in agg.items():
+            if atype in ("aggs", "aggregations", "meta") or not isinstance(params, dict):
+                continue
+            if atype == "nested":
+                inner_nested = params.get("path")
+                info = v.fields.get(inner_nested)
+                if v.fields and (info is None or info["type"] != "nested"):
+                    v.report("error", here, inner_nested, "nested 聚合的 path 必须是 nested 类型字段",
+                             v.nested_paths or None)
+            elif atype == "reverse_nested":
+                inner_nested = params.get("path")
+            elif atype == "filter":
+                _walk_query(v, params, f"{here}.filter", nested)
+            elif atype == "filters":
+                filters = params.get("filters", {})
+                items = filters.items() if isinstance(filters, dict) else enumerate(filters)
+                for key, query in items:
+                    _walk_query(v, query, f"{here}.filters.{key}", nested)
+            elif atype == "composite":
+                for i, source in enumerate(params.get("sources", [])):
+                    for source_name, spec in source.items():
+                        for stype, sparams in spec.items():
+                            if isinstance(sparams, dict):
+                                _agg_field(v, stype, sparams, f"{here}.sources[{i}].{source_name}", nested)
+            else:
+                _agg_field(v, atype, params, here, nested)
+                if atype == "significant_text" and (agg.get("aggs") or agg.get("aggregations")):
+                    v.report("error", here, params.get("field"), "significant_text 不支持子聚合")
+        _walk_aggs(v, agg.get("aggs") or agg.get("aggregations"), here, inner_nested)
+
+
+def _walk_sort(v: _Validator, sort):
+    """校验排序字段"""
+    for i, clause in enumerate(sort if isinstance(sort, list) else [sort]):
+        field = clause if isinstance(clause, str) else next(iter(clause), None) if isinstance(clause, dict) else None
+        if field is None or field.startswith("_"):
+            continue
+        options = clause.get(field) if isinstance(clause, dict) else None
+        nested = None
+        if isinstance(options, dict):
+            nested = (options.get("nested") or {}).get("path") or options.get("nested_path")
+        here = f"sort[{i}]"
+        info = v.field(field, here, nested)
+        if info and not info.get("aggregatable"):
+            v.report("error", here, field, f"{info['type']} 字段不能排序（无 doc_values）", v.suggest(field))
+
+
+def validate(index: str, query: dict = None, aggs: dict = None, sort=None) -> dict:
+    """校验查询、聚合和排序中的字段，返回错误和警告"""
+    fields = get_mapping_cache().fields(index)
+    v = _Validator(fields)
+    if query:
+        _walk_query(v, query, "query", None)
+    if aggs:
+        _walk_aggs(v, aggs, "aggs", None)
+    if sort:
+        _walk_sort(v, sort)
+    return {
+        "valid": not v.errors,
+        "errors": v.errors,
+        "warnings": v.warnings,
+        "fields_checked": sorted(v.checked)
+    }
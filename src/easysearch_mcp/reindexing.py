@@ -0,0 +1,317 @@
+"""
+后台分片并行重建索引
+
+以 wait_for_completion=false 提交带 slices 的 _reindex，避免客户端超时；
+执行期间目标索引进入批量写入模式（见 bulk_mode），
+通过 _tasks 跟踪各 slice 进度并估算速率和剩余时间，
+完成后恢复设置、刷新目标索引，并可原子切换别名。
+每个任务有一个后台线程轮询 _tasks，不再查询进度时也会在任务结束后收尾。
+
+在线迁移（migrate_*）在此基础上按时间戳水位线多轮追平复制期间的写入，
+再原子切换读写别名并做最后一轮追平，全程无需停写
+"""
+
+import threading
+import time
+import uuid
+from . import bulk_mode
+from .client import get_client
+
+_lock = threading.Lock()
+_jobs = {}
+# 后台监视任务完成的轮询间隔（秒）
+WATCH_POLL_S = 10
+
+
+def _sources(source: dict) -> list:
+    """源索引列表"""
+    index = source.get("index") or []
+    return index if isinstance(index, list) else str(index).split(",")
+
+
+def start(source: dict, dest: dict, slices="auto", requests_per_second: float = None,
+          script: dict = None, max_docs: int = None, tune_dest: bool = True,
+          swap_alias: str = None, conflicts: str = None) -> dict:
+    """提交后台 _reindex 并登记任务，返回任务信息"""
+    client = get_client()
+    dest_index = dest.get("index")
+    if not dest_index:
+        raise ValueError("dest 必须包含 index")
+    if swap_alias and not _sources(source):
+        raise ValueError("切换别名需要 source 中指定 index")
+
+    if tune_dest:
+        if not client.head(f"/{dest_index}"):
+            client.put(f"/{dest_index}")
+        # 任务可能运行很久，不设租约：由后台监视在任务结束后恢复，进程退出时也会恢复
+        bulk_mode.enter_bulk(dest_index, lease=0)
+
+    body = {"source": source, "dest": dest}
+    if script:
+        body["script"] = script
+    if max_docs:
+        body["max_docs"] = max_docs
+    if conflicts:
+        body["conflicts"] = conflicts
+    params = {"wait_for_completion": "false", "slices": str(slices)}
+    if requests_per_second:
+        params["requests_per_second"] = str(requests_per_second)
+    try:
+        task = client.post("/_reindex", body, params=params)["task"]
+    except Exception:
+        if tune_dest:
+            bulk_mode.exit_bulk(dest_index, wait_for_green=False)
+        raise
+
+    job_id = uuid.uuid4().hex[:12]
+    with _lock:
+        _jobs[job_id] = {
+            "task": task,
+            "source": _sources(source),
+            "dest": dest_index,
+            "slices": slices,
+            "started": time.time(),
+            "tuned": tune_dest,
+            "swap_alias": swap_alias,
+            "state": "running"
+        }
+    threading.Thread(target=_watch, args=(job_id,), name=f"reindex-{job_id}", daemon=True).start()
+    return {"job_id": job_id, "task": task, "dest": dest_index, "tuned_settings": tune_dest}
+
+
+def _watch(job_id: str):
+    """后台轮询任务直到结束并收尾（恢复目标索引设置、切换别名）；查询失败时下次重试"""
+    job = _jobs[job_id]
+    while job["state"] == "running":
+        time.sleep(WATCH_POLL_S)
+        if job["state"] != "running":
+            return
+        try:
+            progress(job_id)
+        except Exception:
+            continue
+
+
+def _counts(status: dict) -> dict:
+    """任务状态中的计数"""
+    done = sum(status.get(k, 0) for k in ("created", "updated", "deleted", "version_conflicts", "noops"))
+    return {"total": status.get("total", 0), "done": done, "created": status.get("created", 0),
+            "updated": status.get("updated", 0), "version_conflicts": status.get("version_conflicts", 0)}
+
+
+def _finish(job: dict, succeeded: bool) -> dict:
+    """恢复目标索引设置、刷新，成功时切换别名"""
+    client = get_client()
+    steps = {}
+    if job["tuned"]:
+        # 退出批量模式时会一并刷新
+        steps["restored_settings"] = bulk_mode.exit_bulk(job["dest"], wait_for_green=False)["restored"]
+    else:
+        client.post(f"/{job['dest']}/_refresh")
+    if succeeded and job["swap_alias"]:
+        alias = job["swap_alias"]
+        actions = [{"remove": {"index": index, "alias": alias}} for index in job["source"]
+                   if client.head(f"/{index}/_alias/{alias}")]
+        actions.append({"add": {"index": job["dest"], "alias": alias}})
+        client.post("/_aliases", {"actions": actions})
+        steps["alias_swapped"] = {"alias": alias, "from": job["source"], "to": job["dest"]}
+    return steps
+
+
+def progress(job_id: str) -> dict:
+    """查询任务进度；任务结束后执行收尾（只执行一次）"""
+    job = _jobs.get(job_id)
+    if job is None:
+        raise ValueError(f"reindex 任务不存在: {job_id}")
+    result = get_client().get(f"/_tasks/{job['task']}")
+    task = result.get("task", {})
+    status = task.get("status", {})
+    counts = _counts(result.get("response") or status)
+    elapsed = job.get("ended", time.time()) - job["started"]
+    report = {"job_id": job_id, "task": job["task"], "dest": job["dest"],
+              "elapsed_s": round(elapsed, 1), **counts}
+    report["percent"] = round(100 * counts["done"] / counts["total"], 1) if counts["total"] else None
+    rate = counts["done"] / elapsed if elapsed > 0 else 0
+    report["docs_per_s"] = round(rate, 1)
+    if status.get("slices"):
+        report["slices"] = [dict(_counts(s or {}), slice_id=(s or {}).get("slice_id", i))
+                            for i, s in enumerate(status["slices"])]
+    if status.get("throttled_millis"):
+        report["throttled_ms"] = status["throttled_millis"]
+
+    if not result.get("completed"):
+        remaining = counts["total"] - counts["done"]
+        report["eta_s"] = round(remaining / rate, 1) if rate and counts["total"] else None
+        report["state"] = job["state"]
+        return report
+
+    response = result.get("response", {})
+    failures = response.get("failures") or []
+    error = result.get("error")
+    succeeded = not failures and not error and not response.get("canceled")
+    with _lock:
+        finish = job["state"] == "running"
+        if finish:
+            job["state"] = "completed" if succeeded else "failed"
+            job["ended"] = time.time()
+    if finish:
+        job["finished"] = _finish(job, succeeded)
+    report["state"] = job["state"]
+    report.update(job.get("finished", {}))
+    if failures:
+        report["failures"] = failures[:10]
+        report["failure_count"] = len(failures)
+    if error:
+        report["error"] = error
+    return report
+
+
+def cancel(job_id: str) -> dict:
+    """取消任务并恢复目标索引设置"""
+    job = _jobs.get(job_id)
+    if job is None:
+        raise ValueError(f"reindex 任务不存在: {job_id}")
+    get_client().post(f"/_tasks/{job['task']}/_cancel")
+    with _lock:
+        finish = job["state"] == "running"
+        if finish:
+            job["state"] = "canceled"
+            job["ended"] = time.time()
+    if finish:
+        job["finished"] = _finish(job, False)
+    return {"job_id": job_id, "state": job["state"], **job.get("finished", {})}
+
+
+_migrate_lock = threading.Lock()
+_migrations = {}
+
+
+def _max_timestamp(index: str, field: str):
+    """索引中时间戳字段的最大值（epoch 毫秒），无数据时为 None"""
+    result = get_client().post(f"/{index}/_search", {"size": 0, "aggs": {"m": {"max": {"field": field}}}})
+    value = result.get("aggregations", {}).get("m", {}).get("value")
+    return int(value) if value is not None else None
+
+
+def migrate_start(source: str, dest: str, timestamp_field: str, mappings: dict = None,
+                  settings: dict = None, read_alias: str = None, write_alias: str = None,
+                  slices="auto", max_delta_docs: int = 1000, max_passes: int = 5) -> dict:
+    """创建目标索引、记录水位线并开始全量复制"""
+    client = get_client()
+    if not read_alias and not write_alias:
+        raise ValueError("至少需要指定 read_alias 或 write_alias")
+    if client.head(f"/{dest}"):
+        raise ValueError(f"目标索引已存在: {dest}")
+    body = {}
+    if mappings:
+        body["mappings"] = mappings
+    if settings:
+        body["settings"] = settings
+    client.put(f"/{dest}", body or None)
+    # 以源索引中的最大时间戳为水位线（不依赖本机时钟），之后的写入由追平轮次复制
+    watermark = _max_timestamp(source, timestamp_field)
+    # external 版本：复制不会覆盖切换别名后在新索引上产生的更新版本
+    copy = start({"index": source}, {"index": dest, "version_type": "external"}, slices,
+                 conflicts="proceed")
+    job_id = uuid.uuid4().hex[:12]
+    with _migrate_lock:
+        _migrations[job_id] = {
+            "source": source,
+            "dest": dest,
+            "timestamp_field": timestamp_field,
+            "read_alias": read_alias,
+            "write_alias": write_alias,
+            "max_delta_docs": max_delta_docs,
+            "max_passes": max_passes,
+            "phase": "copy",
+            "copy_job": copy["job_id"],
+            "watermark": watermark,
+            "task": None,
+            "passes": [],
+            "started": time.time()
+        }
+    return {"job_id": job_id, "phase": "copy", "dest": dest, "copy_job": copy["job_id"], "watermark": watermark}
+
+
+def _start_pass(job: dict, final: bool):
+    """提交一轮追平：复制时间戳 >= 水位线的文档"""
+    ts = job["timestamp_field"]
+    upper = None if final else _max_timestamp(job["source"], ts)
+    query = {"range": {ts: {"gte": job["watermark"], "format": "epoch_millis"}}} \
+        if job["watermark"] is not None else {"match_all": {}}
+    body = {
+        "source": {"index": job["source"], "query": query},
+        "dest": {"index": job["dest"], "version_type": "external"},
+        "conflicts": "proceed"
+    }
+    job["task"] = get_client().post("/_reindex", body, params={"wait_for_completion": "false"})["task"]
+    job["pending"] = {"from": job["watermark"], "to": upper, "final": final, "started": time.time()}
+
+
+def _swap_aliases(job: dict) -> list:
+    """在一次 _aliases 请求中将读写别名从源索引切到目标索引"""
+    client = get_client()
+    actions = []
+    for alias in dict.fromkeys(a for a in (job["read_alias"], job["write_alias"]) if a):
+        if client.head(f"/{job['source']}/_alias/{alias}"):
+            actions.append({"remove": {"index": job["source"], "alias": alias}})
+        add = {"index": job["dest"], "alias": alias}
+        if alias == job["write_alias"]:
+            add["is_write_index"] = True
+        actions.append({"add": add})
+    client.post("/_aliases", {"actions": actions})
+    return actions
+
+
+def migrate_progress(job_id: str) -> dict:
+    """查看迁移进度并推进到下一阶段（每次调用最多推进一步，不阻塞）"""
+    job = _migrations.get(job_id)
+    if job is None:
+        raise ValueError(f"迁移任务不存在: {job_id}")
+    client = get_client()
+    report = {"job_id": job_id, "source": job["source"], "dest": job["dest"]}
+
+    with _migrate_lock:
+        if job["phase"] == "copy":
+            copy = progress(job["copy_job"])
+            report["copy"] = copy
+            if copy["state"] == "completed":
+                job["phase"] = "catchup"
+                _start_pass(job, final=False)
+            elif copy["state"] != "running":
+                job["phase"] = "failed"
+        elif job["phase"] in ("catchup", "final"):
+            result = client.get(f"/_tasks/{job['task']}")
+            if result.get("completed"):
+                response = result.get("response", {})
+                if response.get("failures") or result.get("error"):
+                    job["phase"] = "failed"
+                    report["failures"] = (response.get("failures") or [])[:10] or result.get("error")
+                else:
+                    pending = job.pop("pending")
+                    copied = response.get("created", 0) + response.get("updated", 0)
+                    job["passes"].append(dict(pending, copied=copied,
+                                              version_conflicts=response.get("version_conflicts", 0),
+                                              took_ms=response.get("took")))
+                    if pending["to"] is not None:
+                        job["watermark"] = pending["to"]
+                    if pending["final"]:
+                        client.post(f"/{job['dest']}/_refresh")
+                        job["phase"] = "completed"
+                    elif copied <= job["max_delta_docs"] or len(job["passes"]) >= job["max_passes"]:
+                        # 增量已足够小：先切换别名让新写入进入目标索引，再追平切换前落在源索引的写入
+                        job["aliases"] = _swap_aliases(job)
+                        job["phase"] = "final"
+                        _start_pass(job, final=True)
+                    else:
+                        _start_pass(job, final=False)
+            else:
+                status = result.get("task", {}).get("status", {})
+                report["current_pass"] = dict(job["pending"], total=status.get("total", 0),
+                                              done=status.get("created", 0) + status.get("updated", 0))
+
+    report.update(phase=job["phase"], watermark=job["watermark"], passes=job["passes"],
+                  elapsed_s=round(time.time() - job["started"], 1))
+    if "aliases" in job:
+        report["aliases"] = job["aliases"]
+    return report
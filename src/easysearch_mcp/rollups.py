@@ -0,0 +1,415 @@
+"""
+客户端物化 Rollup
+
+按固定时间间隔（可选再按若干 keyword 字段分组）增量预聚合可合并的指标
+（sum/min/max/count，avg 由 sum/count 推出），只处理水位线之后已闭合的时间桶。
+重复的 date_histogram 聚合可直接由 rollup 结果加上水位线之后的少量实时数据回答
+
+环境变量:
+    EASYSEARCH_ROLLUP_STORE: rollup 持久化文件路径（可选，不设置则只保存在内存中）
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from .client import get_client
+
+INTERVAL_UNITS = {"ms": 1, "s": 1000, "m": 60000, "h": 3600000, "d": 86400000}
+# 与 UTC 固定间隔等价的 calendar_interval
+CALENDAR_INTERVALS = {"minute": "1m", "1m": "1m", "hour": "1h", "1h": "1h", "day": "1d", "1d": "1d"}
+METRIC_TYPES = ("sum", "min", "max", "avg", "value_count")
+# 可由 rollup 回答的聚合参数，包含其他参数（order/missing/include 等）时交给集群执行
+HISTOGRAM_KEYS = {"field", "fixed_interval", "calendar_interval", "min_doc_count"}
+TERMS_KEYS = {"field", "size"}
+# range 条件中可识别的日期格式
+RANGE_FORMATS = {None, "epoch_millis", "strict_date_optional_time", "date_optional_time"}
+
+_lock = threading.Lock()
+_rollups = None
+
+
+def parse_interval(interval: str) -> int:
+    """解析固定间隔（如 30s/5m/1h/1d）为毫秒"""
+    match = re.fullmatch(r"(\d+)(ms|s|m|h|d)", str(interval).strip())
+    if not match:
+        raise ValueError(f"不支持的时间间隔: {interval}")
+    return int(match.group(1)) * INTERVAL_UNITS[match.group(2)]
+
+
+def parse_time(value, now_ms: int = None) -> int:
+    """解析时间（epoch 毫秒、ISO 8601 或 now-1d 形式）为毫秒，无法解析时返回 None"""
+    now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = str(value).strip()
+    if text.isdigit():
+        return int(text)
+    match = re.fullmatch(r"now(?:([+-])(\d+)(ms|s|m|h|d))?", text)
+    if match:
+        if not match.group(1):
+            return now_ms
+        delta = int(match.group(2)) * INTERVAL_UNITS[match.group(3)]
+        return now_ms + delta if match.group(1) == "+" else now_ms - delta
+    try:
+        parsed = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+
+def _iso(ms: int) -> str:
+    """毫秒转 ISO 8601 字符串"""
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")[:-4] + "Z"
+
+
+def _registry() -> dict:
+    """rollup 注册表（首次访问时从持久化文件加载）"""
+    global _rollups
+    if _rollups is None:
+        _rollups = {}
+        path = os.getenv("EASYSEARCH_ROLLUP_STORE")
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                _rollups = json.load(f)
+    return _rollups
+
+
+def _save():
+    """持久化全部 rollup"""
+    path = os.getenv("EASYSEARCH_ROLLUP_STORE")
+    if path:
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(_rollups, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
+
+
+def _collect(config: dict, start: int, end: int) -> dict:
+    """用 composite 聚合读取 [start, end) 内的分桶数据，返回 {键: [doc_count, {字段: [sum, min, max, count]}]}"""
+    client = get_client()
+    ts_field = config["timestamp_field"]
+    sources = [{"t": {"date_histogram": {"field": ts_field, "fixed_interval": config["interval"]}}}]
+    sources += [{f"g{i}": {"terms": {"field": g, "missing_bucket": True}}}
+                for i, g in enumerate(config["group_by"])]
+    aggs = {}
+    for i, field in enumerate(config["metrics"]):
+        for metric in ("sum", "min", "max", "value_count"):
+            aggs[f"{i}_{metric}"] = {metric: {"field": field}}
+    filters = [{"range": {ts_field: {"gte": start, "lt": end, "format": "epoch_millis"}}}]
+    if config.get("query"):
+        filters.append(config["query"])
+
+    buckets = {}
+    after = None
+    while True:
+        composite = {"size": 1000, "sources": sources}
+        if after:
+            composite["after"] = after
+        body = {
+            "size": 0,
+            "query": {"bool": {"filter": filters}},
+            "aggs": {"rollup": {"composite": composite, "aggs": aggs}}
+        }
+        result = client.post(f"/{config['index']}/_search", body).get("aggregations", {}).get("rollup", {})
+        for b in result.get("buckets", []):
+            key = json.dumps([b["key"]["t"]] + [b["key"][f"g{i}"] for i in range(len(config["group_by"]))])
+            metrics = {}
+            for i, field in enumerate(config["metrics"]):
+                count = b.get(f"{i}_value_count", {}).get("value") or 0
+                metrics[field] = [b.get(f"{i}_sum", {}).get("value") or 0,
+                                  b.get(f"{i}_min", {}).get("value"),
+                                  b.get(f"{i}_max", {}).get("value"),
+                                  count]
+            buckets[key] = [b.get("doc_count", 0), metrics]
+        after = result.get("after_key")
+        if not after:
+            return buckets
+
+
+def _merge(target: dict, source: dict):
+    """将 [doc_count, metrics] 形式的分桶数据合并到 target"""
+    for key, (doc_count, metrics) in source.items():
+        entry = target.setdefault(key, [0, {}])
+        entry[0] += doc_count
+        for field, (s, lo, hi, count) in metrics.items():
+            current = entry[1].get(field)
+            if current is None:
+                entry[1][field] = [s, lo, hi, count]
+                continue
+            current[0] += s
+            current[1] = lo if current[1] is None else (current[1] if lo is None else min(current[1], lo))
+            current[2] = hi if current[2] is None else (current[2] if hi is None else max(current[2], hi))
+            current[3] += count
+
+
+def create(name: str, index: str, timestamp_field: str, interval: str, metrics: list,
+           group_by: list = None, query: dict = None, delay: str = "1m", start=None) -> dict:
+    """注册 rollup（不立即计算，首次 update 时回填）"""
+    parse_interval(interval)
+    parse_interval(delay)
+    with _lock:
+        rollups = _registry()
+        if name in rollups:
+            raise ValueError(f"rollup 已存在: {name}")
+        rollups[name] = {
+            "index": index,
+            "timestamp_field": timestamp_field,
+            "interval": interval,
+            "metrics": list(metrics),
+            "group_by": list(group_by or []),
+            "query": query,
+            "delay": delay,
+            "start": parse_time(start) if start is not None else None,
+            "watermark": None,
+            "buckets": {}
+        }
+        _save()
+        return describe(name)
+
+
+def delete(name: str) -> bool:
+    """删除 rollup"""
+    with _lock:
+        removed = _registry().pop(name, None) is not None
+        _save()
+        return removed
+
+
+def describe(name: str) -> dict:
+    """rollup 配置和状态（不含分桶数据）"""
+    config = _registry().get(name)
+    if config is None:
+        raise ValueError(f"rollup 不存在: {name}")
+    info = {k: v for k, v in config.items() if k != "buckets"}
+    info["name"] = name
+    info["stored_buckets"] = len(config["buckets"])
+    if config["watermark"] is not None:
+        info["watermark_iso"] = _iso(config["watermark"])
+    return info
+
+
+def list_all() -> list:
+    """全部 rollup 的配置和状态"""
+    return [describe(name) for name in _registry()]
+
+
+def update(name: str) -> dict:
+    """处理水位线之后已闭合的时间桶，推进水位线"""
+    with _lock:
+        config = _registry().get(name)
+        if config is None:
+            raise ValueError(f"rollup 不存在: {name}")
+        interval_ms = parse_interval(config["interval"])
+        now_ms = int(time.time() * 1000)
+        new_watermark = (now_ms - parse_interval(config["delay"])) // interval_ms * interval_ms
+        watermark = config["watermark"]
+        if watermark is None:
+            start = config["start"]
+            if start is None:
+                # 从索引中最早的数据开始回填
+                result = get_client().post(f"/{config['index']}/_search", {
+                    "size": 0, "aggs": {"first": {"min": {"field": config["timestamp_field"]}}}})
+                start = result.get("aggregations", {}).get("first", {}).get("value")
+            watermark = int(start) // interval_ms * interval_ms if start is not None else new_watermark
+        if new_watermark <= watermark:
+            return {"name": name, "buckets_added": 0, "watermark": config["watermark"]}
+        added = _collect(config, watermark, new_watermark)
+        _merge(config["buckets"], added)
+        config["watermark"] = new_watermark
+        _save()
+        return {
+            "name": name,
+            "processed_from": _iso(watermark),
+            "processed_to": _iso(new_watermark),
+            "buckets_added": len(added),
+            "watermark": new_watermark
+        }
+
+
+def query(name: str, interval: str = None, start=None, end=None, group_by: list = None,
+          include_live: bool = True) -> dict:
+    """
+    从 rollup 读取聚合结果，返回 {(桶时间, 分组值...): [doc_count, metrics]}
+
+    interval 必须是 rollup 间隔的整数倍；include_live 时同时实时聚合水位线之后的数据
+    """
+    update(name)
+    config = _registry()[name]
+    base = parse_interval(config["interval"])
+    step = parse_interval(interval) if interval else base
+    if step % base:
+        raise ValueError(f"间隔 {interval} 不是 rollup 间隔 {config['interval']} 的整数倍")
+    group_by = list(group_by or [])
+    missing = [g for g in group_by if g not in config["group_by"]]
+    if missing:
+        raise ValueError(f"rollup 未按以下字段分组: {missing}")
+    positions = [config["group_by"].index(g) for g in group_by]
+    now_ms = int(time.time() * 1000)
+    start_ms = parse_time(start, now_ms)
+    end_ms = parse_time(end, now_ms)
+
+    sources = [config["buckets"]]
+    if include_live and config["watermark"] is not None and (end_ms is None or end_ms > config["watermark"]):
+        sources.append(_collect(config, config["watermark"], end_ms or now_ms + base))
+
+    result = {}
+    for buckets in sources:
+        for key, value in buckets.items():
+            parts = json.loads(key)
+            ts = parts[0]
+            if (start_ms is not None and ts < start_ms) or (end_ms is not None and ts >= end_ms):
+                continue
+            rolled = (ts // step * step,) + tuple(parts[1 + p] for p in positions)
+            _merge(result, {rolled: value})
+    return result
+
+
+def _metric_value(metric: str, values: list):
+    """由 [sum, min, max, count] 计算指标值"""
+    s, lo, hi, count = values
+    if metric == "sum":
+        return s
+    if metric == "min":
+        return lo
+    if metric == "max":
+        return hi
+    if metric == "value_count":
+        return count
+    return s / count if count else None
+
+
+def match_aggregate(index: str, aggs: dict, query_dsl: dict = None) -> tuple:
+    """
+    判断 aggregate 请求能否由 rollup 回答，返回 (rollup 名称, 解析结果) 或 (None, None)
+
+    支持的形式：顶层单个 date_histogram（固定间隔为 rollup 间隔的整数倍），
+    可选一层只带 field/size 的 terms（按分组字段），叶子为 sum/min/max/avg/value_count 指标；
+    查询条件只能是时间戳上的 range，且边界与聚合间隔对齐
+    """
+    if not aggs or len(aggs) != 1:
+        return None, None
+    name, spec = next(iter(aggs.items()))
+    histogram = spec.get("date_histogram") if isinstance(spec, dict) else None
+    if not histogram or set(histogram) - HISTOGRAM_KEYS or histogram.get("min_doc_count", 0) not in (0, 1):
+        return None, None
+    interval = histogram.get("fixed_interval") or CALENDAR_INTERVALS.get(histogram.get("calendar_interval"))
+    if not interval:
+        return None, None
+    children = spec.get("aggs") or spec.get("aggregations") or {}
+    terms = None
+    if len(children) == 1:
+        child_name, child = next(iter(children.items()))
+        if isinstance(child, dict) and "terms" in child:
+            if not isinstance(child["terms"], dict) or set(child["terms"]) - TERMS_KEYS:
+                return None, None
+            terms = (child_name, child["terms"].get("field"), child["terms"].get("size", 10))
+            children = child.get("aggs") or child.get("aggregations") or {}
+    leaves = []
+    for leaf_name, leaf in children.items():
+        if not isinstance(leaf, dict) or len(leaf) != 1:
+            return None, None
+        metric, params = next(iter(leaf.items()))
+        if metric not in METRIC_TYPES or not isinstance(params, dict) or set(params) != {"field"}:
+            return None, None
+        leaves.append((leaf_name, metric, params["field"]))
+
+    for rollup_name, config in _registry().items():
+        if config["index"] != index or config["timestamp_field"] != histogram.get("field"):
+            continue
+        if config.get("query"):
+            continue
+        try:
+            if parse_interval(interval) % parse_interval(config["interval"]):
+                continue
+        except ValueError:
+            continue
+        if terms and terms[1] not in config["group_by"]:
+            continue
+        if any(field not in config["metrics"] for _, _, field in leaves):
+            continue
+        time_range = _time_range(query_dsl, config["timestamp_field"], parse_interval(interval))
+        if time_range is None:
+            continue
+        return rollup_name, {
+            "name": name, "interval": interval, "terms": terms, "leaves": leaves, "range": time_range,
+            "fill_empty": histogram.get("min_doc_count", 0) == 0
+        }
+    return None, None
+
+
+def _time_range(query_dsl: dict, ts_field: str, step: int):
+    """提取时间戳 range 条件，返回 (start, end)；包含其他条件或边界未按 step 对齐时返回 None"""
+    if not query_dsl:
+        return (None, None)
+    clauses = [query_dsl]
+    if "bool" in query_dsl and set(query_dsl["bool"]) <= {"filter", "must"}:
+        clauses = [c for occur in query_dsl["bool"].values()
+                   for c in (occur if isinstance(occur, list) else [occur])]
+    if len(clauses) != 1 or set(clauses[0]) != {"range"} or set(clauses[0]["range"]) != {ts_field}:
+        return None
+    spec = clauses[0]["range"][ts_field]
+    if not isinstance(spec, dict) or set(spec) - {"gte", "lt", "format"} or spec.get("format") not in RANGE_FORMATS:
+        return None
+    # 边界必须落在桶边界上：rollup 只能整桶取舍，未对齐的边界会多算或少算部分桶内的文档。
+    # now 等相对时间在执行时才确定，不使用 rollup
+    bounds = []
+    for value in (spec.get("gte"), spec.get("lt")):
+        if value is None:
+            bounds.append(None)
+            continue
+        if isinstance(value, str) and value.strip().startswith("now"):
+            return None
+        ms = parse_time(value)
+        if ms is None or ms % step:
+            return None
+        bounds.append(ms)
+    return tuple(bounds)
+
+
+def answer_aggregate(rollup_name: str, plan: dict) -> dict:
+    """按 ES 聚合结果的格式返回由 rollup 计算的结果"""
+    group_by = [plan["terms"][1]] if plan["terms"] else []
+    start, end = plan["range"]
+    rows = query(rollup_name, plan["interval"], start, end, group_by)
+
+    def metrics_of(values: dict) -> dict:
+        """由合并后的指标计算各叶子聚合的值"""
+        return {leaf_name: {"value": _metric_value(metric, values[field])}
+                for leaf_name, metric, field in plan["leaves"]}
+
+    by_time = {}
+    for key, (doc_count, values) in rows.items():
+        by_time.setdefault(key[0], []).append((key[1:], doc_count, values))
+    times = sorted(by_time)
+    if plan["fill_empty"] and times:
+        # 与 date_histogram 默认的 min_doc_count=0 一致：补齐首尾之间的空桶
+        step = parse_interval(plan["interval"])
+        times = list(range(times[0], times[-1] + step, step))
+    buckets = []
+    for ts in times:
+        groups = by_time.get(ts, [])
+        bucket = {"key_as_string": _iso(ts), "key": ts, "doc_count": sum(g[1] for g in groups)}
+        if plan["terms"]:
+            terms_name, _, size = plan["terms"]
+            # 分组字段缺失的文档计入时间桶，但与 terms 聚合一样不产生 null 键的桶
+            ranked = sorted((g for g in groups if g[0][0] is not None), key=lambda g: (-g[1], g[0][0]))
+            bucket[terms_name] = {
+                "doc_count_error_upper_bound": 0,
+                "sum_other_doc_count": sum(g[1] for g in ranked[size:]),
+                "buckets": [dict({"key": g[0][0], "doc_count": g[1]}, **metrics_of(g[2]))
+                            for g in ranked[:size]]
+            }
+        else:
+            merged = {ts: [0, {field: [0, None, None, 0] for _, _, field in plan["leaves"]}]}
+            for _, doc_count, values in groups:
+                _merge(merged, {ts: [doc_count, values]})
+            bucket.update(metrics_of(merged[ts][1]))
+        buckets.append(bucket)
+    return {plan["name"]: {"buckets": buckets}}
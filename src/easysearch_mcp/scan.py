@@ -0,0 +1,95 @@
+"""
+流式遍历工具（PIT + search_after，或 scroll）
+"""
+
+from typing import Generator
+import httpx
+from .client import get_client
+
+# PIT 下按分片内文档顺序遍历，不需要 _id fielddata
+SHARD_DOC_SORT = [{"_shard_doc": "asc"}]
+
+
+def open_pit(index: str, keep_alive: str = "5m") -> tuple:
+    """打开 point in time，返回 (pit_id, close(pit_id) 函数)；集群不支持时返回 (None, None)"""
+    client = get_client()
+    try:
+        pit_id = client.post(f"/{index}/_pit", params={"keep_alive": keep_alive}).get("id")
+        return pit_id, lambda pid: client.delete("/_pit", {"id": pid})
+    except Exception:
+        pass
+    try:
+        pit_id = client.post(f"/{index}/_search/point_in_time",
+                             params={"keep_alive": keep_alive}).get("pit_id")
+        return pit_id, lambda pid: client.delete("/_search/point_in_time", {"pit_id": [pid]})
+    except Exception:
+        return None, None
+
+
+def _scroll(index: str, body: dict, page_size: int, keep_alive: str) -> Generator[dict, None, None]:
+    """按 _doc 顺序 scroll 遍历（集群不支持 PIT 或 _shard_doc 时使用）"""
+    client = get_client()
+    result = client.post(f"/{index}/_search", dict(body, size=page_size, sort=["_doc"]),
+                         params={"scroll": keep_alive})
+    scroll_id = result.get("_scroll_id")
+    try:
+        while True:
+            hits = result.get("hits", {}).get("hits", [])
+            yield from hits
+            if not hits or not scroll_id:
+                return
+            result = client.post("/_search/scroll", {"scroll": keep_alive, "scroll_id": scroll_id})
+            scroll_id = result.get("_scroll_id", scroll_id)
+    finally:
+        if scroll_id:
+            try:
+                client.delete("/_search/scroll", {"scroll_id": [scroll_id]})
+            except Exception:
+                pass
+
+
+def scan(index: str, body: dict = None, sort: list = None, page_size: int = 1000,
+         keep_alive: str = "5m") -> Generator[dict, None, None]:
+    """
+    流式遍历索引（优先使用 PIT + search_after 保证一致视图）
+
+    sort 为空时不保证顺序：PIT 下按 _shard_doc 遍历，不支持时改用 scroll 按 _doc 遍历；
+    指定 sort 时必须能唯一确定文档顺序
+    """
+    client = get_client()
+    body = body or {}
+    pit_id, close = open_pit(index, keep_alive)
+    if sort is None and not pit_id:
+        yield from _scroll(index, body, page_size, keep_alive)
+        return
+    page_sort = sort or SHARD_DOC_SORT
+    try:
+        search_after = None
+        while True:
+            page = dict(body, size=page_size, sort=page_sort)
+            if search_after:
+                page["search_after"] = search_after
+            if pit_id:
+                page["pit"] = {"id": pit_id, "keep_alive": keep_alive}
+                try:
+                    result = client.post("/_search", page)
+                except httpx.HTTPStatusError as e:
+                    if sort is not None or search_after or e.response.status_code != 400:
+                        raise
+                    # 集群不支持 _shard_doc 排序：改用 scroll
+                    yield from _scroll(index, body, page_size, keep_alive)
+                    return
+                pit_id = result.get("pit_id", pit_id)
+            else:
+                result = client.post(f"/{index}/_search", page)
+            hits = result.get("hits", {}).get("hits", [])
+            yield from hits
+            if len(hits) < page_size:
+                return
+            search_after = hits[-1]["sort"]
+    finally:
+        if close:
+            try:
+                close(pit_id)
+            except Exception:
+                pass
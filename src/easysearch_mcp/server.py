@@ -7,7 +7,9 @@ Easysearch MCP Server 主入口
 """
 
 import argparse
+import sys
 from mcp.server.fastmcp import FastMCP
+from . import bulk_mode
 from .tools import register_all_tools
 
 # 创建 MCP Server
@@ -25,6 +27,15 @@ def main():
     parser.add_argument("--port", type=int, default=8080, help="SSE 模式监听端口 (默认: 8080)")
     args = parser.parse_args()
 
+    # 恢复上次异常退出时遗留在批量写入模式的索引
+    bulk_mode.install_exit_hooks()
+    try:
+        restored = bulk_mode.recover()["restored"]
+        if restored:
+            print(f"Restored settings of indices left in bulk mode: {', '.join(restored)}", file=sys.stderr)
+    except Exception as e:
+        print(f"Bulk mode recovery skipped: {e}", file=sys.stderr)
+
     if args.sse:
         import uvicorn
         print(f"Starting Easysearch MCP Server in SSE mode on {args.host}:{args.port}")
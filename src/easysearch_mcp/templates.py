@@ -0,0 +1,184 @@
+"""
+索引模板解析缓存
+
+缓存全部旧版模板（_template）并将 index_patterns 编译为查找结构：
+精确名称和 "前缀*" 形式按前缀哈希查找，其余模式合并为正则。
+给定索引名可直接在本地得到匹配的模板以及按 order 合并后的 settings/mappings/aliases，
+并能检查模式重叠的模板
+
+环境变量:
+    EASYSEARCH_TEMPLATE_CACHE_TTL: 模板缓存有效期（秒，默认 300）
+"""
+
+import copy
+import os
+import re
+import threading
+import time
+from functools import lru_cache
+from .client import get_client
+
+
+def _unwrap_mappings(mappings: dict) -> dict:
+    """兼容带 type 名称的旧版映射"""
+    if mappings and "properties" not in mappings and len(mappings) == 1:
+        inner = next(iter(mappings.values()))
+        if isinstance(inner, dict):
+            return inner
+    return mappings or {}
+
+
+def _patterns(template: dict) -> list:
+    """模板的索引模式（兼容单个字符串和 5.x 的 template 字段）"""
+    patterns = template.get("index_patterns", template.get("template", []))
+    return [patterns] if isinstance(patterns, str) else list(patterns)
+
+
+def _deep_merge(target: dict, source: dict, path: str, origin: dict, name: str):
+    """将 source 合并到 target（后合并的覆盖），origin 记录每个叶子路径来自哪个模板"""
+    for key, value in source.items():
+        here = f"{path}.{key}" if path else key
+        if isinstance(value, dict) and value and isinstance(target.get(key, {}), dict):
+            _deep_merge(target.setdefault(key, {}), value, here, origin, name)
+        else:
+            target[key] = copy.deepcopy(value)
+            origin[here] = name
+
+
+@lru_cache(maxsize=4096)
+def patterns_overlap(a: str, b: str) -> bool:
+    """两个只含 * 通配符的模式是否存在同时匹配的索引名"""
+    @lru_cache(maxsize=None)
+    def walk(i: int, j: int) -> bool:
+        if i == len(a) and j == len(b):
+            return True
+        if i < len(a) and a[i] == "*":
+            return walk(i + 1, j) or (j < len(b) and walk(i, j + 1))
+        if j < len(b) and b[j] == "*":
+            return walk(i, j + 1) or (i < len(a) and walk(i + 1, j))
+        return i < len(a) and j < len(b) and a[i] == b[j] and walk(i + 1, j + 1)
+    return walk(0, 0)
+
+
+class TemplateIndex:
+    """编译后的模板模式索引"""
+
+    def __init__(self, templates: dict):
+        self.templates = templates
+        self.exact = {}     # 名称 -> [模板]
+        self.prefixes = {}  # 前缀 -> [模板]
+        general = []        # (正则片段, 模板)
+        for name, template in templates.items():
+            for pattern in _patterns(template):
+                star = pattern.find("*")
+                if star < 0:
+                    self.exact.setdefault(pattern, []).append(name)
+                elif star == len(pattern) - 1:
+                    self.prefixes.setdefault(pattern[:-1], []).append(name)
+                else:
+                    general.append((".*".join(re.escape(p) for p in pattern.split("*")), name))
+        # 先用合并后的单个正则快速排除，命中后再逐个确认是哪些模板
+        self.general = [(re.compile(fragment), name) for fragment, name in general]
+        self.general_any = re.compile("|".join(f"(?:{f})" for f, _ in general)) if general else None
+
+    def match(self, index: str) -> list:
+        """匹配索引名的模板名，按 order 升序（后面的覆盖前面的）"""
+        names = set(self.exact.get(index, []))
+        for i in range(len(index) + 1):
+            names.update(self.prefixes.get(index[:i], []))
+        if self.general_any and self.general_any.fullmatch(index):
+            names.update(name for regex, name in self.general if regex.fullmatch(index))
+        return sorted(names, key=lambda n: (self.templates[n].get("order", 0), n))
+
+    def resolve(self, index: str) -> dict:
+        """按 order 合并匹配模板的 settings/mappings/aliases，并记录被覆盖的值"""
+        names = self.match(index)
+        settings, mappings, aliases = {}, {}, {}
+        origin, overridden = {}, []
+        for name in names:
+            template = self.templates[name]
+            for key, value in template.get("settings", {}).items():
+                if key in settings and settings[key] != value:
+                    overridden.append({"key": f"settings.{key}", "value": settings[key],
+                                       "from": origin[f"settings.{key}"], "overridden_by": name})
+                settings[key] = value
+                origin[f"settings.{key}"] = name
+            before = dict(origin)
+            _deep_merge(mappings, _unwrap_mappings(template.get("mappings")), "mappings", origin, name)
+            for path, source in origin.items():
+                if path in before and before[path] != source and path.startswith("mappings."):
+                    overridden.append({"key": path, "from": before[path], "overridden_by": source})
+            aliases.update(template.get("aliases", {}))
+        return {
+            "index": index,
+            "templates": [{"name": n, "order": self.templates[n].get("order", 0),
+                           "index_patterns": _patterns(self.templates[n])} for n in names],
+            "settings": settings,
+            "mappings": mappings,
+            "aliases": aliases,
+            "overridden": overridden
+        }
+
+    def overlaps(self, names: list = None) -> list:
+        """模式重叠的模板对；order 相同时合并顺序不确定，标记为 ambiguous"""
+        names = sorted(names if names is not None else self.templates)
+        result = []
+        for i, a in enumerate(names):
+            for b in names[i + 1:]:
+                pairs = [(pa, pb) for pa in _patterns(self.templates[a])
+                         for pb in _patterns(self.templates[b]) if patterns_overlap(pa, pb)]
+                if not pairs:
+                    continue
+                order_a, order_b = self.templates[a].get("order", 0), self.templates[b].get("order", 0)
+                settings_a = self.templates[a].get("settings", {})
+                settings_b = self.templates[b].get("settings", {})
+                conflicts = sorted(k for k in settings_a.keys() & settings_b.keys()
+                                   if settings_a[k] != settings_b[k])
+                result.append({
+                    "templates": [a, b],
+                    "patterns": [list(p) for p in pairs],
+                    "orders": [order_a, order_b],
+                    "ambiguous": order_a == order_b,
+                    "winner": None if order_a == order_b else (a if order_a > order_b else b),
+                    "conflicting_settings": conflicts
+                })
+        result.sort(key=lambda r: (not r["ambiguous"], -len(r["conflicting_settings"])))
+        return result
+
+
+class TemplateCache:
+    """带有效期的模板索引缓存"""
+
+    def __init__(self, ttl: float = None):
+        self.ttl = ttl if ttl is not None else float(os.getenv("EASYSEARCH_TEMPLATE_CACHE_TTL", "300"))
+        self._lock = threading.Lock()
+        self._entry = None  # (过期时间, TemplateIndex)
+
+    def get(self) -> TemplateIndex:
+        """获取编译后的模板索引，过期后重新加载"""
+        now = time.monotonic()
+        with self._lock:
+            if self._entry and self._entry[0] > now:
+                return self._entry[1]
+        templates = get_client().get("/_template", {"flat_settings": "true"})
+        index = TemplateIndex(templates)
+        with self._lock:
+            self._entry = (now + self.ttl, index)
+        return index
+
+    def invalidate(self):
+        """清除缓存（模板变更后调用）"""
+        with self._lock:
+            self._entry = None
+
+
+# 全局缓存实例
+_cache = None
+
+
+def get_template_cache() -> TemplateCache:
+    """获取全局模板缓存实例"""
+    global _cache
+    if _cache is None:
+        _cache = TemplateCache()
+    return _cache
@@ -13,6 +13,7 @@ from .slm import register_slm_tools
 from .tasks import register_tasks_tools
 from .ingest import register_ingest_tools
 from .ilm import register_ilm_tools
+from .rollup import register_rollup_tools
 
 
 def register_all_tools(mcp):
@@ -28,3 +29,4 @@ def register_all_tools(mcp):
     register_tasks_tools(mcp)
     register_ingest_tools(mcp)
     register_ilm_tools(mcp)
+    register_rollup_tools(mcp)
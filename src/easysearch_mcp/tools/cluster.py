@@ -2,8 +2,22 @@
 集群管理相关工具
 """
 
+import math
+import re
 from mcp.server.fastmcp import FastMCP
-from ..client import get_client
+from ..client import get_client, parallel_map
+
+GB = 1024 ** 3
+# 分片大小分布区间（上界，字节）
+SIZE_BUCKETS = [("<100mb", 100 * 1024 ** 2), ("100mb-1gb", GB), ("1-10gb", 10 * GB),
+                ("10-50gb", 50 * GB), (">50gb", float("inf"))]
+# 时间序列索引名后缀：日期或 rollover 序号
+SERIES_SUFFIX = re.compile(r"[-_.](\d{4}([-_.]\d{2}){0,2}|\d{6})$")
+
+
+def _largest_divisor(n: int, limit: int) -> int:
+    """n 的不超过 limit 的最大因数"""
+    return max(d for d in range(1, max(min(n, limit), 1) + 1) if n % d == 0)
 
 
 def register_cluster_tools(mcp: FastMCP):
@@ -163,3 +177,139 @@ def register_cluster_tools(mcp: FastMCP):
         body = {"commands": commands or []}
         params = {"dry_run": "true"} if dry_run else None
         return client.post("/_cluster/reroute", body, params=params)
+    
+    @mcp.tool()
+    def cluster_shard_advisor(target_shard_size_gb: float = 30, min_shard_size_gb: float = 10,
+                              max_shard_size_gb: float = 50, heap_mb_per_shard: float = 20,
+                              max_shards_per_heap_gb: int = 20, top_n: int = 20) -> dict:
+        """
+        分片大小与布局建议：找出过小/过大的分片，给出 split/shrink/rollover/模板建议并估算收益
+        
+        参数:
+            target_shard_size_gb: 目标主分片大小
+            min_shard_size_gb: 平均主分片小于该值视为过小
+            max_shard_size_gb: 平均主分片大于该值视为过大
+            heap_mb_per_shard: 估算时每个分片副本的堆内存开销（经验值）
+            max_shards_per_heap_gb: 每 GB 堆内存建议的最大分片数，超过时标记节点
+            top_n: 返回收益最大的前 N 条建议
+        
+        并行读取 _cat/shards、_cat/indices、_cat/allocation、_cat/nodes（流式解析文本输出，
+        按索引累计，不保存逐分片数据），适用于数万分片的集群。
+        同一前缀、以日期或 rollover 序号结尾的索引按时间序列整体给出模板和 rollover 建议
+        """
+        client = get_client()
+        target, low, high = target_shard_size_gb * GB, min_shard_size_gb * GB, max_shard_size_gb * GB
+        
+        # 分片按行流式累计：{索引: [主分片数, 主分片总字节, 最小, 最大]}
+        histogram = {name: 0 for name, _ in SIZE_BUCKETS}
+        per_index = {}
+        shard_count = 0
+        
+        def consume_shards():
+            nonlocal shard_count
+            for index, prirep, size in client.cat_rows("/_cat/shards", ["index", "prirep", "store"],
+                                                       {"bytes": "b"}):
+                shard_count += 1
+                if size is None or prirep != "p":
+                    continue
+                size = int(size)
+                entry = per_index.get(index)
+                if entry is None:
+                    per_index[index] = [1, size, size, size]
+                else:
+                    entry[0] += 1
+                    entry[1] += size
+                    entry[2] = min(entry[2], size)
+                    entry[3] = max(entry[3], size)
+                histogram[next(name for name, limit in SIZE_BUCKETS if size < limit)] += 1
+        
+        def fetch(request: tuple):
+            path, columns = request
+            if columns is None:
+                return consume_shards()
+            return list(client.cat_rows(path, columns, {"bytes": "b"}))
+        
+        # 可能为空的列放在最后，避免文本输出按空白切分时错位
+        _, indices, allocation, nodes = parallel_map(fetch, [
+            ("/_cat/shards", None),
+            ("/_cat/indices", ["index", "pri", "rep", "pri.store.size"]),
+            ("/_cat/allocation", ["node", "shards", "disk.avail"]),
+            ("/_cat/nodes", ["name", "heap.max"])
+        ], max_workers=4)
+        replicas = {row[0]: int(row[2]) for row in indices if row[2] is not None}
+        
+        recommendations = []
+        
+        def recommend(kind: str, name: str, primaries: int, new_primaries: int, copies: int, **extra):
+            saved = (primaries - new_primaries) * copies
+            recommendations.append(dict({
+                "action": kind, "index": name, "primaries": primaries,
+                "recommended_primaries": new_primaries, "shard_copies_saved": saved,
+                "heap_mb_saved": round(saved * heap_mb_per_shard),
+                "search_fanout_change": f"{primaries} -> {new_primaries} 分片/查询"
+            }, **extra))
+        
+        series = {}
+        for name, (primaries, total, smallest, largest) in per_index.items():
+            match = SERIES_SUFFIX.search(name)
+            if match and not name.startswith("."):
+                series.setdefault(name[:match.start() + 1], []).append(name)
+                continue
+            copies = 1 + replicas.get(name, 0)
+            avg = total / primaries
+            if avg > high:
+                new = primaries * math.ceil(avg / target)
+                recommend("index_split", name, primaries, new, copies,
+                          avg_shard_gb=round(avg / GB, 2), max_shard_gb=round(largest / GB, 2),
+                          note="目标分片数需为 number_of_routing_shards 的因数")
+            elif avg < low and primaries > 1:
+                new = _largest_divisor(primaries, max(1, math.ceil(total / target)))
+                if new < primaries:
+                    recommend("index_shrink", name, primaries, new, copies, avg_shard_gb=round(avg / GB, 3))
+        
+        for prefix, names in series.items():
+            primaries = sum(per_index[n][0] for n in names)
+            total = sum(per_index[n][1] for n in names)
+            avg = total / primaries
+            if low <= avg <= high:
+                continue
+            per_member = total / len(names)
+            shards_per_member = max(1, math.ceil(per_member / target))
+            copies = 1 + max(replicas.get(n, 0) for n in names)
+            # 按目标大小 rollover 后，同样数据需要的主分片数
+            new = max(shards_per_member, math.ceil(total / target))
+            if new >= primaries:
+                continue
+            recommend("template_and_rollover", f"{prefix}*", primaries, new, copies,
+                      series_indices=len(names), avg_shard_gb=round(avg / GB, 3),
+                      template_settings={"index.number_of_shards": shards_per_member},
+                      rollover_conditions={"max_size": f"{round(target_shard_size_gb * shards_per_member)}gb"})
+        
+        recommendations.sort(key=lambda r: abs(r["shard_copies_saved"]), reverse=True)
+        heap = {row[0]: int(row[1]) for row in nodes if row[1] is not None}
+        node_warnings = []
+        for node, shards, avail in allocation:
+            if node not in heap or shards is None:
+                continue
+            limit = max_shards_per_heap_gb * heap[node] / GB
+            if int(shards) > limit:
+                node_warnings.append({"node": node, "shards": int(shards), "recommended_max": int(limit),
+                                      "heap_gb": round(heap[node] / GB, 1)})
+        
+        primaries = sum(e[0] for e in per_index.values())
+        return {
+            "summary": {
+                "indices": len(per_index),
+                "shards": shard_count,
+                "primaries": primaries,
+                "primary_bytes": sum(e[1] for e in per_index.values()),
+                "primary_size_histogram": histogram
+            },
+            "estimated_savings": {
+                "shard_copies": sum(r["shard_copies_saved"] for r in recommendations),
+                "heap_mb": sum(r["heap_mb_saved"] for r in recommendations)
+            },
+            "recommendations": recommendations[:top_n],
+            "recommendation_count": len(recommendations),
+            "node_warnings": node_warnings
+        }
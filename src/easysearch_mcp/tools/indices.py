@@ -2,9 +2,179 @@
 索引管理相关工具
 """
 
-import json
+import re
+import time
+from array import array
+from typing import Generator
+import httpx
 from mcp.server.fastmcp import FastMCP
-from ..client import get_client
+from .. import bulk_mode, reindexing
+from ..client import get_client, parallel_map
+from ..mappings import get_mapping_cache
+from ..rollups import parse_interval
+from ..templates import get_template_cache
+
+# 统计 min/max/avg 的字段类型
+STATS_TYPES = {
+    "long", "integer", "short", "byte", "double", "float", "half_float", "scaled_float",
+    "unsigned_long", "date", "date_nanos"
+}
+# 统计高频值的字段类型
+TOP_VALUE_TYPES = {"keyword", "constant_keyword", "boolean", "ip", "version"}
+# 强制合并任务的轮询间隔（秒）
+FORCEMERGE_POLL_S = 5
+# 表示索引已不再写入的阻止设置
+WRITE_BLOCKS = ("index.blocks.write", "index.blocks.read_only")
+# index_diff 分桶模数上限（脚本中按 int 取模）
+DIFF_MAX_MODULUS = 2 ** 30
+# index_diff 的内容哈希：_id 与 _source 的 Java hashCode 混合后按 _id 哈希分桶累加（数量、和、异或），
+# leaf 时返回指定桶内每个文档的 [_id, 哈希]。在 parents 之外的文档不读取 _source
+DIFF_HASH_SCRIPT = {
+    "lang": "painless",
+    "init_script": "state.p = params.parents == null ? null : new HashSet(params.parents); "
+                   "state.b = new HashMap(); state.docs = new ArrayList();",
+    "map_script": """
+        String id = doc['_id'].value;
+        int ih = id.hashCode();
+        if (state.p != null && !state.p.contains(Math.floorMod(ih, params.pm))) { return; }
+        long h = (31L * ih + params._source.hashCode()) * -7046029254386353131L;
+        h ^= h >>> 31;
+        if (params.leaf) { state.docs.add([id, h]); return; }
+        String b = Integer.toString(Math.floorMod(ih, params.m));
+        def c = state.b.get(b);
+        if (c == null) { state.b.put(b, [1L, h, h * -4658895280553007687L]); }
+        else { c[0] += 1L; c[1] += h; c[2] ^= h * -4658895280553007687L; }
+    """,
+    "combine_script": "return params.leaf ? state.docs : state.b;",
+    "reduce_script": """
+        Map out = new HashMap(); List docs = new ArrayList();
+        for (s in states) {
+            if (s == null) { continue; }
+            if (params.leaf) { docs.addAll(s); continue; }
+            for (e in s.entrySet()) {
+                def c = out.get(e.getKey()); def v = e.getValue();
+                if (c == null) { out.put(e.getKey(), v); }
+                else { c[0] += v[0]; c[1] += v[1]; c[2] ^= v[2]; }
+            }
+        }
+        return params.leaf ? docs : out;
+    """
+}
+
+
+def _field_aggs(i: int, path: str, info: dict, top_n: int) -> dict:
+    """为单个字段生成画像所需的聚合，聚合名以字段序号为前缀"""
+    aggs = {}
+    if info["searchable"]:
+        aggs[f"{i}_present"] = {"filter": {"exists": {"field": path}}}
+    if info["aggregatable"]:
+        aggs[f"{i}_card"] = {"cardinality": {"field": path}}
+        if info["type"] in STATS_TYPES:
+            aggs[f"{i}_stats"] = {"stats": {"field": path}}
+        if info["type"] in TOP_VALUE_TYPES and top_n:
+            aggs[f"{i}_top"] = {"terms": {"field": path, "size": top_n}}
+    return aggs
+
+
+def _pick_shrink_node(client, index: str) -> dict:
+    """选择收缩目标节点：可用磁盘能容纳两份主分片数据的数据节点中，分片最少、可用磁盘最多的"""
+    info = client.get(f"/_cat/indices/{index}", {"format": "json", "bytes": "b", "h": "index,pri.store.size"})
+    needed = 2 * sum(int(i.get("pri.store.size") or 0) for i in info)
+    data_nodes = {n["name"] for n in client.get("/_cat/nodes", {"format": "json", "h": "name,node.role"})
+                  if "d" in n.get("node.role", "")}
+    candidates = []
+    for node in client.get("/_cat/allocation", {"format": "json", "bytes": "b"}):
+        if node.get("node") not in data_nodes:
+            continue
+        avail = int(node.get("disk.avail") or 0)
+        candidates.append({"node": node["node"], "disk_avail": avail,
+                           "shards": int(node.get("shards") or 0), "fits": avail >= needed})
+    if not candidates:
+        raise ValueError("没有可用的数据节点")
+    candidates.sort(key=lambda c: (not c["fits"], c["shards"], -c["disk_avail"]))
+    best = dict(candidates[0], needed_bytes=needed)
+    if not best["fits"]:
+        raise ValueError(f"没有可用磁盘 >= {needed} 字节的数据节点: {candidates}")
+    return best
+
+
+def _cluster_rates(client, interval: float) -> dict:
+    """两次采样节点统计，计算全集群每秒查询数和写入文档数"""
+    params = {"filter_path": "nodes.*.indices.search.query_total,nodes.*.indices.indexing.index_total"}
+    
+    def totals() -> tuple:
+        nodes = client.get("/_nodes/stats/indices/search,indexing", params).get("nodes", {})
+        return (sum(n["indices"]["search"]["query_total"] for n in nodes.values()),
+                sum(n["indices"]["indexing"]["index_total"] for n in nodes.values()))
+    
+    search_before, index_before = totals()
+    started = time.monotonic()
+    time.sleep(interval)
+    search_after, index_after = totals()
+    elapsed = time.monotonic() - started
+    return {"search_per_s": round(max(search_after - search_before, 0) / elapsed, 1),
+            "index_per_s": round(max(index_after - index_before, 0) / elapsed, 1)}
+
+
+# 热点检测采样的计数器：(名称, _stats 中的路径)
+HOT_SPOT_COUNTERS = [
+    ("indexing_per_s", ("indexing", "index_total")),
+    ("search_per_s", ("search", "query_total")),
+    ("merge_bytes_per_s", ("merges", "total_size_in_bytes"))
+]
+
+
+def _stats_rows(stats: dict, per_shard: bool) -> Generator[tuple, None, None]:
+    """展开 _stats 结果，产出 (键, 计数器所在的字典)，键为索引或 (索引, 分片, 节点, 是否主分片)"""
+    for index, data in stats.get("indices", {}).items():
+        if not per_shard:
+            yield index, data.get("total", {})
+            continue
+        for shard, copies in data.get("shards", {}).items():
+            for copy in copies:
+                routing = copy.get("routing", {})
+                yield (index, shard, routing.get("node"), routing.get("primary")), copy
+
+
+BYTE_UNITS = {"b": 1, "kb": 1024, "mb": 1024 ** 2, "gb": 1024 ** 3, "tb": 1024 ** 4, "pb": 1024 ** 5}
+
+
+def _parse_bytes(value) -> int:
+    """解析字节大小（如 50gb、512mb）"""
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([kmgtp]?b)", str(value).strip().lower())
+    if not match:
+        raise ValueError(f"不支持的大小: {value}")
+    return int(float(match.group(1)) * BYTE_UNITS[match.group(2)])
+
+
+def _write_blocked(settings: dict) -> set:
+    """
+    _settings（flat_settings）响应中禁止写入的索引
+
+    只看 index.blocks.write / index.blocks.read_only：磁盘水位线自动设置的
+    read_only_allow_delete 是临时状态，不代表索引已不再写入
+    """
+    return {name for name, body in settings.items()
+            if any(str(body.get("settings", {}).get(key)).lower() == "true" for key in WRITE_BLOCKS)}
+
+
+def _rollover_progress(conditions: dict, stats: dict, now_ms: int) -> dict:
+    """按本地统计计算各滚动条件的完成比例（>= 1 表示已满足）"""
+    progress = {}
+    for name, limit in conditions.items():
+        if name == "max_age":
+            value = now_ms - stats["created"]
+            progress[name] = value / parse_interval(limit)
+        elif name == "max_docs":
+            progress[name] = stats["docs"] / int(limit)
+        elif name == "max_size":
+            progress[name] = stats["bytes"] / _parse_bytes(limit)
+        elif name == "max_primary_shard_size":
+            # _cat/indices 只有主分片总大小，按平均主分片大小近似
+            progress[name] = stats["bytes"] / max(stats["primaries"], 1) / _parse_bytes(limit)
+        else:
+            raise ValueError(f"本地评估不支持的条件: {name}（可使用 mode=\"dry_run\"）")
+    return progress
 
 
 def register_indices_tools(mcp: FastMCP):
@@ -35,7 +205,9 @@ def register_indices_tools(mcp: FastMCP):
             body["settings"] = settings
         if aliases:
             body["aliases"] = aliases
-        return client.put(f"/{index}", body if body else None)
+        result = client.put(f"/{index}", body if body else None)
+        get_mapping_cache().invalidate()
+        return result
     
     @mcp.tool()
     def index_delete(index: str) -> dict:
@@ -46,7 +218,9 @@ def register_indices_tools(mcp: FastMCP):
             index: 索引名称，支持通配符如 logs-*
         """
         client = get_client()
-        return client.delete(f"/{index}")
+        result = client.delete(f"/{index}")
+        get_mapping_cache().invalidate()
+        return result
     
     @mcp.tool()
     def index_exists(index: str) -> bool:
@@ -100,7 +274,213 @@ def register_indices_tools(mcp: FastMCP):
         body = {"properties": properties}
         if dynamic:
             body["dynamic"] = dynamic
-        return client.put(f"/{index}/_mapping", body)
+        result = client.put(f"/{index}/_mapping", body)
+        get_mapping_cache().invalidate(index)
+        return result
+    
+    @mcp.tool()
+    def index_profile(index: str, fields: list = None, top_n: int = 5, max_fields: int = 200,
+                      sample_threshold: int = 1000000, sample_size: int = 10000, seed: int = 42,
+                      fields_per_request: int = 50) -> dict:
+        """
+        字段画像：一次调用统计索引各字段的基数、缺失率、最小/最大/平均值和高频值
+        
+        参数:
+            index: 索引名称
+            fields: 只统计指定字段（可选，默认映射中的全部叶子字段）
+            top_n: 每个字段返回的高频值数量（keyword/boolean/ip 字段）
+            max_fields: 最多统计的字段数
+            sample_threshold: 文档数超过该值时改为随机抽样统计
+            sample_size: 抽样时每个分片的样本文档数
+            seed: 随机抽样种子
+            fields_per_request: 每个搜索请求包含的字段数（所有请求通过一次 _msearch 发送）
+        
+        示例:
+            index_profile("logs")
+            index_profile("orders", fields=["status", "amount", "created_at"])
+        """
+        client = get_client()
+        mapping = get_mapping_cache().fields(index)
+        nested_paths = [p for p, f in mapping.items() if f["type"] == "nested"]
+        selected, skipped = [], []
+        for path, info in mapping.items():
+            if fields and path not in fields:
+                continue
+            if info["type"] in ("object", "nested"):
+                continue
+            if any(path.startswith(f"{n}.") for n in nested_paths):
+                skipped.append(path)
+                continue
+            selected.append((path, info))
+        truncated = len(selected) > max_fields
+        selected = selected[:max_fields]
+        
+        total = client.post(f"/{index}/_count").get("count", 0)
+        sampled = total > sample_threshold
+        query = None
+        if sampled:
+            query = {"function_score": {"random_score": {"seed": seed, "field": "_seq_no"}}}
+        
+        searches = []
+        for start in range(0, len(selected), max(1, fields_per_request)):
+            aggs = {}
+            for i, (path, info) in enumerate(selected[start:start + fields_per_request], start):
+                aggs.update(_field_aggs(i, path, info, top_n))
+            if sampled:
+                aggs = {"sample": {"sampler": {"shard_size": sample_size}, "aggs": aggs}}
+            body = {"size": 0, "track_total_hits": False, "aggs": aggs}
+            if query:
+                body["query"] = query
+            searches.append(({"index": index}, body))
+        
+        results = {}
+        base = total
+        for r in client.msearch(searches).get("responses", []) if searches else []:
+            if "error" in r:
+                raise ValueError(f"字段统计失败: {r['error'].get('reason', r['error'])}")
+            aggs = r.get("aggregations", {})
+            if sampled:
+                aggs = aggs.get("sample", {})
+                base = aggs.get("doc_count", 0)
+            results.update(aggs)
+        
+        profile = {}
+        for i, (path, info) in enumerate(selected):
+            entry = {"type": info["type"]}
+            present = results.get(f"{i}_present")
+            if present is not None and base:
+                entry["missing_ratio"] = round(1 - present["doc_count"] / base, 4)
+            if f"{i}_card" in results:
+                entry["cardinality"] = results[f"{i}_card"].get("value")
+            stats = results.get(f"{i}_stats")
+            if stats and stats.get("count"):
+                if info["type"].startswith("date"):
+                    entry.update(min=stats.get("min_as_string", stats.get("min")),
+                                 max=stats.get("max_as_string", stats.get("max")))
+                else:
+                    entry.update(min=stats.get("min"), max=stats.get("max"), avg=stats.get("avg"))
+            top = results.get(f"{i}_top")
+            if top:
+                entry["top"] = [[b.get("key_as_string", b.get("key")), b.get("doc_count")]
+                                for b in top.get("buckets", [])]
+            profile[path] = entry
+        
+        response = {
+            "index": index,
+            "docs": total,
+            "sampled": sampled,
+            "fields": profile
+        }
+        if sampled:
+            response["sample_docs"] = base
+        if truncated:
+            response["truncated"] = f"仅统计前 {max_fields} 个字段"
+        if skipped:
+            response["skipped_nested"] = skipped
+        return response
+    
+    @mcp.tool()
+    def index_diff(source: str, target: str, query: dict = None, partitions: int = 64,
+                   leaf_docs: int = 10000, max_ids: int = 100) -> dict:
+        """
+        比较两个索引的文档是否一致（reindex/clone/snapshot_restore 后校验）
+        
+        在服务端对每个文档计算内容哈希（_id + _source），按 _id 哈希分桶汇总（Merkle 式）：
+        两侧汇总相同的桶直接跳过，不同的桶细分为 partitions 个子桶重新汇总，
+        直到桶内文档数不超过 leaf_docs，再取回桶内各文档的 _id 和哈希逐个比较。
+        数据不经过客户端，内存占用受 leaf_docs 限制
+        
+        参数:
+            source: 源索引
+            target: 目标索引
+            query: 只比较匹配的文档（可选）
+            partitions: 每层的分桶数
+            leaf_docs: 逐文档比较时每批最多取回的文档数
+            max_ids: 每类差异最多返回的 _id 数量（计数不受限制）
+        
+        返回 missing（目标缺失）、extra（目标多出）、changed（内容不同）的数量和示例 _id。
+        哈希由脚本计算（需要允许 painless 脚本读取 _id 和 _source）
+        
+        示例:
+            index_diff("products", "products-v2")
+            index_diff("logs-2024", "logs-2024-restored", query={"range": {"@timestamp": {"gte": "now-7d"}}})
+        """
+        if partitions < 2 or leaf_docs < 1:
+            raise ValueError("partitions 必须 >= 2，leaf_docs 必须 >= 1")
+        client = get_client()
+        
+        def rollups(modulus: int, parent_modulus: int = 0, parents: list = None, leaf: bool = False) -> list:
+            """两侧索引按 _id 哈希分桶的汇总；leaf 时返回 [[_id, 哈希], ...]"""
+            params = {"m": modulus, "pm": parent_modulus, "parents": parents, "leaf": leaf}
+            body = {"size": 0, "aggs": {"h": {"scripted_metric": dict(DIFF_HASH_SCRIPT, params=params)}}}
+            if query:
+                body["query"] = query
+            results = []
+            for r in client.msearch([({"index": source}, body), ({"index": target}, body)]).get("responses", []):
+                if "error" in r:
+                    raise ValueError(f"内容哈希计算失败: {r['error'].get('reason', r['error'])}")
+                results.append(r.get("aggregations", {}).get("h", {}).get("value") or ([] if leaf else {}))
+            return results
+        
+        stats = {"docs_source": 0, "docs_target": 0, "passes": 0, "buckets_skipped": 0, "buckets_compared": 0}
+        leaves = {}  # 模数 -> [(桶, 文档数)]
+        modulus, parent_modulus, parents = partitions, 0, None
+        while True:
+            a, b = rollups(modulus, parent_modulus, parents)
+            stats["passes"] += 1
+            if parents is None:
+                stats["docs_source"] = sum(r[0] for r in a.values())
+                stats["docs_target"] = sum(r[0] for r in b.values())
+            split = []
+            for key in sorted(a.keys() | b.keys(), key=int):
+                ra, rb = a.get(key), b.get(key)
+                if ra == rb:
+                    stats["buckets_skipped"] += 1
+                    continue
+                size = max(ra[0] if ra else 0, rb[0] if rb else 0)
+                if size <= leaf_docs or modulus * partitions > DIFF_MAX_MODULUS:
+                    leaves.setdefault(modulus, []).append((int(key), size))
+                else:
+                    split.append(int(key))
+            if not split:
+                break
+            modulus, parent_modulus, parents = modulus * partitions, modulus, split
+        
+        diff = {"missing": [], "extra": [], "changed": []}
+        counts = {"missing": 0, "extra": 0, "changed": 0}
+        
+        def record(kind: str, doc_id: str):
+            counts[kind] += 1
+            if len(diff[kind]) < max_ids:
+                diff[kind].append(doc_id)
+        
+        for modulus, buckets in leaves.items():
+            batch, batch_docs = [], 0
+            for i, (bucket, size) in enumerate(buckets):
+                batch.append(bucket)
+                batch_docs += size
+                if i + 1 < len(buckets) and batch_docs + buckets[i + 1][1] <= leaf_docs:
+                    continue
+                a, b = rollups(modulus, modulus, batch, leaf=True)
+                stats["passes"] += 1
+                stats["buckets_compared"] += len(batch)
+                left = {doc_id: h for doc_id, h in a}
+                for doc_id, h in sorted(b):
+                    expected = left.pop(doc_id, None)
+                    if expected is None:
+                        record("extra", doc_id)
+                    elif expected != h:
+                        record("changed", doc_id)
+                for doc_id in sorted(left):
+                    record("missing", doc_id)
+                batch, batch_docs = [], 0
+        
+        return {
+            "identical": not any(counts.values()),
+            **stats,
+            "counts": counts,
+            "ids": diff
+        }
     
     @mcp.tool()
     def index_get_settings(index: str, include_defaults: bool = False) -> dict:
@@ -130,6 +510,44 @@ def register_indices_tools(mcp: FastMCP):
         client = get_client()
         return client.put(f"/{index}/_settings", settings)
     
+    @mcp.tool()
+    def index_bulk_mode_enter(index: str, profile: str = "throughput", settings: dict = None,
+                              lease: int = 3600) -> dict:
+        """
+        进入批量写入模式：记录当前设置并应用高吞吐配置
+        
+        参数:
+            index: 索引名称（支持通配符、逗号分隔）
+            profile: throughput（关闭刷新、副本数 0、异步 translog、flush 阈值 1gb）
+                     或 safe（只关闭刷新并提高 flush 阈值）
+            settings: 额外覆盖的设置（可选）
+            lease: 租约秒数，超时未退出则自动恢复（0 表示不限，仍会在进程退出时恢复）
+        
+        重复进入会续租，原设置以首次进入时为准；进程退出、收到 SIGTERM 或下次启动时
+        会自动恢复遗留的索引
+        
+        示例:
+            index_bulk_mode_enter("logs-2024.01", lease=1800)
+        """
+        return bulk_mode.enter_bulk(index, profile, settings, lease)
+    
+    @mcp.tool()
+    def index_bulk_mode_exit(index: str = None, wait_for_green: bool = True, timeout: str = "20s") -> dict:
+        """
+        退出批量写入模式：恢复原设置、刷新并触发副本恢复
+        
+        参数:
+            index: 索引名称（支持通配符、逗号分隔，默认全部）
+            wait_for_green: 是否等待副本恢复到 green
+            timeout: 等待 green 的超时时间（超时不报错，返回 green: false，设置已恢复）
+        """
+        return bulk_mode.exit_bulk(index, wait_for_green, timeout)
+    
+    @mcp.tool()
+    def index_bulk_mode_status() -> list:
+        """查看处于批量写入模式的索引、原设置和剩余租约"""
+        return bulk_mode.status()
+    
     @mcp.tool()
     def index_open(index: str) -> dict:
         """
@@ -199,6 +617,144 @@ def register_indices_tools(mcp: FastMCP):
             params["only_expunge_deletes"] = "true"
         return client.post(path, params=params or None)
     
+    @mcp.tool()
+    def index_forcemerge_schedule(index: str = "*", max_num_segments: int = 1, min_deleted_ratio: float = 0.1,
+                                  include_writable: bool = False, limit: int = 5, concurrency: int = 1,
+                                  max_search_rate: float = None, max_index_rate: float = None,
+                                  sample_interval: float = 5, max_runtime: int = 1800,
+                                  dry_run: bool = False) -> dict:
+        """
+        按段数和删除文档比例排序，在集群低负载时依次强制合并只读索引
+        
+        参数:
+            index: 候选索引（支持通配符，默认全部）
+            max_num_segments: 每个分片合并到的段数
+            min_deleted_ratio: 段数已达标时，删除文档比例超过该值仍会合并以回收空间
+            include_writable: 是否包含可写索引（默认只合并设置了 index.blocks.write 或 index.blocks.read_only 的索引）
+            limit: 本次最多合并的索引数
+            concurrency: 同时合并的索引数
+            max_search_rate: 全集群每秒查询数超过该值时暂停（可选）
+            max_index_rate: 全集群每秒写入文档数超过该值时暂停（可选）
+            sample_interval: 负载采样间隔秒数
+            max_runtime: 最长运行秒数，超时后不再开始新的合并，也不再等待进行中的合并
+            dry_run: 只返回排序结果和当前负载，不执行合并
+        
+        返回每个索引合并前后的段数和回收的字节数；负载过高或超时未处理的索引列在 deferred 中，
+        超时仍在进行的合并列在 running 中（附任务 ID）
+        
+        示例:
+            index_forcemerge_schedule("logs-*", max_search_rate=50, limit=10)
+        """
+        client = get_client()
+        stats = client.get(f"/{index}/_stats/docs,segments,store", {
+            "filter_path": "indices.*.primaries.docs,indices.*.total.segments.count,"
+                           "indices.*.total.store.size_in_bytes"
+        }).get("indices", {})
+        blocked = set()
+        if not include_writable:
+            blocked = _write_blocked(client.get(f"/{index}/_settings/index.blocks.*", {"flat_settings": "true"}))
+        shard_copies = {}
+        for row in client.get(f"/_cat/shards/{index}", {"format": "json", "h": "index,state"}):
+            if row.get("state") == "STARTED":
+                shard_copies[row["index"]] = shard_copies.get(row["index"], 0) + 1
+        
+        candidates = []
+        for name, data in stats.items():
+            if not include_writable and name not in blocked:
+                continue
+            docs = data.get("primaries", {}).get("docs", {})
+            live, deleted = docs.get("count", 0), docs.get("deleted", 0)
+            segments = data.get("total", {}).get("segments", {}).get("count", 0)
+            copies = shard_copies.get(name, 1)
+            excess = segments - copies * max_num_segments
+            deleted_ratio = deleted / (live + deleted) if live + deleted else 0
+            if excess <= 0 and deleted_ratio < min_deleted_ratio:
+                continue
+            candidates.append({
+                "index": name,
+                "segments": segments,
+                "shard_copies": copies,
+                "deleted_ratio": round(deleted_ratio, 4),
+                "store_bytes": data.get("total", {}).get("store", {}).get("size_in_bytes", 0),
+                "score": round(max(excess, 0) * (1 + 10 * deleted_ratio) + 100 * deleted_ratio, 1)
+            })
+        candidates.sort(key=lambda c: c["score"], reverse=True)
+        candidates = candidates[:limit]
+        
+        def overloaded() -> tuple:
+            if max_search_rate is None and max_index_rate is None:
+                return False, None
+            load = _cluster_rates(client, sample_interval)
+            busy = (max_search_rate is not None and load["search_per_s"] > max_search_rate) or \
+                   (max_index_rate is not None and load["index_per_s"] > max_index_rate)
+            return busy, load
+        
+        if dry_run:
+            return {"candidates": candidates, "load": overloaded()[1]}
+        
+        started = time.monotonic()
+        deadline = started + max_runtime
+        
+        def merge(candidate: dict) -> dict:
+            name = candidate["index"]
+            report = {"index": name, "segments_before": candidate["segments"]}
+            try:
+                response = client.post(f"/{name}/_forcemerge", params={
+                    "max_num_segments": str(max_num_segments), "wait_for_completion": "false"})
+            except httpx.TimeoutException:
+                # 集群忽略 wait_for_completion=false 且同步合并超过客户端超时：合并仍在集群上进行
+                return dict(report, status="running", task=None)
+            task = response.get("task")
+            # 不带 task 表示集群已同步完成合并；否则轮询任务状态，到达 max_runtime 时不再等待
+            while task:
+                result = client.get(f"/_tasks/{task}")
+                if result.get("completed"):
+                    if result.get("error"):
+                        return dict(report, status="failed", task=task, error=result["error"])
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return dict(report, status="running", task=task)
+                time.sleep(min(FORCEMERGE_POLL_S, remaining))
+            after = client.get(f"/{name}/_stats/segments,store", {
+                "filter_path": "indices.*.total.segments.count,indices.*.total.store.size_in_bytes"
+            }).get("indices", {}).get(name, {}).get("total", {})
+            store_after = after.get("store", {}).get("size_in_bytes", 0)
+            return dict(report, status="completed",
+                        segments_after=after.get("segments", {}).get("count"),
+                        reclaimed_bytes=candidate["store_bytes"] - store_after)
+        
+        results, deferred, loads = [], [], []
+        pending = list(candidates)
+        while pending:
+            if time.monotonic() > deadline:
+                deferred = [c["index"] for c in pending]
+                break
+            busy, load = overloaded()
+            if load:
+                loads.append(load)
+            if busy:
+                deferred = [c["index"] for c in pending]
+                break
+            batch, pending = pending[:max(concurrency, 1)], pending[max(concurrency, 1):]
+            results.extend(parallel_map(merge, batch, max_workers=concurrency))
+        merged = [r for r in results if r["status"] == "completed"]
+        response = {
+            "merged": merged,
+            "reclaimed_bytes": sum(m["reclaimed_bytes"] for m in merged),
+            "deferred": deferred,
+            "load_samples": loads,
+            "elapsed_s": round(time.monotonic() - started, 1)
+        }
+        # 超过 max_runtime 仍在进行的合并返回任务 ID，可用 tasks_get 继续查看
+        running = [r for r in results if r["status"] == "running"]
+        failed = [r for r in results if r["status"] == "failed"]
+        if running:
+            response["running"] = running
+        if failed:
+            response["failed"] = failed
+        return response
+    
     @mcp.tool()
     def index_clear_cache(index: str = None, fielddata: bool = False, query: bool = False, request: bool = False) -> dict:
         """
@@ -239,6 +795,93 @@ def register_indices_tools(mcp: FastMCP):
             parts.append(metric)
         return client.get("/" + "/".join(parts))
     
+    @mcp.tool()
+    def index_hot_spots(index: str = "*", interval: float = 5, samples: int = 2, per_shard: bool = False,
+                        sort_by: str = "indexing_per_s", top_n: int = 10) -> dict:
+        """
+        多次采样 _stats 计算当前写入/查询/合并速率，找出最热的索引或分片
+        
+        参数:
+            index: 索引名称（支持通配符，默认全部）
+            interval: 两次采样的间隔秒数
+            samples: 采样次数（至少 2 次，多于 2 次时额外给出峰值速率）
+            per_shard: 是否按分片（含节点、主副本）统计
+            sort_by: 排序指标 indexing_per_s/search_per_s/merge_bytes_per_s
+            top_n: 返回前 N 个
+        
+        只请求所需计数器（filter_path），每次采样的值按固定顺序存放在紧凑数组中，
+        适用于数千个索引的集群
+        
+        示例:
+            index_hot_spots("logs-*", interval=10, per_shard=True, sort_by="search_per_s")
+        """
+        names = [name for name, _ in HOT_SPOT_COUNTERS]
+        if sort_by not in names:
+            raise ValueError(f"sort_by 必须是 {', '.join(names)} 之一")
+        if samples < 2:
+            raise ValueError("samples 至少为 2")
+        client = get_client()
+        prefix = "indices.*.shards.*." if per_shard else "indices.*.total."
+        fields = [f"{prefix}{section}.{counter}" for _, (section, counter) in HOT_SPOT_COUNTERS]
+        if per_shard:
+            fields += [f"{prefix}routing.node", f"{prefix}routing.primary"]
+        params = {"filter_path": ",".join(fields)}
+        if per_shard:
+            params["level"] = "shards"
+        
+        # 第一次采样确定键顺序，之后每次采样为每个计数器生成一个与键对齐的数组
+        positions = {}
+        series = []  # [(时间, [数组 × 计数器])]
+        for i in range(samples):
+            if i:
+                time.sleep(interval)
+            stats = client.get(f"/{index}/_stats/indexing,search,merge", params)
+            taken = time.monotonic()
+            values = [array("d", [float("nan")]) * len(positions) for _ in HOT_SPOT_COUNTERS]
+            for key, data in _stats_rows(stats, per_shard):
+                pos = positions.get(key)
+                if pos is None:
+                    if i:
+                        continue
+                    pos = positions[key] = len(positions)
+                    for column in values:
+                        column.append(float("nan"))
+                for column, (_, (section, counter)) in zip(values, HOT_SPOT_COUNTERS):
+                    column[pos] = data.get(section, {}).get(counter, 0)
+            series.append((taken, values))
+        
+        keys = list(positions)
+        elapsed = series[-1][0] - series[0][0]
+        rates = []
+        for c in range(len(HOT_SPOT_COUNTERS)):
+            first, last = series[0][1][c], series[-1][1][c]
+            # 分片迁移等导致计数器重置时按 0 处理；缺失值（NaN）比较结果为 False，同样按 0
+            rates.append(array("d", ((last[p] - first[p]) / elapsed if last[p] >= first[p] else 0.0
+                                     for p in range(len(keys)))))
+        order = sorted(range(len(keys)), key=rates[names.index(sort_by)].__getitem__, reverse=True)[:top_n]
+        
+        top = []
+        for p in order:
+            key = keys[p]
+            row = {"index": key} if not per_shard else {
+                "index": key[0], "shard": int(key[1]), "node": key[2], "primary": key[3]}
+            for c, name in enumerate(names):
+                row[name] = round(rates[c][p], 1)
+                if samples > 2:
+                    peak = 0.0
+                    for (t0, before), (t1, after) in zip(series, series[1:]):
+                        delta = after[c][p] - before[c][p]
+                        if delta > 0:
+                            peak = max(peak, delta / (t1 - t0))
+                    row[name.replace("_per_s", "_peak_per_s")] = round(peak, 1)
+            top.append(row)
+        totals = {name: round(sum(rates[c]), 1) for c, name in enumerate(names)}
+        total = totals[sort_by]
+        for row in top:
+            row["share"] = round(row[sort_by] / total, 3) if total else 0
+        return {"window_s": round(elapsed, 1), "samples": samples,
+                "tracked": len(keys), "totals": totals, "top": top}
+    
     @mcp.tool()
     def index_segments(index: str = None) -> dict:
         """
@@ -309,17 +952,13 @@ def register_indices_tools(mcp: FastMCP):
         
         参数:
             index: 索引名称
-            target_node: 目标节点名称（可选，不传则使用第一个数据节点）
+            target_node: 目标节点名称（可选，不传则选择磁盘足够、分片最少的数据节点）
         """
         client = get_client()
         
-        # 如果没指定节点，获取第一个数据节点
+        # 如果没指定节点，按可用磁盘和分片数选择
         if not target_node:
-            nodes = client.get("/_cat/nodes?format=json")
-            for node in nodes:
-                if 'd' in node.get('node.role', ''):
-                    target_node = node.get('name')
-                    break
+            target_node = _pick_shrink_node(client, index)["node"]
         
         body = {
             "settings": {
@@ -404,6 +1043,85 @@ def register_indices_tools(mcp: FastMCP):
         body = {"settings": settings} if settings else None
         return client.post(f"/{source}/_shrink/{target}", body)
     
+    @mcp.tool()
+    def index_shrink_workflow(source: str, target: str, number_of_shards: int = 1, target_node: str = None,
+                              settings: dict = None, forcemerge: bool = False, max_wait: int = 600) -> dict:
+        """
+        完整的收缩流程：选择节点、迁移分片、等待迁移完成、收缩、检查健康、清理源索引设置
+        
+        参数:
+            source: 源索引名称
+            target: 目标索引名称
+            number_of_shards: 目标分片数（必须是源分片数的因数）
+            target_node: 迁移到的节点（可选，不传则选择可用磁盘足够、分片最少的数据节点）
+            settings: 目标索引额外设置
+            forcemerge: 收缩后是否在后台将目标索引合并为 1 个段
+            max_wait: 等待分片迁移完成及目标索引主分片就绪的最长秒数（从开始迁移算起）
+        
+        源索引最终会清除 allocation 限制和写入阻止；失败时同样会清理
+        
+        示例:
+            index_shrink_workflow("logs-2024.01", "logs-2024.01-shrunk", number_of_shards=1)
+        """
+        client = get_client()
+        current = client.get(f"/{source}/_settings", {"flat_settings": "true"})
+        if len(current) != 1:
+            raise ValueError(f"source 必须是单个索引: {source}")
+        source_shards = int(next(iter(current.values()))["settings"]["index.number_of_shards"])
+        if number_of_shards < 1 or source_shards % number_of_shards:
+            raise ValueError(f"目标分片数 {number_of_shards} 必须是源分片数 {source_shards} 的因数")
+        
+        steps = {}
+        if not target_node:
+            steps["node_selection"] = _pick_shrink_node(client, source)
+            target_node = steps["node_selection"]["node"]
+        started = time.monotonic()
+        client.put(f"/{source}/_settings", {
+            "index.routing.allocation.require._name": target_node,
+            "index.blocks.write": True
+        })
+        try:
+            # 等待迁移完成：每个分片都有一个已启动的副本在目标节点上
+            while True:
+                # 等待超时时 health() 返回 timed_out: true，进入下一轮
+                health = client.health(source, {"wait_for_no_relocating_shards": "true", "timeout": "20s"})
+                shards = client.get(f"/_cat/shards/{source}", {"format": "json", "h": "shard,state,node"})
+                on_node = {s["shard"] for s in shards if s.get("node") == target_node and s.get("state") == "STARTED"}
+                if not health.get("timed_out") and len(on_node) == source_shards:
+                    break
+                if time.monotonic() - started > max_wait:
+                    raise ValueError(f"{max_wait} 秒内分片未全部迁移到 {target_node}"
+                                     f"（已就绪 {len(on_node)}/{source_shards}）")
+            steps["relocation_s"] = round(time.monotonic() - started, 1)
+            
+            body = {"settings": {
+                "index.number_of_shards": number_of_shards,
+                "index.routing.allocation.require._name": None,
+                "index.blocks.write": None,
+                **(settings or {})
+            }}
+            steps["shrink"] = client.post(f"/{source}/_shrink/{target}", body)
+            # 新索引的主分片初始化期间为 red，按轮等待；副本未就绪（yellow）不影响后续步骤
+            while True:
+                health = client.health(target, {"wait_for_status": "green", "timeout": "20s"})
+                if health.get("status") != "red" or time.monotonic() - started > max_wait:
+                    break
+            steps["target_health"] = {k: health.get(k) for k in
+                                      ("status", "timed_out", "active_shards", "initializing_shards", "unassigned_shards")}
+            if health.get("status") == "red":
+                raise ValueError(f"目标索引 {target} 状态为 red: {steps['target_health']}")
+            if forcemerge:
+                steps["forcemerge"] = client.post(f"/{target}/_forcemerge", params={
+                    "max_num_segments": "1", "wait_for_completion": "false"})
+        finally:
+            client.put(f"/{source}/_settings", {
+                "index.routing.allocation.require._name": None,
+                "index.blocks.write": None
+            })
+            steps["source_cleared"] = True
+        return {"source": source, "target": target, "target_node": target_node,
+                "number_of_shards": number_of_shards, **steps}
+    
     @mcp.tool()
     def index_rollover(alias: str, conditions: dict = None, settings: dict = None, mappings: dict = None) -> dict:
         """
@@ -432,6 +1150,117 @@ def register_indices_tools(mcp: FastMCP):
             body["mappings"] = mappings
         return client.post(f"/{alias}/_rollover", body if body else None)
     
+    @mcp.tool()
+    def index_rollover_batch(conditions: dict, alias: str = "*", mode: str = "local", execute: bool = False,
+                             concurrency: int = 8, near_threshold: float = 0.8) -> dict:
+        """
+        批量评估所有写别名的滚动条件，并可并发执行到期的滚动
+        
+        参数:
+            conditions: 滚动条件，如 {"max_age": "7d", "max_docs": 1000000, "max_size": "50gb"}
+            alias: 别名过滤（支持通配符，默认全部）
+            mode: local（一次 _cat/indices 在本地计算，支持 max_age/max_docs/max_size/max_primary_shard_size）
+                  或 dry_run（对每个别名并发调用 _rollover?dry_run，由集群判断）
+            execute: 是否对到期的别名执行滚动（集群会再次校验条件）
+            concurrency: dry_run 和执行滚动时的并发数
+            near_threshold: 未到期但任一条件完成比例超过该值的别名列为 near
+        
+        写别名指 is_write_index 为 true 的别名；以 . 开头或 is_hidden 的别名不参与。
+        按名称（不含通配符）指定的别名只指向一个索引时也可滚动
+        
+        示例:
+            index_rollover_batch({"max_age": "1d", "max_size": "50gb"}, alias="logs-*", execute=True)
+        """
+        if mode not in ("local", "dry_run"):
+            raise ValueError("mode 必须是 local 或 dry_run")
+        client = get_client()
+        path = f"/_alias/{alias}" if alias != "*" else "/_alias"
+        named = set(alias.split(",")) if not any(c in alias for c in "*?") else set()
+        members = {}  # 别名 -> [(索引, is_write_index)]
+        for index, data in client.get(path).items():
+            for name, spec in data.get("aliases", {}).items():
+                spec = spec or {}
+                if name.startswith(".") or spec.get("is_hidden"):
+                    continue
+                members.setdefault(name, []).append((index, spec.get("is_write_index")))
+        targets, skipped = {}, []
+        for name, indices in members.items():
+            writes = [i for i, w in indices if w]
+            if len(writes) == 1:
+                targets[name] = writes[0]
+            elif name in named and len(indices) == 1 and indices[0][1] is None:
+                targets[name] = indices[0][0]
+            else:
+                skipped.append(name)
+        
+        due, near, errors = {}, [], {}
+        not_due = 0
+        if mode == "local":
+            now_ms = int(time.time() * 1000)
+            wanted = set(targets.values())
+            stats = {}
+            # 可能为空的列放在最后
+            for index, primaries, created, docs, size in client.cat_rows(
+                    "/_cat/indices", ["index", "pri", "creation.date", "docs.count", "pri.store.size"],
+                    {"bytes": "b"}):
+                if index in wanted:
+                    stats[index] = {"primaries": int(primaries), "created": int(created),
+                                    "docs": int(docs or 0), "bytes": int(size or 0)}
+            for name, index in targets.items():
+                if index not in stats:
+                    errors[name] = f"写索引 {index} 没有统计信息"
+                    continue
+                ratios = _rollover_progress(conditions, stats[index], now_ms)
+                met = sorted(c for c, r in ratios.items() if r >= 1)
+                if met:
+                    due[name] = {"index": index, "met": met}
+                    continue
+                not_due += 1
+                if max(ratios.values(), default=0) >= near_threshold:
+                    near.append({"alias": name, "index": index,
+                                 "progress": {c: round(r, 2) for c, r in ratios.items()}})
+        else:
+            def dry_run(name: str):
+                try:
+                    return name, client.post(f"/{name}/_rollover", {"conditions": conditions},
+                                             params={"dry_run": "true"})
+                except Exception as e:
+                    return name, e
+            for name, result in parallel_map(dry_run, targets, max_workers=concurrency):
+                if isinstance(result, Exception):
+                    errors[name] = str(result)
+                    continue
+                met = sorted(c for c, ok in result.get("conditions", {}).items() if ok)
+                if met:
+                    due[name] = {"index": targets[name], "met": met}
+                else:
+                    not_due += 1
+        
+        rolled = []
+        if execute and due:
+            def rollover(name: str):
+                try:
+                    return name, client.post(f"/{name}/_rollover", {"conditions": conditions})
+                except Exception as e:
+                    return name, e
+            for name, result in parallel_map(rollover, sorted(due), max_workers=concurrency):
+                if isinstance(result, Exception):
+                    errors[name] = str(result)
+                elif result.get("rolled_over"):
+                    rolled.append({"alias": name, "old_index": result.get("old_index"),
+                                   "new_index": result.get("new_index")})
+        
+        near.sort(key=lambda n: max(n["progress"].values()), reverse=True)
+        return {
+            "aliases": len(targets),
+            "due": due,
+            "not_due": not_due,
+            "near": near[:20],
+            "rolled_over": rolled,
+            "skipped": skipped,
+            "errors": errors
+        }
+    
     @mcp.tool()
     def alias_get(name: str = None, index: str = None) -> dict:
         """
@@ -517,6 +1346,35 @@ def register_indices_tools(mcp: FastMCP):
         path = f"/_template/{name}" if name else "/_template"
         return client.get(path)
     
+    @mcp.tool()
+    def template_resolve(index: str = None, simulate: bool = False, refresh: bool = False) -> dict:
+        """
+        本地解析索引模板：给定索引名返回匹配的模板及按 order 合并后的 settings/mappings/aliases
+        
+        参数:
+            index: 待创建的索引名（可选）
+            simulate: 检查模式重叠的模板（给定 index 时只检查匹配它的模板，否则检查全部）
+            refresh: 忽略缓存重新加载模板
+        
+        模板在本地缓存并编译为前缀哈希和正则，重复查询不访问集群；
+        order 相同且模式重叠的模板合并顺序不确定，simulate 会标记为 ambiguous
+        
+        示例:
+            template_resolve("logs-2024.06.01")
+            template_resolve(simulate=True)
+        """
+        cache = get_template_cache()
+        if refresh:
+            cache.invalidate()
+        templates = cache.get()
+        if index is None and not simulate:
+            raise ValueError("需要指定 index 或 simulate=True")
+        result = templates.resolve(index) if index else {"templates": len(templates.templates)}
+        if simulate:
+            names = [t["name"] for t in result["templates"]] if index else None
+            result["overlaps"] = templates.overlaps(names)
+        return result
+    
     @mcp.tool()
     def template_create(name: str, index_patterns: list, template: dict, priority: int = None, composed_of: list = None) -> dict:
         """
@@ -547,7 +1405,9 @@ def register_indices_tools(mcp: FastMCP):
         }
         if priority is not None:
             body["order"] = priority  # 旧版 API 使用 order 而非 priority
-        return client.put(f"/_template/{name}", body)
+        result = client.put(f"/_template/{name}", body)
+        get_template_cache().invalidate()
+        return result
     
     @mcp.tool()
     def template_delete(name: str) -> dict:
@@ -559,7 +1419,9 @@ def register_indices_tools(mcp: FastMCP):
         """
         client = get_client()
         # 使用旧版模板 API（兼容 Easysearch）
-        return client.delete(f"/_template/{name}")
+        result = client.delete(f"/_template/{name}")
+        get_template_cache().invalidate()
+        return result
     
     @mcp.tool()
     def reindex(source: dict, dest: dict, script: dict = None, max_docs: int = None) -> dict:
@@ -585,3 +1447,95 @@ def register_indices_tools(mcp: FastMCP):
         if max_docs:
             body["max_docs"] = max_docs
         return client.post("/_reindex", body)
+    
+    @mcp.tool()
+    def reindex_start(source: dict, dest: dict, slices: str = "auto", requests_per_second: float = None,
+                      script: dict = None, max_docs: int = None, tune_dest: bool = True,
+                      swap_alias: str = None) -> dict:
+        """
+        后台分片并行重建索引（不受客户端 30 秒超时限制）
+        
+        参数:
+            source: 源配置 {"index": "old-index", "query": {...}}
+            dest: 目标配置 {"index": "new-index"}
+            slices: 并行 slice 数（auto 表示按分片数自动切分）
+            requests_per_second: 限速（每秒文档数，可选）
+            script: 转换脚本
+            max_docs: 最大文档数
+            tune_dest: 执行期间将目标索引设为 refresh_interval=-1、副本数 0，完成后恢复
+            swap_alias: 成功后将该别名从源索引原子切换到目标索引（可选）
+        
+        返回 job_id，用 reindex_progress 查看进度；任务结束后的首次查询会恢复设置并切换别名
+        
+        示例:
+            reindex_start({"index": "products-v1"}, {"index": "products-v2"}, swap_alias="products")
+        """
+        return reindexing.start(source, dest, slices, requests_per_second, script, max_docs,
+                                tune_dest, swap_alias)
+    
+    @mcp.tool()
+    def reindex_progress(job_id: str) -> dict:
+        """
+        查看后台重建索引的进度
+        
+        参数:
+            job_id: reindex_start 返回的任务 ID
+        
+        返回总数、已完成数、百分比、速率（docs/s）、预计剩余时间和各 slice 进度；
+        任务结束后恢复目标索引设置、刷新并按需切换别名
+        """
+        return reindexing.progress(job_id)
+    
+    @mcp.tool()
+    def reindex_cancel(job_id: str) -> dict:
+        """
+        取消后台重建索引并恢复目标索引设置（不切换别名）
+        
+        参数:
+            job_id: reindex_start 返回的任务 ID
+        """
+        return reindexing.cancel(job_id)
+    
+    @mcp.tool()
+    def index_migrate(source: str, dest: str, timestamp_field: str, mappings: dict = None,
+                      settings: dict = None, read_alias: str = None, write_alias: str = None,
+                      slices: str = "auto", max_delta_docs: int = 1000, max_passes: int = 5) -> dict:
+        """
+        在线迁移索引（修改映射等），无需停写
+        
+        流程：按新映射创建目标索引 → 后台分片并行全量复制 → 按时间戳水位线多轮追平复制期间的写入
+        → 增量足够小时原子切换读写别名 → 最后一轮追平切换前写入源索引的文档
+        
+        参数:
+            source: 源索引名称
+            dest: 目标索引名称（不能已存在）
+            timestamp_field: 每次写入都会更新的时间戳字段（如 updated_at），用于找出复制期间变更的文档
+            mappings: 目标索引映射
+            settings: 目标索引设置
+            read_alias: 读别名（可选）
+            write_alias: 写别名（可选，可与读别名相同）
+            slices: 全量复制的并行 slice 数
+            max_delta_docs: 一轮追平的文档数不超过该值时切换别名
+            max_passes: 最多追平轮数，达到后直接切换
+        
+        所有复制使用 external 版本，不会覆盖切换后在新索引上的更新；复制期间在源索引上的删除不会同步。
+        返回 job_id，反复调用 index_migrate_progress 推进直到 phase 为 completed
+        
+        示例:
+            index_migrate("products-v1", "products-v2", "updated_at",
+                          mappings={"properties": {...}}, read_alias="products", write_alias="products")
+        """
+        return reindexing.migrate_start(source, dest, timestamp_field, mappings, settings, read_alias,
+                                        write_alias, slices, max_delta_docs, max_passes)
+    
+    @mcp.tool()
+    def index_migrate_progress(job_id: str) -> dict:
+        """
+        查看在线迁移进度，并推进到下一阶段（copy → catchup → final → completed）
+        
+        参数:
+            job_id: index_migrate 返回的任务 ID
+        
+        返回当前阶段、水位线、各轮追平复制的文档数，以及切换别名的操作
+        """
+        return reindexing.migrate_progress(job_id)
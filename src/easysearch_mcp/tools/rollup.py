@@ -0,0 +1,95 @@
+"""
+客户端 Rollup 相关工具
+"""
+
+from mcp.server.fastmcp import FastMCP
+from .. import rollups
+
+
+def register_rollup_tools(mcp: FastMCP):
+    """注册客户端 Rollup 工具"""
+    
+    @mcp.tool()
+    def rollup_create(name: str, index: str, metrics: list, timestamp_field: str = "@timestamp",
+                      interval: str = "1h", group_by: list = None, query: dict = None,
+                      delay: str = "1m", start: str = None) -> dict:
+        """
+        创建客户端物化 rollup（按时间桶增量预聚合指标）
+        
+        参数:
+            name: rollup 名称
+            index: 源索引（支持通配符）
+            metrics: 预聚合的数值字段列表（保存 sum/min/max/count，可回答 sum/min/max/avg/value_count）
+            timestamp_field: 时间戳字段
+            interval: 时间桶间隔（固定间隔，如 5m/1h/1d）
+            group_by: 分组字段列表（keyword 类字段，可选）
+            query: 只预聚合匹配的文档（可选；设置后不用于自动回答 aggregate）
+            delay: 水位线延迟，只处理早于 now - delay 的已闭合时间桶
+            start: 回填起始时间（可选，默认从索引中最早的数据开始）
+        
+        创建后 aggregate 传入 use_rollup=True 时，匹配的 date_histogram 聚合（同索引、同时间字段、
+        间隔为整数倍、时间范围与间隔对齐、指标字段已预聚合）由 rollup 回答，只实时计算水位线之后的新数据
+        
+        示例:
+            rollup_create("logs-hourly", "logs-*", metrics=["bytes", "latency_ms"],
+                          group_by=["service"], interval="1h")
+        """
+        return rollups.create(name, index, timestamp_field, interval, metrics,
+                              group_by=group_by, query=query, delay=delay, start=start)
+    
+    @mcp.tool()
+    def rollup_update(name: str) -> dict:
+        """
+        增量更新 rollup（只处理上次水位线之后已闭合的时间桶）
+        
+        参数:
+            name: rollup 名称
+        """
+        return rollups.update(name)
+    
+    @mcp.tool()
+    def rollup_query(name: str, interval: str = None, start: str = None, end: str = None,
+                     group_by: list = None, include_live: bool = True) -> dict:
+        """
+        查询 rollup 结果
+        
+        参数:
+            name: rollup 名称
+            interval: 结果时间桶间隔（必须是 rollup 间隔的整数倍，默认与 rollup 相同）
+            start: 起始时间（包含，支持 ISO 8601、epoch 毫秒、now-7d）
+            end: 结束时间（不包含）
+            group_by: 结果分组字段（必须是 rollup 分组字段的子集，默认不分组）
+            include_live: 是否实时聚合水位线之后尚未预聚合的数据
+        
+        返回每个时间桶（及分组）的 doc_count 和各字段的 sum/min/max/count/avg
+        
+        示例:
+            rollup_query("logs-hourly", interval="1d", start="now-7d", group_by=["service"])
+        """
+        group_by = list(group_by or [])
+        rows = rollups.query(name, interval, start, end, group_by, include_live)
+        result = []
+        for key in sorted(rows, key=lambda k: (k[0], [str(v) for v in k[1:]])):
+            doc_count, values = rows[key]
+            row = {"timestamp": key[0], "doc_count": doc_count}
+            row.update(zip(group_by, key[1:]))
+            for field, (s, lo, hi, count) in values.items():
+                row[field] = {"sum": s, "min": lo, "max": hi, "count": count,
+                              "avg": s / count if count else None}
+            result.append(row)
+        return {"name": name, "buckets": len(result), "rows": result}
+    
+    @mcp.tool()
+    def rollup_list() -> list:
+        """获取全部 rollup 的配置、水位线和已保存的桶数量"""
+        return rollups.list_all()
+    
+    @mcp.tool()
+    def rollup_delete(name: str) -> dict:
+        """
+        删除 rollup
+        
+        参数:
+            name: rollup 名称
+        """
+        return {"name": name, "deleted": rollups.delete(name)}
@@ -2,8 +2,374 @@
 搜索相关工具
 """
 
+import csv
+import fnmatch
+import io
+import json
+import math
+import random
+import time
+import uuid
+from array import array
+from itertools import chain
+import httpx
 from mcp.server.fastmcp import FastMCP
-from ..client import get_client
+from .. import rollups
+from ..client import get_client, parallel_map
+from ..mappings import get_mapping_cache
+from ..query_guard import estimate_cost, guard
+from ..query_validate import validate
+from ..query_rewrite import rewrite_query, scoring_matters
+from ..scan import open_pit, scan
+
+
+# 索引文档数缓存：索引 -> (获取时间, 主分片文档数, 是否带过滤条件的别名)
+_doc_counts = {}
+# 跟随读取状态：follow_id -> 游标、重叠窗口内已读 _id 等
+_follows = {}
+FOLLOW_IDLE_TTL = 3600
+# 单次请求可返回的最多文档数（index.max_result_window 默认值）
+SAMPLE_WINDOW = 10000
+
+
+def _filtered_alias(index: str) -> bool:
+    """索引表达式中是否有带 filter 的别名（不是别名时返回 False）"""
+    try:
+        result = get_client().get(f"/_alias/{index}")
+    except httpx.HTTPStatusError:
+        return False
+    names = index.split(",")
+    return any(spec.get("filter") for body in result.values()
+               for alias, spec in body.get("aliases", {}).items()
+               if any(fnmatch.fnmatchcase(alias, name) for name in names))
+
+
+def _vector_dims(index: str, field: str) -> int:
+    """从映射中读取向量字段维度，未声明时返回 None"""
+    client = get_client()
+    result = client.get(f"/{index}/_mapping/field/{field}")
+    for index_mapping in result.values():
+        for field_mapping in index_mapping.get("mappings", {}).values():
+            for leaf in field_mapping.get("mapping", {}).values():
+                dims = (leaf.get("dims") or leaf.get("dimension")
+                        or leaf.get("knn", {}).get("dims"))
+                if dims:
+                    return int(dims)
+    return None
+
+
+def _validate_vectors(vectors: list, dims: int = None) -> int:
+    """一次性校验向量矩阵的维度和数值类型，返回维度"""
+    if not vectors:
+        raise ValueError("query_vectors 不能为空")
+    lengths = set(map(len, vectors))
+    if len(lengths) != 1:
+        raise ValueError(f"向量维度不一致: {sorted(lengths)}")
+    dim = lengths.pop()
+    if dims and dim != dims:
+        raise ValueError(f"向量维度 {dim} 与映射维度 {dims} 不匹配")
+    try:
+        array("d", chain.from_iterable(vectors))
+    except TypeError:
+        raise ValueError("query_vectors 中包含非数值元素")
+    return dim
+
+
+def _min_max(scores: dict) -> dict:
+    """将分数线性归一化到 [0, 1]"""
+    if not scores:
+        return {}
+    low, high = min(scores.values()), max(scores.values())
+    span = high - low
+    return {k: (v - low) / span if span else 1.0 for k, v in scores.items()}
+
+
+def _cosine(a: list, b: list) -> float:
+    """余弦相似度"""
+    dot = math.fsum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(math.fsum(x * x for x in a)) * math.sqrt(math.fsum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+# 单桶聚合：指标列为 name.doc_count 及其子指标
+SINGLE_BUCKET_AGGS = {"filter", "nested", "reverse_nested", "global", "missing", "sampler",
+                      "diversified_sampler", "children", "parent"}
+# 多值指标聚合返回的数值字段
+MULTI_VALUE_METRICS = {
+    "stats": ("count", "min", "max", "avg", "sum"),
+    "extended_stats": ("count", "min", "max", "avg", "sum", "sum_of_squares", "variance",
+                       "variance_population", "variance_sampling", "std_deviation",
+                       "std_deviation_population", "std_deviation_sampling"),
+    "string_stats": ("count", "min_length", "max_length", "avg_length", "entropy"),
+    "boxplot": ("min", "max", "q1", "q2", "q3"),
+    "geo_centroid": ("count",)
+}
+DEFAULT_PERCENTS = (1, 5, 25, 50, 75, 95, 99)
+# 不产生指标列的聚合：多桶聚合和返回文档/对象的聚合
+NON_METRIC_AGGS = {
+    "terms", "multi_terms", "rare_terms", "significant_terms", "significant_text", "histogram",
+    "date_histogram", "auto_date_histogram", "variable_width_histogram", "range", "date_range",
+    "ip_range", "geo_distance", "filters", "adjacency_matrix", "geohash_grid", "geotile_grid", "composite",
+    "top_hits", "top_metrics", "geo_bounds", "matrix_stats"
+}
+
+
+def _single_bucket(agg: dict) -> bool:
+    """filter/nested/reverse_nested/global 等单桶聚合结果"""
+    return "doc_count" in agg and "buckets" not in agg
+
+
+def _bucket_children(bucket: dict, prefix: str = "") -> list:
+    """桶内的多桶子聚合，穿过单桶聚合查找，名称加上单桶聚合前缀"""
+    children = []
+    for name, agg in bucket.items():
+        if name == "key" or not isinstance(agg, dict):
+            continue
+        if "buckets" in agg:
+            children.append((f"{prefix}{name}", agg))
+        elif _single_bucket(agg):
+            children.extend(_bucket_children(agg, f"{prefix}{name}."))
+    return children
+
+
+def _bucket_metrics(bucket: dict) -> dict:
+    """提取桶内的指标值，多值指标展开为 name.sub"""
+    metrics = {}
+    for name, agg in bucket.items():
+        if name in ("key", "key_as_string", "doc_count") or not isinstance(agg, dict):
+            continue
+        if "buckets" in agg:
+            continue
+        if _single_bucket(agg):
+            # filter/nested/global 等单桶聚合：展开其下的指标，名称加前缀
+            metrics[f"{name}.doc_count"] = agg["doc_count"]
+            metrics.update({f"{name}.{m}": v for m, v in _bucket_metrics(agg).items()})
+        elif "value" in agg:
+            metrics[name] = agg["value"]
+        elif isinstance(agg.get("values"), dict):
+            for sub, value in agg["values"].items():
+                metrics[f"{name}.{sub}"] = value
+        else:
+            for sub, value in agg.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    metrics[f"{name}.{sub}"] = value
+    return metrics
+
+
+def _metric_columns(aggs: dict, prefix: str = "") -> list:
+    """按聚合定义得到 _bucket_metrics 提取的指标列名（多桶子聚合不产生列）"""
+    columns = []
+    for name, agg in (aggs or {}).items():
+        atype = next((k for k in agg if k not in ("aggs", "aggregations", "meta")), None)
+        params = agg.get(atype) or {}
+        name = f"{prefix}{name}"
+        if atype in SINGLE_BUCKET_AGGS:
+            columns.append(f"{name}.doc_count")
+            columns.extend(_metric_columns(agg.get("aggs") or agg.get("aggregations"), f"{name}."))
+        elif atype in MULTI_VALUE_METRICS:
+            columns.extend(f"{name}.{sub}" for sub in MULTI_VALUE_METRICS[atype])
+        elif atype in ("percentiles", "percentile_ranks"):
+            points = params.get("percents", DEFAULT_PERCENTS) if atype == "percentiles" else params.get("values", [])
+            columns.extend(f"{name}.{float(p)}" for p in points)
+        elif atype and atype not in NON_METRIC_AGGS:
+            columns.append(name)
+    return columns
+
+
+def _nullable(values: array) -> list:
+    """将 NaN 还原为 None，便于 JSON 输出"""
+    return [None if v != v else v for v in values]
+
+
+def _is_number(value) -> bool:
+    """可存入数值列的指标值（None 记为缺失）"""
+    return value is None or (isinstance(value, (int, float)) and not isinstance(value, bool))
+
+
+def _csv_value(value):
+    """对象/数组类指标值在 CSV 中以 JSON 输出"""
+    return json.dumps(value, ensure_ascii=False) if isinstance(value, (dict, list)) else value
+
+
+def _bucket_list(agg: dict) -> list:
+    """统一桶列表格式（filters 等聚合返回以名称为键的桶）"""
+    buckets = agg.get("buckets", [])
+    if isinstance(buckets, dict):
+        return [{"key": key, **bucket} for key, bucket in buckets.items()]
+    return buckets
+
+
+def _flatten_buckets(name: str, agg: dict, parent: dict, columns: dict, count: list):
+    """将嵌套桶树展开为列，每个叶子桶一行"""
+    for bucket in _bucket_list(agg):
+        row = dict(parent)
+        row[name] = bucket.get("key_as_string", bucket.get("key"))
+        children = _bucket_children(bucket)
+        metrics = _bucket_metrics(bucket)
+        if children:
+            row[f"{name}.doc_count"] = bucket.get("doc_count")
+            row.update({f"{name}.{m}": v for m, v in metrics.items()})
+            for child_name, child in children:
+                _flatten_buckets(child_name, child, row, columns, count)
+            continue
+        row["doc_count"] = bucket.get("doc_count")
+        row.update(metrics)
+        for column in row:
+            if column not in columns:
+                columns[column] = [None] * count[0]
+        for column, values in columns.items():
+            values.append(row.get(column))
+        count[0] += 1
+
+
+def _flatten_aggregations(aggregations: dict, format: str) -> dict:
+    """将聚合结果转换为列式 JSON 或 CSV 表格"""
+    tables = {}
+    metrics = _bucket_metrics(aggregations)
+    for name, agg in _bucket_children(aggregations):
+        columns = {}
+        count = [0]
+        _flatten_buckets(name, agg, {}, columns, count)
+        if format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer, lineterminator="\n")
+            writer.writerow(columns)
+            writer.writerows(zip(*columns.values()))
+            tables[name] = buffer.getvalue()
+        else:
+            tables[name] = {"rows": count[0], "columns": columns}
+    result = {"tables": tables}
+    if metrics:
+        result["metrics"] = metrics
+    return result
+
+
+def _source_values(hit: dict, path: str) -> list:
+    """按点分路径取出文档字段值（_id 取元数据），统一返回列表"""
+    if path == "_id":
+        return [hit.get("_id")]
+    value = hit.get("_source") or {}
+    for part in path.split("."):
+        if isinstance(value, list):
+            value = [v.get(part) for v in value if isinstance(v, dict)]
+        elif isinstance(value, dict):
+            value = value.get(part)
+        else:
+            return []
+    if value is None:
+        return []
+    values = value if isinstance(value, list) else [value]
+    return [v for v in values if v is not None and not isinstance(v, (dict, list))]
+
+
+def _join_key(value) -> str:
+    """关联键统一为字符串（数值 123 与 "123"、1.0 与 1 视为相同）"""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _sql_page(body: dict) -> tuple:
+    """执行一次 SQL 请求，返回 (columns, rows, cursor)"""
+    client = get_client()
+    result = client.post("/_sql?format=json", body)
+    columns = result.get("columns") or result.get("schema") or []
+    rows = result.get("rows") if "rows" in result else result.get("datarows", [])
+    return columns, rows, result.get("cursor")
+
+
+def _sql_result(columns: list, rows: list, columnar: bool) -> dict:
+    """组装 SQL 结果，columnar 为 True 时按列输出"""
+    if not columnar:
+        return {"columns": columns, "rows": rows}
+    # 后续分页不返回 columns，此时按列序号命名
+    names = [c.get("name") for c in columns] or [str(i) for i in range(len(rows[0]) if rows else 0)]
+    data = [list(col) for col in zip(*rows)] if rows else [[] for _ in names]
+    return {"columns": columns, "data": dict(zip(names, data))}
+
+
+def _walk_profile(nodes: list, shard: str, out: list, depth: int = 0):
+    """展开 profile 树节点，计算自身耗时（去掉子节点耗时）"""
+    for node in nodes:
+        children = node.get("children", [])
+        total = node.get("time_in_nanos", 0)
+        out.append({
+            "shard": shard,
+            "type": node.get("type") or node.get("name"),
+            "description": (node.get("description") or node.get("reason") or "")[:200],
+            "depth": depth,
+            "total_ns": total,
+            "self_ns": max(0, total - sum(c.get("time_in_nanos", 0) for c in children))
+        })
+        _walk_profile(children, shard, out, depth + 1)
+
+
+def _ms(nanos: float) -> float:
+    """纳秒转毫秒"""
+    return round(nanos / 1e6, 3)
+
+
+def _profile_summary(profile: dict, top_n: int) -> dict:
+    """将各分片的原始 profile 树汇总为热点排名"""
+    queries, collectors, aggregations = [], [], []
+    rewrite_ns = 0
+    shard_ns = {}
+    for shard in profile.get("shards", []):
+        shard_id = shard.get("id")
+        for search in shard.get("searches", []):
+            _walk_profile(search.get("query", []), shard_id, queries)
+            _walk_profile(search.get("collector", []), shard_id, collectors)
+            rewrite_ns += search.get("rewrite_time", 0)
+            shard_ns[shard_id] = shard_ns.get(shard_id, 0) + search.get("rewrite_time", 0) + sum(
+                q.get("time_in_nanos", 0) for q in search.get("query", []))
+        _walk_profile(shard.get("aggregations", []), shard_id, aggregations)
+        shard_ns[shard_id] = shard_ns.get(shard_id, 0) + sum(
+            a.get("time_in_nanos", 0) for a in shard.get("aggregations", []))
+    
+    def by_type(nodes: list) -> list:
+        totals = {}
+        for n in nodes:
+            entry = totals.setdefault(n["type"], {"type": n["type"], "count": 0, "self_ns": 0})
+            entry["count"] += 1
+            entry["self_ns"] += n["self_ns"]
+        ranked = sorted(totals.values(), key=lambda e: e["self_ns"], reverse=True)[:top_n]
+        return [{"type": e["type"], "count": e["count"], "self_ms": _ms(e["self_ns"])} for e in ranked]
+    
+    nodes = [dict(n, kind=kind) for kind, items in
+             (("query", queries), ("collector", collectors), ("aggregation", aggregations))
+             for n in items]
+    hotspots = sorted(nodes, key=lambda n: n["self_ns"], reverse=True)[:top_n]
+    
+    shard_times = sorted(shard_ns.values())
+    skew = None
+    if shard_times:
+        median = shard_times[len(shard_times) // 2]
+        skew = round(shard_times[-1] / median, 2) if median else None
+    slowest = sorted(shard_ns.items(), key=lambda kv: kv[1], reverse=True)[:top_n]
+    
+    return {
+        "hotspots": [{
+            "kind": n["kind"],
+            "type": n["type"],
+            "description": n["description"],
+            "shard": n["shard"],
+            "self_ms": _ms(n["self_ns"]),
+            "total_ms": _ms(n["total_ns"])
+        } for n in hotspots],
+        "query_types": by_type(queries),
+        "collectors": by_type(collectors),
+        "aggregations": by_type(aggregations),
+        "rewrite_ms": _ms(rewrite_ns),
+        "shards": {
+            "count": len(shard_ns),
+            "max_ms": _ms(shard_times[-1]) if shard_times else 0,
+            "min_ms": _ms(shard_times[0]) if shard_times else 0,
+            "skew": skew,
+            "slowest": [{"shard": k, "ms": _ms(v)} for k, v in slowest]
+        }
+    }
 
 
 def register_search_tools(mcp: FastMCP):
@@ -12,7 +378,8 @@ def register_search_tools(mcp: FastMCP):
     @mcp.tool()
     def search(index: str, query: dict = None, size: int = 10, from_: int = 0, 
                sort: list = None, source: list = None, aggs: dict = None,
-               highlight: dict = None, track_total_hits: bool = True) -> dict:
+               highlight: dict = None, track_total_hits: bool = True, dry_run: bool = False,
+               optimize: bool = False) -> dict:
         """
         执行搜索查询
         
@@ -26,6 +393,11 @@ def register_search_tools(mcp: FastMCP):
             aggs: 聚合定义
             highlight: 高亮配置
             track_total_hits: 是否精确统计总数
+            dry_run: 仅评估查询成本并返回明细，不执行查询
+            optimize: 根据映射改写查询（非评分子句移入 filter、精确字段的 match 改为 term）
+        
+        执行前会评估查询成本（见 EASYSEARCH_QUERY_GUARD / EASYSEARCH_QUERY_BUDGET），
+        超出预算时按配置告警、拒绝、改写或限流
         
         示例 - 全文搜索:
             search("products", query={"match": {"name": "iPhone"}})
@@ -45,6 +417,10 @@ def register_search_tools(mcp: FastMCP):
         client = get_client()
         body = {"size": size, "from": from_}
         
+        optimized = None
+        if query and optimize:
+            optimized = rewrite_query(index, query, scoring_matters(size, sort))
+            query = optimized["query"]
         if query:
             body["query"] = query
         if sort:
@@ -58,7 +434,10 @@ def register_search_tools(mcp: FastMCP):
         if track_total_hits is not None:
             body["track_total_hits"] = track_total_hits
         
-        result = client.post(f"/{index}/_search", body)
+        if dry_run:
+            return estimate_cost(index, body)
+        with guard(index, body) as (body, report):
+            result = client.post(f"/{index}/_search", body)
         hits = result.get("hits", {})
         
         response = {
@@ -77,6 +456,10 @@ def register_search_tools(mcp: FastMCP):
         
         if "aggregations" in result:
             response["aggregations"] = result["aggregations"]
+        if report:
+            response["guard"] = report
+        if optimized:
+            response["optimize"] = optimized
         
         return response
     
@@ -102,6 +485,372 @@ def register_search_tools(mcp: FastMCP):
         
         return search(index, query=query, size=size)
     
+    @mcp.tool()
+    def search_sample(index: str, size: int = 100, query: dict = None, seed: int = None,
+                      stratify_field: str = None, strata: int = 10, allocation: str = "equal",
+                      source: list = None, max_bytes: int = 1000000) -> dict:
+        """
+        随机抽样文档（可按字段分层）
+        
+        参数:
+            index: 索引名称
+            size: 样本数量
+            query: 过滤条件（可选，只在匹配的文档中抽样）
+            seed: 随机种子（相同种子得到相同样本，不传则随机生成并在结果中返回）
+            stratify_field: 分层字段（keyword 类字段，可选）
+            strata: 最多分层数（取文档数最多的前 N 个取值）
+            allocation: 分层样本分配方式 equal（每层相同）/proportional（按文档数比例）
+            source: 返回的字段列表
+            max_bytes: 返回的 _source 总字节数上限，超过后截断（分层时按各层配额比例交替选取，
+                       各层保留相同比例的样本）
+        
+        示例:
+            search_sample("logs", size=50, seed=7)
+            search_sample("orders", size=100, stratify_field="status", source=["status", "amount"])
+        """
+        if allocation not in ("equal", "proportional"):
+            raise ValueError(f"不支持的分配方式: {allocation}")
+        if not stratify_field and size > SAMPLE_WINDOW:
+            raise ValueError(f"size 不能超过 {SAMPLE_WINDOW}")
+        client = get_client()
+        if seed is None:
+            seed = random.randrange(2 ** 31)
+        def random_query(q: dict) -> dict:
+            return {
+                "function_score": {
+                    "query": q or {"match_all": {}},
+                    "random_score": {"seed": seed, "field": "_seq_no"},
+                    "boost_mode": "replace"
+                }
+            }
+        
+        capped = []
+        if stratify_field:
+            # 先取各层文档数并计算配额，再按层各取配额数量的随机文档
+            body = {"size": 0, "aggs": {"strata": {"terms": {"field": stratify_field, "size": strata}}}}
+            if query:
+                body["query"] = query
+            result = client.post(f"/{index}/_search", body)
+            buckets = result.get("aggregations", {}).get("strata", {}).get("buckets", [])
+            total = sum(b.get("doc_count", 0) for b in buckets)
+            quotas = []
+            for i, b in enumerate(buckets):
+                if allocation == "equal":
+                    quota = size // len(buckets) + (1 if i < size % len(buckets) else 0)
+                else:
+                    quota = round(size * b.get("doc_count", 0) / total) if total else 0
+                quota = min(quota, b.get("doc_count", 0))
+                if quota > SAMPLE_WINDOW:
+                    capped.append(b.get("key"))
+                    quota = SAMPLE_WINDOW
+                quotas.append(quota)
+            searches = []
+            for b, quota in zip(buckets, quotas):
+                if quota:
+                    stratum = {"bool": {"filter": [q for q in (query, {"term": {stratify_field: b["key"]}}) if q]}}
+                    search = {"size": quota, "query": random_query(stratum)}
+                    if source is not None:
+                        search["_source"] = source
+                    searches.append(({}, search))
+            responses = iter(client.msearch(searches, index).get("responses", []) if searches else [])
+            groups = []
+            for b, quota in zip(buckets, quotas):
+                hits = next(responses, {}).get("hits", {}).get("hits", []) if quota else []
+                groups.append((b.get("key"), b.get("doc_count"), hits))
+        else:
+            body = {"size": size, "query": random_query(query)}
+            if source is not None:
+                body["_source"] = source
+            result = client.post(f"/{index}/_search", body)
+            groups = [(None, result.get("hits", {}).get("total", {}).get("value", 0),
+                       result.get("hits", {}).get("hits", []))]
+        
+        # 按各层已取比例交替选取，字节数超限时各层都只保留相同比例的样本
+        order = sorted(((rank + 0.5) / len(hits), g, rank)
+                       for g, (_, _, hits) in enumerate(groups) for rank in range(len(hits)))
+        taken = [0] * len(groups)
+        used = 0
+        truncated = False
+        for _, g, rank in order:
+            doc_bytes = len(json.dumps(groups[g][2][rank].get("_source"), ensure_ascii=False).encode())
+            if used + doc_bytes > max_bytes:
+                truncated = True
+                break
+            used += doc_bytes
+            taken[g] += 1
+        docs = []
+        strata_counts = {}
+        for (key, doc_count, hits), count in zip(groups, taken):
+            for h in hits[:count]:
+                doc = {"_index": h.get("_index"), "_id": h.get("_id"), "_source": h.get("_source")}
+                if stratify_field:
+                    doc["stratum"] = key
+                docs.append(doc)
+            if stratify_field:
+                strata_counts[key] = {"docs": doc_count, "sampled": count}
+                if count < len(hits):
+                    strata_counts[key]["truncated"] = len(hits) - count
+        
+        response = {
+            "seed": seed,
+            "sampled": len(docs),
+            "bytes": used,
+            "truncated": truncated,
+            "docs": docs
+        }
+        if stratify_field:
+            response["strata"] = strata_counts
+            if capped:
+                # 配额超过单次请求上限的层只取到上限，比例会偏低
+                response["quota_capped"] = capped
+        else:
+            response["population"] = groups[0][1]
+        return response
+    
+    @mcp.tool()
+    def search_join(left_index: str, left_field: str, right_index: str, right_field: str = "_id",
+                    left_query: dict = None, left_source: list = None, right_source: list = None,
+                    join_type: str = "inner", max_rows: int = 1000, chunk_size: int = 500,
+                    max_concurrency: int = 4, max_matches: int = 10) -> dict:
+        """
+        跨索引关联查询（批量 lookup join，替代逐条查询右表）
+        
+        参数:
+            left_index: 左表索引
+            left_field: 左表关联字段（支持点分路径，_id 表示文档 ID）
+            right_index: 右表索引
+            right_field: 右表关联字段（默认 _id，使用 _mget；其他字段使用 terms 查询并按该字段 collapse，
+                         需为单值的 keyword/数值等有 doc_values 的字段）
+            left_query: 左表查询条件（可选）
+            left_source: 左表返回字段
+            right_source: 右表返回字段
+            join_type: inner（只保留有匹配的行）/left（保留全部左表行）
+            max_rows: 最多读取的左表文档数
+            chunk_size: 每批 lookup 的关联键数量
+            max_concurrency: 并发 lookup 请求数上限
+            max_matches: 每个关联键最多关联的右表文档数（超过时在结果中标记 truncated）
+        
+        关联键两侧统一按字符串比较（123 与 "123" 视为相同）
+        
+        示例:
+            search_join("orders", "customer_id", "customers",
+                        left_query={"range": {"amount": {"gte": 1000}}},
+                        right_source=["name", "level"])
+            search_join("orders", "sku", "products", right_field="sku", join_type="left")
+        """
+        if join_type not in ("inner", "left"):
+            raise ValueError(f"不支持的关联方式: {join_type}")
+        if max_rows < 1 or max_matches < 1 or not 1 <= chunk_size <= SAMPLE_WINDOW:
+            raise ValueError(f"max_rows、max_matches 必须 >= 1，chunk_size 必须在 1 到 {SAMPLE_WINDOW} 之间")
+        client = get_client()
+        left_body = {"query": left_query} if left_query else {}
+        if left_source is not None:
+            fields = set(left_source) | ({left_field} if left_field != "_id" else set())
+            left_body["_source"] = sorted(fields)
+        
+        def lookup(keys: list) -> dict:
+            """查询一批关联键，返回 键 -> 右表文档列表"""
+            matches = {}
+            if right_field == "_id":
+                body = {"ids": keys}
+                if right_source is not None:
+                    body["_source"] = right_source
+                for doc in client.post(f"/{right_index}/_mget", body).get("docs", []):
+                    if doc.get("found"):
+                        matches.setdefault(doc["_id"], []).append(
+                            {"_id": doc["_id"], "_source": doc.get("_source")})
+                return matches
+            # 按关联字段 collapse：每个键一组，组内最多 max_matches 条，热点键不会挤占其他键
+            inner_hits = {"name": "matches", "size": max_matches}
+            if right_source is not None:
+                inner_hits["_source"] = right_source
+            body = {
+                "size": len(keys),
+                "_source": False,
+                "query": {"bool": {"filter": [{"terms": {right_field: keys}}]}},
+                "collapse": {"field": right_field, "inner_hits": inner_hits}
+            }
+            for hit in client.post(f"/{right_index}/_search", body).get("hits", {}).get("hits", []):
+                group = hit.get("inner_hits", {}).get("matches", {}).get("hits", {})
+                for key in hit.get("fields", {}).get(right_field, []):
+                    total = group.get("total", {})
+                    total = total.get("value", 0) if isinstance(total, dict) else total
+                    matches[_join_key(key)] = [{"_id": h["_id"], "_source": h.get("_source")}
+                                               for h in group.get("hits", [])]
+                    if total > max_matches:
+                        truncated_keys.add(_join_key(key))
+            return matches
+        
+        rows = []
+        stats = {"left_rows": 0, "keys": 0, "lookups": 0}
+        window = []
+        truncated_keys = set()
+        
+        def flush():
+            """对当前窗口的关联键分块并发 lookup，并输出关联行"""
+            keys = sorted({k for _, ks in window for k in ks}, key=str)
+            chunks = [keys[i:i + chunk_size] for i in range(0, len(keys), max(1, chunk_size))]
+            matches = {}
+            for part in parallel_map(lookup, chunks, max_concurrency):
+                for key, docs in part.items():
+                    matches.setdefault(key, []).extend(docs)
+            stats["keys"] += len(keys)
+            stats["lookups"] += len(chunks)
+            for hit, ks in window:
+                right = [d for k in ks for d in matches.get(k, [])]
+                if right or join_type == "left":
+                    row = {"_id": hit.get("_id"), "left": hit.get("_source"), "right": right[:max_matches]}
+                    if len(right) > max_matches or truncated_keys.intersection(ks):
+                        row["truncated"] = True
+                    rows.append(row)
+            window.clear()
+        
+        # 左表按窗口流式读取，每个窗口的关联键分块并发查询
+        for hit in scan(left_index, left_body, page_size=min(max_rows, 1000)):
+            window.append((hit, list(dict.fromkeys(_join_key(k) for k in _source_values(hit, left_field)))))
+            stats["left_rows"] += 1
+            if len(window) >= chunk_size * max(1, max_concurrency):
+                flush()
+            if stats["left_rows"] >= max_rows:
+                break
+        if window:
+            flush()
+        
+        return {**stats, "rows_returned": len(rows), "truncated_keys": len(truncated_keys), "rows": rows}
+    
+    @mcp.tool()
+    def search_follow(index: str = None, follow_id: str = None, query: dict = None,
+                      timestamp_field: str = "@timestamp", tiebreaker: str = None,
+                      start: str = "now-1m", size: int = 100, overlap_s: float = 5,
+                      source: list = None) -> dict:
+        """
+        跟随读取时序索引的新文档（类似 tail -f）
+        
+        首次调用传入 index 创建跟随游标，之后只传 follow_id 即可获取上次之后新写入的文档。
+        游标保存在服务端，每次从 (最后时间戳 - overlap_s) 开始按 (时间戳, tiebreaker) 排序读取，
+        重叠窗口内已返回过的文档会被去重，避免写入延迟导致的漏读。
+        未指定 tiebreaker 时每次读取打开 PIT，以 _shard_doc 作为同一时间戳内的排序依据
+        
+        参数:
+            index: 索引名称（创建游标时必填）
+            follow_id: 已有游标 ID
+            query: 过滤条件（创建游标时指定）
+            timestamp_field: 时间戳字段
+            tiebreaker: 时间戳相同时的排序字段（可选，需唯一且有 doc_values，如 keyword 类型的事件 ID）
+            start: 创建游标时的起始时间（日期表达式，如 now-5m 或 2024-01-01T00:00:00Z）
+            size: 本次最多返回的新文档数
+            overlap_s: 重叠窗口（秒），应大于数据写入到可搜索的最大延迟
+            source: 返回的字段列表（创建游标时指定）
+        
+        示例:
+            search_follow("logs-*", query={"term": {"level": "error"}}, start="now-5m")
+            search_follow(follow_id="...")
+        """
+        client = get_client()
+        now = time.monotonic()
+        for key in [k for k, f in _follows.items() if now - f["used"] > FOLLOW_IDLE_TTL]:
+            del _follows[key]
+        
+        if follow_id:
+            state = _follows.get(follow_id)
+            if state is None:
+                raise ValueError(f"跟随游标不存在或已过期: {follow_id}")
+        elif index:
+            fields = get_mapping_cache().fields(index)
+            ts_info = fields.get(timestamp_field)
+            if ts_info is None or ts_info["type"] not in ("date", "date_nanos"):
+                raise ValueError(f"时间戳字段不存在或不是日期类型: {timestamp_field}")
+            if tiebreaker and not (fields.get(tiebreaker) or {}).get("aggregatable"):
+                raise ValueError(f"tiebreaker 字段需存在于映射中且有 doc_values（如 keyword）: {tiebreaker}")
+            follow_id = uuid.uuid4().hex
+            state = {
+                "index": index, "query": query, "timestamp_field": timestamp_field,
+                "tiebreaker": tiebreaker, "source": source, "overlap_ms": int(overlap_s * 1000),
+                # date_nanos 字段的排序值为纳秒
+                "unit": 1000000 if ts_info["type"] == "date_nanos" else 1,
+                "last": None, "seen": {}
+            }
+            _follows[follow_id] = state
+        else:
+            raise ValueError("需要 index（创建游标）或 follow_id")
+        state["used"] = now
+        
+        ts_field = state["timestamp_field"]
+        if state["last"] is None:
+            since = {"gte": start}
+        else:
+            since = {"gte": state["last"][0] // state["unit"] - state["overlap_ms"], "format": "epoch_millis"}
+        filters = [{"range": {ts_field: since}}]
+        if state["query"]:
+            filters.append(state["query"])
+        body = {
+            "size": size,
+            "query": {"bool": {"filter": filters}},
+            "sort": [{ts_field: "asc"}, {state["tiebreaker"] or "_shard_doc": "asc"}]
+        }
+        if state["source"] is not None:
+            body["_source"] = state["source"]
+        pit_id, close = (None, None) if state["tiebreaker"] else open_pit(state["index"], "1m")
+        if not state["tiebreaker"] and not pit_id:
+            raise ValueError("集群不支持 PIT，请指定 tiebreaker 字段")
+        
+        docs = []
+        duplicates = 0
+        search_after = None
+        try:
+            while len(docs) < size:
+                if search_after:
+                    body["search_after"] = search_after
+                if pit_id:
+                    body["pit"] = {"id": pit_id, "keep_alive": "1m"}
+                    result = client.post("/_search", body)
+                    pit_id = result.get("pit_id", pit_id)
+                else:
+                    result = client.post(f"/{state['index']}/_search", body)
+                hits = result.get("hits", {}).get("hits", [])
+                for h in hits:
+                    key = f"{h.get('_index')}/{h.get('_id')}"
+                    if key in state["seen"]:
+                        duplicates += 1
+                        continue
+                    state["seen"][key] = h["sort"][0]
+                    if state["last"] is None or h["sort"][0] > state["last"][0]:
+                        state["last"] = h["sort"]
+                    docs.append({"_index": h.get("_index"), "_id": h.get("_id"), "_source": h.get("_source")})
+                    if len(docs) >= size:
+                        break
+                if len(hits) < size:
+                    break
+                search_after = hits[-1]["sort"]
+        finally:
+            if close:
+                try:
+                    close(pit_id)
+                except Exception:
+                    pass
+        
+        # 只保留重叠窗口内的已读记录
+        if state["last"]:
+            horizon = state["last"][0] - state["overlap_ms"] * state["unit"]
+            state["seen"] = {k: ts for k, ts in state["seen"].items() if ts >= horizon}
+        
+        return {
+            "follow_id": follow_id,
+            "docs": docs,
+            "duplicates_skipped": duplicates,
+            "cursor": state["last"]
+        }
+    
+    @mcp.tool()
+    def search_follow_stop(follow_id: str) -> dict:
+        """
+        停止跟随读取，释放服务端游标
+        
+        参数:
+            follow_id: 跟随游标 ID
+        """
+        return {"follow_id": follow_id, "stopped": _follows.pop(follow_id, None) is not None}
+    
     @mcp.tool()
     def search_template(index: str, id: str = None, source: str = None, params: dict = None) -> dict:
         """
@@ -139,30 +888,134 @@ def register_search_tools(mcp: FastMCP):
             ])
         """
         client = get_client()
-        import json
-        lines = []
-        for s in searches:
-            lines.append(json.dumps(s.get("header", {})))
-            lines.append(json.dumps(s.get("body", {})))
-        body = "\n".join(lines) + "\n"
-        return client.post("/_msearch", content=body, headers={"Content-Type": "application/x-ndjson"})
+        return client.msearch([(s.get("header", {}), s.get("body", {})) for s in searches])
     
     @mcp.tool()
-    def count(index: str, query: dict = None) -> dict:
+    def count(index: str, query: dict = None, optimize: bool = False, at_least: int = None,
+              terminate_after: int = None, fast: bool = False, max_age: float = 30) -> dict:
         """
         统计文档数量
         
         参数:
             index: 索引名称
             query: 查询条件（可选）
+            optimize: 根据映射改写查询（计数不需要评分，可过滤子句全部移入 filter）
+            at_least: 只需判断"是否至少有 N 条"时使用，计数到 N 即停止（track_total_hits=N）
+            terminate_after: 每个分片最多计数的文档数，达到后提前结束
+            fast: 无查询条件时直接读取索引统计中的文档数（不执行查询，结果为近似值；
+                  带过滤条件的别名仍执行 _count）
+            max_age: fast 模式下缓存的文档数有效期（秒）
+        
+        返回结果中的 exact 表示计数是否精确
         
         示例:
             count("products")
             count("products", query={"term": {"status": "active"}})
+            count("logs", query={"match": {"level": "error"}}, at_least=1000)
+            count("logs", fast=True)
         """
         client = get_client()
-        body = {"query": query} if query else None
-        return client.post(f"/{index}/_count", body)
+        optimized = None
+        if query and optimize:
+            optimized = rewrite_query(index, query, scoring=False)
+            query = optimized["query"]
+        
+        if fast and not query:
+            cached = _doc_counts.get(index)
+            now = time.monotonic()
+            if cached is None or now - cached[0] > max_age:
+                cached = (now, None, _filtered_alias(index))
+                if not cached[2]:
+                    stats = client.get(f"/{index}/_stats/docs",
+                                       {"filter_path": "_all.primaries.docs.count"})
+                    count = stats.get("_all", {}).get("primaries", {}).get("docs", {}).get("count", 0)
+                    cached = (now, count, False)
+                _doc_counts[index] = cached
+            # 别名过滤条件不体现在索引统计中，此时仍执行 _count
+            if not cached[2]:
+                return {
+                    # 统计值可能来自缓存、包含 nested 子文档，且与 _count 的刷新可见性不同
+                    "count": cached[1],
+                    "exact": False,
+                    "method": "index_stats",
+                    "age_s": round(now - cached[0], 1),
+                    "includes_nested_docs": any(
+                        f["type"] == "nested" for f in get_mapping_cache().fields(index).values())
+                }
+        
+        if at_least:
+            body = {"size": 0, "track_total_hits": at_least}
+            if query:
+                body["query"] = query
+            if terminate_after:
+                body["terminate_after"] = terminate_after
+            result = client.post(f"/{index}/_search", body)
+            total = result.get("hits", {}).get("total", {})
+            response = {
+                "count": total.get("value", 0),
+                "exact": total.get("relation", "eq") == "eq" and not result.get("terminated_early", False),
+                "at_least": total.get("value", 0) >= at_least,
+                "method": "track_total_hits"
+            }
+            if result.get("terminated_early"):
+                response["terminated_early"] = True
+        else:
+            body = {"query": query} if query else None
+            params = {"terminate_after": terminate_after} if terminate_after else None
+            response = client.post(f"/{index}/_count", body, params=params)
+            response["exact"] = not response.get("terminated_early", False)
+        if optimized:
+            response["optimize"] = optimized
+        return response
+    
+    @mcp.tool()
+    def query_optimize(index: str, query: dict, sort: list = None, size: int = 10,
+                       measure: bool = True, runs: int = 3) -> dict:
+        """
+        根据映射优化查询，并对比改写前后的耗时
+        
+        参数:
+            index: 索引名称
+            query: DSL 查询条件
+            sort: 排序规则（不按 _score 排序时，可过滤子句全部移入 filter）
+            size: 返回数量（0 表示只计数/聚合，不需要评分）
+            measure: 是否实际执行改写前后的查询并对比耗时（禁用请求缓存）
+            runs: 每个版本执行的次数，取耗时中位数
+        
+        返回改写前后的 DSL、改写说明、无法改写的问题，以及耗时对比
+        
+        示例:
+            query_optimize("products", {"bool": {"must": [
+                {"match": {"status": "active"}},
+                {"range": {"price": {"lte": 100}}}
+            ]}})
+        """
+        client = get_client()
+        optimized = rewrite_query(index, query, scoring_matters(size, sort))
+        response = {
+            "before": query,
+            "after": optimized["query"],
+            "changes": optimized["changes"],
+            "flags": optimized["flags"]
+        }
+        if not measure or not optimized["changes"]:
+            return response
+        
+        def took(q: dict) -> int:
+            body = {"size": size, "query": q, "track_total_hits": True}
+            if sort:
+                body["sort"] = sort
+            result = client.post(f"/{index}/_search", body, params={"request_cache": "false"})
+            return result.get("took", 0)
+        
+        timings = {"before": [], "after": []}
+        for _ in range(max(1, runs)):
+            timings["before"].append(took(query))
+            timings["after"].append(took(optimized["query"]))
+        before = sorted(timings["before"])[len(timings["before"]) // 2]
+        after = sorted(timings["after"])[len(timings["after"]) // 2]
+        response["took_ms"] = {"before": before, "after": after, "diff": after - before}
+        return response
     
     @mcp.tool()
     def validate_query(index: str, query: dict, explain: bool = False, rewrite: bool = False) -> dict:
@@ -184,6 +1037,99 @@ def register_search_tools(mcp: FastMCP):
             params["rewrite"] = "true"
         return client.post(f"/{index}/_validate/query", body)
     
+    @mcp.tool()
+    def query_validate_local(index: str, query: dict = None, aggs: dict = None, sort: list = None) -> dict:
+        """
+        基于缓存映射在本地校验查询中的字段（不执行查询）
+        
+        检查字段是否存在、查询/聚合/排序类型与字段类型是否匹配、
+        nested 字段是否在 nested 上下文中使用，并给出修正建议（如 name.keyword）。
+        映射已缓存时不访问集群
+        
+        参数:
+            index: 索引名称（支持通配符）
+            query: 查询条件
+            aggs: 聚合定义
+            sort: 排序
+        
+        示例:
+            query_validate_local("logs-*", query={"term": {"message": "error"}},
+                                 aggs={"by_host": {"terms": {"field": "host"}}})
+        """
+        if not (query or aggs or sort):
+            raise ValueError("query、aggs、sort 至少需要指定一个")
+        return validate(index, query, aggs, sort)
+    
+    @mcp.tool()
+    def search_profile(index: str, query: dict = None, aggs: dict = None, size: int = 10,
+                       compare_query: dict = None, compare_aggs: dict = None, top_n: int = 10,
+                       runs: int = 3) -> dict:
+        """
+        分析查询性能（profile），汇总耗时热点
+        
+        参数:
+            index: 索引名称
+            query: DSL 查询条件
+            aggs: 聚合定义（可选）
+            size: 返回文档数
+            compare_query: 对比的另一种查询写法（可选，两者并排比较）
+            compare_aggs: 对比查询的聚合定义（可选，默认与 aggs 相同）
+            top_n: 每项排名返回的条目数
+            runs: 对比时每种写法的执行次数（先各预热一次，之后交替顺序执行）
+        
+        返回按自身耗时排序的热点（查询节点、collector、聚合），各查询类型/collector/聚合的
+        耗时汇总、rewrite 耗时，以及分片间耗时倾斜（最慢分片 / 中位数）
+        
+        示例:
+            search_profile("logs", query={"wildcard": {"message": "*error*"}})
+            search_profile("logs", query={"wildcard": {"message": "*error*"}},
+                           compare_query={"match": {"message": "error"}})
+        """
+        client = get_client()
+        
+        def run(q: dict, a: dict) -> dict:
+            body = {"size": size, "profile": True}
+            if q:
+                body["query"] = q
+            if a:
+                body["aggs"] = a
+            result = client.post(f"/{index}/_search", body, params={"request_cache": "false"})
+            summary = _profile_summary(result.get("profile", {}), top_n)
+            summary["took_ms"] = result.get("took")
+            summary["total"] = result.get("hits", {}).get("total", {}).get("value", 0)
+            return summary
+        
+        if compare_query is None and compare_aggs is None:
+            return run(query, aggs)
+        
+        variants = [(query, aggs),
+                    (compare_query if compare_query is not None else query,
+                     compare_aggs if compare_aggs is not None else aggs)]
+        # 顺序执行避免两者互相争用资源；先各预热一次，之后交替先后顺序
+        for q, a in variants:
+            run(q, a)
+        summaries = [[], []]
+        for i in range(max(1, runs)):
+            order = (0, 1) if i % 2 == 0 else (1, 0)
+            for which in order:
+                summaries[which].append(run(*variants[which]))
+        
+        def pick(results: list) -> dict:
+            """取耗时中位数的一次作为代表，附带每次耗时"""
+            ordered = sorted(results, key=lambda r: r["took_ms"] or 0)
+            summary = dict(ordered[len(ordered) // 2])
+            summary["took_ms_runs"] = [r["took_ms"] for r in results]
+            return summary
+        
+        base, variant = pick(summaries[0]), pick(summaries[1])
+        return {
+            "base": base,
+            "variant": variant,
+            "runs": max(1, runs),
+            "took_ms_diff": (variant["took_ms"] or 0) - (base["took_ms"] or 0),
+            "slowest_shard_ms_diff": round(variant["shards"]["max_ms"] - base["shards"]["max_ms"], 3)
+        }
+    
     @mcp.tool()
     def explain(index: str, id: str, query: dict) -> dict:
         """
@@ -201,7 +1147,9 @@ def register_search_tools(mcp: FastMCP):
         return client.post(f"/{index}/_explain/{id}", body)
     
     @mcp.tool()
-    def aggregate(index: str, aggs: dict, query: dict = None, size: int = 0) -> dict:
+    def aggregate(index: str, aggs: dict, query: dict = None, size: int = 0,
+                  format: str = "json", dry_run: bool = False, optimize: bool = False,
+                  use_rollup: bool = False) -> dict:
         """
         执行聚合查询
         
@@ -210,6 +1158,11 @@ def register_search_tools(mcp: FastMCP):
             aggs: 聚合定义
             query: 过滤条件（可选）
             size: 返回文档数（默认 0，仅返回聚合结果）
+            format: 输出格式 json（原始嵌套结构）/columns（展开为列式表格）/csv（展开为 CSV 文本）
+            dry_run: 仅评估查询成本并返回明细，不执行查询
+            optimize: 根据映射改写过滤条件（可过滤子句移入 filter、精确字段的 match 改为 term）
+            use_rollup: 聚合与已创建的 rollup 匹配时由 rollup 回答（时间范围需与聚合间隔对齐，
+                        不满足条件时仍由集群执行）
         
         示例 - 分组统计:
             aggregate("orders", aggs={
@@ -235,17 +1188,54 @@ def register_search_tools(mcp: FastMCP):
                     }
                 }
             })
+        
+        示例 - 多级聚合展开为表格（每个叶子桶一行，列为各级 key 和指标）:
+            aggregate("logs", aggs={...}, format="csv")
         """
+        if format not in ("json", "columns", "csv"):
+            raise ValueError(f"不支持的输出格式: {format}")
         client = get_client()
         body = {"size": size, "aggs": aggs}
+        optimized = None
+        if query and optimize:
+            optimized = rewrite_query(index, query, scoring_matters(size))
+            query = optimized["query"]
         if query:
             body["query"] = query
-        result = client.post(f"/{index}/_search", body)
-        return {
+        if dry_run:
+            return estimate_cost(index, body)
+        
+        rollup_name = None
+        if use_rollup and not size:
+            rollup_name, plan = rollups.match_aggregate(index, aggs, query)
+        if rollup_name:
+            started = time.monotonic()
+            aggregations = rollups.answer_aggregate(rollup_name, plan)
+            result = {
+                "took": int((time.monotonic() - started) * 1000),
+                "hits": {"total": {"value": sum(
+                    b["doc_count"] for b in aggregations[plan["name"]]["buckets"])}},
+                "aggregations": aggregations
+            }
+            report = None
+        else:
+            with guard(index, body) as (body, report):
+                result = client.post(f"/{index}/_search", body)
+        response = {
             "took_ms": result.get("took"),
-            "total": result.get("hits", {}).get("total", {}).get("value", 0),
-            "aggregations": result.get("aggregations", {})
+            "total": result.get("hits", {}).get("total", {}).get("value", 0)
         }
+        if rollup_name:
+            response["rollup"] = rollup_name
+        if format == "json":
+            response["aggregations"] = result.get("aggregations", {})
+        else:
+            response.update(_flatten_aggregations(result.get("aggregations", {}), format))
+        if report:
+            response["guard"] = report
+        if optimized:
+            response["optimize"] = optimized
+        return response
     
     @mcp.tool()
     def aggregate_simple(index: str, field: str, agg_type: str = "terms", size: int = 10) -> dict:
@@ -273,6 +1263,117 @@ def register_search_tools(mcp: FastMCP):
         result = aggregate(index, aggs={"result": agg_body})
         return result.get("aggregations", {}).get("result", {})
     
+    @mcp.tool()
+    def aggregate_composite(index: str, sources: list, aggs: dict = None, query: dict = None,
+                            page_size: int = 1000, max_buckets: int = 100000, after: dict = None,
+                            output_file: str = None) -> dict:
+        """
+        使用 composite 聚合分页遍历全部桶（适合高基数字段）
+        
+        参数:
+            index: 索引名称
+            sources: composite 分组来源，字符串表示对该字段做 terms 分组
+            aggs: 每个桶内的指标聚合（可选）
+            query: 过滤条件（可选）
+            page_size: 每页桶数量
+            max_buckets: 本次调用最多读取的桶数，超过后停止并返回 after_key 以便续读
+            after: 从指定 after_key 继续读取
+            output_file: 写入本地 CSV 文件（逐页写入，不在内存中保留桶，且不受 max_buckets 限制）
+        
+        返回列式结果 {"columns": {"key 列": [...], "doc_count": [...], "指标列": [...]}}
+        
+        示例:
+            aggregate_composite("orders", ["customer_id"],
+                aggs={"total": {"sum": {"field": "amount"}}})
+            aggregate_composite("logs", [
+                {"host": {"terms": {"field": "host"}}},
+                {"day": {"date_histogram": {"field": "@timestamp", "calendar_interval": "day"}}}
+            ], output_file="/tmp/host_daily.csv")
+        """
+        client = get_client()
+        sources = [{s: {"terms": {"field": s}}} if isinstance(s, str) else s for s in sources]
+        key_names = [next(iter(s)) for s in sources]
+        
+        keys = {name: [] for name in key_names}
+        doc_counts = array("q")
+        metrics = {}
+        writer = None
+        out = open(output_file, "w", newline="", encoding="utf-8") if output_file else None
+        if out:
+            # 表头按聚合定义生成：与各桶实际返回的指标无关，空结果也写表头
+            metric_names = _metric_columns(aggs)
+            writer = csv.writer(out)
+            writer.writerow(key_names + ["doc_count"] + metric_names)
+        bucket_count = 0
+        pages = 0
+        after_key = after
+        try:
+            while True:
+                composite = {"size": page_size, "sources": sources}
+                if after_key:
+                    composite["after"] = after_key
+                agg = {"composite": composite}
+                if aggs:
+                    agg["aggs"] = aggs
+                body = {"size": 0, "aggs": {"result": agg}}
+                if query:
+                    body["query"] = query
+                
+                result = client.post(f"/{index}/_search", body).get("aggregations", {}).get("result", {})
+                buckets = result.get("buckets", [])
+                after_key = result.get("after_key")
+                pages += 1
+                
+                for bucket in buckets:
+                    values = _bucket_metrics(bucket)
+                    if out:
+                        writer.writerow([bucket["key"].get(n) for n in key_names]
+                                        + [bucket.get("doc_count")]
+                                        + [_csv_value(values.get(m)) for m in metric_names])
+                    else:
+                        for name in key_names:
+                            keys[name].append(bucket["key"].get(name))
+                        doc_counts.append(bucket.get("doc_count", 0))
+                        for name, value in values.items():
+                            if name not in metrics:
+                                metrics[name] = array("d", [math.nan] * bucket_count)
+                            if isinstance(metrics[name], array) and not _is_number(value):
+                                # scripted_metric 等返回对象/数组的指标按原值保存
+                                metrics[name] = _nullable(metrics[name])
+                        for name, column in metrics.items():
+                            value = values.get(name)
+                            if isinstance(column, array):
+                                column.append(math.nan if value is None else value)
+                            else:
+                                column.append(value)
+                    bucket_count += 1
+                
+                # 未满一页不代表结束，只以 after_key 缺失为准
+                if not buckets or not after_key:
+                    after_key = None
+                    break
+                if not out and bucket_count >= max_buckets:
+                    break
+        finally:
+            if out:
+                out.close()
+        
+        response = {
+            "buckets": bucket_count,
+            "pages": pages,
+            "complete": after_key is None,
+            "after_key": after_key
+        }
+        if output_file:
+            response["output_file"] = output_file
+        else:
+            columns = dict(keys)
+            columns["doc_count"] = doc_counts.tolist()
+            for name, column in metrics.items():
+                columns[name] = _nullable(column)
+            response["columns"] = columns
+        return response
+    
     @mcp.tool()
     def scroll_start(index: str, query: dict = None, size: int = 100, scroll: str = "5m", sort: list = None) -> dict:
         """
@@ -348,6 +1449,23 @@ def register_search_tools(mcp: FastMCP):
         params = {"fields": ",".join(fields)}
         return client.get(f"/{index}/_field_caps", params)
     
+    @mcp.tool()
+    def field_caps_local(index: str, fields: list = None) -> dict:
+        """
+        从缓存映射获取字段类型和能力（映射相同的索引共享同一份字段表）
+        
+        参数:
+            index: 索引名称（支持通配符）
+            fields: 字段列表（支持通配符），为空时返回全部字段
+        
+        返回各字段的类型、是否可搜索/可聚合，跨索引类型不一致时包含 conflicts
+        """
+        all_fields = get_mapping_cache().fields(index)
+        if not fields:
+            return all_fields
+        return {name: info for name, info in all_fields.items()
+                if any(fnmatch.fnmatchcase(name, pattern) for pattern in fields)}
+    
     @mcp.tool()
     def knn_search(index: str, field: str, query_vector: list, k: int = 10, num_candidates: int = 100, filter: dict = None) -> dict:
         """
@@ -387,19 +1505,281 @@ def register_search_tools(mcp: FastMCP):
         }
     
     @mcp.tool()
-    def sql_query(query: str, format: str = "json", fetch_size: int = 1000) -> dict:
+    def knn_search_batch(index: str, field: str, query_vectors: list, k: int = 10,
+                         num_candidates: int = 100, filter: dict = None, source: list = None,
+                         batch_size: int = 50, max_concurrency: int = 4) -> dict:
+        """
+        批量 K近邻向量搜索（一次调用执行多个查询向量）
+        
+        参数:
+            index: 索引名称
+            field: 向量字段名
+            query_vectors: 查询向量矩阵（每行一个向量，维度必须一致）
+            k: 每个查询返回的最近邻数量
+            num_candidates: 候选数量
+            filter: 过滤条件（对所有查询生效）
+            source: 返回的字段列表（默认不返回 _source）
+            batch_size: 每个 _msearch 请求包含的查询数
+            max_concurrency: 并发 _msearch 请求数上限
+        
+        返回按输入顺序排列的结果，每项为 {"ids": [...], "scores": [...]}
+        
+        示例:
+            knn_search_batch("products", "embedding", [[0.1, 0.2, ...], [0.3, 0.4, ...]], k=5)
+        """
+        client = get_client()
+        dim = _validate_vectors(query_vectors, _vector_dims(index, field))
+        
+        def build_body(vector: list) -> dict:
+            body = {
+                "size": k,
+                "_source": source or False,
+                "knn": {
+                    "field": field,
+                    "query_vector": vector,
+                    "k": k,
+                    "num_candidates": num_candidates
+                }
+            }
+            if filter:
+                body["knn"]["filter"] = filter
+            return body
+        
+        def run_batch(start: int) -> list:
+            batch = query_vectors[start:start + batch_size]
+            result = client.msearch([({"index": index}, build_body(v)) for v in batch])
+            return result.get("responses", [])
+        
+        batch_size = max(1, batch_size)
+        starts = range(0, len(query_vectors), batch_size)
+        responses = chain.from_iterable(parallel_map(run_batch, starts, max_concurrency))
+        
+        results = []
+        for r in responses:
+            if "error" in r:
+                results.append({"error": r["error"].get("reason", r["error"])})
+                continue
+            hits = r.get("hits", {}).get("hits", [])
+            item = {
+                "ids": [h.get("_id") for h in hits],
+                "scores": [h.get("_score") for h in hits]
+            }
+            if source:
+                item["sources"] = [h.get("_source") for h in hits]
+            results.append(item)
+        
+        return {
+            "queries": len(query_vectors),
+            "dims": dim,
+            "results": results
+        }
+    
+    @mcp.tool()
+    def hybrid_search(index: str, query: dict, field: str, query_vector: list, size: int = 10,
+                      window_size: int = 50, num_candidates: int = 100, filter: dict = None,
+                      fusion: str = "rrf", rank_constant: int = 60, lexical_weight: float = 0.5,
+                      rerank_top_n: int = 0, source: list = None) -> dict:
+        """
+        混合检索（BM25 + kNN 并发执行，客户端融合排序）
+        
+        参数:
+            index: 索引名称
+            query: 全文检索 DSL 查询
+            field: 向量字段名
+            query_vector: 查询向量
+            size: 返回数量
+            window_size: 每路召回的候选数量
+            num_candidates: kNN 候选数量
+            filter: 过滤条件（同时作用于两路召回）
+            fusion: 融合方式 rrf（倒数排名融合）/weighted（归一化分数加权）
+            rank_constant: RRF 常数 k
+            lexical_weight: weighted 模式下 BM25 分数的权重（kNN 权重为 1 - lexical_weight）
+            rerank_top_n: 对融合后前 N 条按 _source 中的向量精确计算余弦相似度重排（0 表示不重排，
+                          只为这 N 条读取向量）
+            source: 返回的字段列表（默认返回除向量字段外的 _source）
+        
+        示例:
+            hybrid_search("products", {"match": {"name": "phone"}}, "embedding", [0.1, 0.2, ...])
+            hybrid_search("products", {"match": {"name": "phone"}}, "embedding", [0.1, 0.2, ...],
+                          fusion="weighted", lexical_weight=0.3, rerank_top_n=20)
+        """
+        if fusion not in ("rrf", "weighted"):
+            raise ValueError(f"不支持的融合方式: {fusion}")
+        client = get_client()
+        # 默认不返回向量字段：每条命中的向量通常有数 KB
+        fetch_source = source if source is not None else {"excludes": [field]}
+        
+        lexical_body = {"size": window_size, "query": query}
+        if filter:
+            lexical_body["query"] = {"bool": {"must": [query], "filter": [filter]}}
+        knn_body = {
+            "size": window_size,
+            "knn": {
+                "field": field,
+                "query_vector": query_vector,
+                "k": window_size,
+                "num_candidates": max(num_candidates, window_size)
+            }
+        }
+        if filter:
+            knn_body["knn"]["filter"] = filter
+        for body in (lexical_body, knn_body):
+            body["_source"] = fetch_source
+        
+        lexical, knn = parallel_map(lambda b: client.post(f"/{index}/_search", b),
+                                    [lexical_body, knn_body], max_workers=2)
+        
+        docs = {}
+        ranks = {"bm25": {}, "knn": {}}
+        scores = {"bm25": {}, "knn": {}}
+        for name, result in (("bm25", lexical), ("knn", knn)):
+            for rank, h in enumerate(result.get("hits", {}).get("hits", []), start=1):
+                key = (h.get("_index"), h.get("_id"))
+                docs.setdefault(key, h)
+                ranks[name][key] = rank
+                scores[name][key] = h.get("_score") or 0.0
+        
+        if fusion == "rrf":
+            fused = {key: sum(1.0 / (rank_constant + r[key]) for r in ranks.values() if key in r)
+                     for key in docs}
+        else:
+            norm_bm25, norm_knn = _min_max(scores["bm25"]), _min_max(scores["knn"])
+            fused = {key: lexical_weight * norm_bm25.get(key, 0.0)
+                     + (1 - lexical_weight) * norm_knn.get(key, 0.0) for key in docs}
+        ordered = sorted(docs, key=fused.get, reverse=True)
+        
+        cosines = {}
+        if rerank_top_n:
+            head = ordered[:rerank_top_n]
+            vectors = {key: (docs[key].get("_source") or {}).get(field) for key in head}
+            missing = [key for key, vector in vectors.items() if vector is None]
+            if missing and not (isinstance(source, list) and field in source):
+                # 只为参与重排的文档读取向量
+                specs = []
+                for key in missing:
+                    spec = {"_index": key[0], "_id": key[1], "_source": [field]}
+                    if docs[key].get("_routing"):
+                        spec["routing"] = docs[key]["_routing"]
+                    specs.append(spec)
+                for doc in client.post("/_mget", {"docs": specs}).get("docs", []):
+                    vectors[(doc.get("_index"), doc.get("_id"))] = (doc.get("_source") or {}).get(field)
+            for key in head:
+                if vectors.get(key):
+                    cosines[key] = _cosine(query_vector, vectors[key])
+            head.sort(key=lambda key: cosines.get(key, -1.0), reverse=True)
+            ordered = head + ordered[rerank_top_n:]
+        
+        hits = []
+        for key in ordered[:size]:
+            doc_source = docs[key].get("_source")
+            hit = {
+                "_index": key[0],
+                "_id": key[1],
+                "score": fused[key],
+                "bm25_score": scores["bm25"].get(key),
+                "bm25_rank": ranks["bm25"].get(key),
+                "knn_score": scores["knn"].get(key),
+                "knn_rank": ranks["knn"].get(key),
+                "_source": doc_source
+            }
+            if key in cosines:
+                hit["cosine"] = cosines[key]
+            hits.append(hit)
+        
+        return {
+            "took_ms": max(lexical.get("took", 0), knn.get("took", 0)),
+            "fusion": fusion,
+            "bm25_total": lexical.get("hits", {}).get("total", {}).get("value", 0),
+            "candidates": len(docs),
+            "hits": hits
+        }
+    
+    @mcp.tool()
+    def sql_query(query: str, format: str = "json", fetch_size: int = 1000, fetch_all: bool = False,
+                  max_rows: int = 100000, output_file: str = None, columnar: bool = False) -> dict:
         """
         执行 SQL 查询
         
         参数:
             query: SQL 查询语句
-            format: 返回格式 json/csv/txt/yaml
+            format: 返回格式 json/csv/txt/yaml（fetch_all/output_file/columnar 时固定为 json）
             fetch_size: 每次获取的行数
+            fetch_all: 是否跟随 cursor 读取全部结果（超过 max_rows 时返回 cursor，可用 sql_next 续读）
+            max_rows: fetch_all 时本次调用最多返回的行数
+            output_file: 跟随 cursor 将全部结果逐页写入本地 CSV 文件（不受 max_rows 限制）
+            columnar: 按列输出 {"data": {"列名": [...]}}
+        
+        未读完的结果会返回 cursor，使用 sql_next 继续读取或 sql_close 释放
         
         示例:
             sql_query("SELECT * FROM products WHERE price > 100 LIMIT 10")
             sql_query("SELECT category, COUNT(*) FROM products GROUP BY category")
+            sql_query("SELECT * FROM logs", fetch_all=True, columnar=True)
+            sql_query("SELECT * FROM logs", output_file="/tmp/logs.csv")
         """
         client = get_client()
         body = {"query": query, "fetch_size": fetch_size}
-        return client.post(f"/_sql?format={format}", body)
+        if not (fetch_all or output_file or columnar):
+            return client.post(f"/_sql?format={format}", body)
+        
+        columns, rows, cursor = _sql_page(body)
+        pages = 1
+        if output_file:
+            total = 0
+            try:
+                with open(output_file, "w", newline="", encoding="utf-8") as out:
+                    writer = csv.writer(out)
+                    writer.writerow([c.get("name") for c in columns])
+                    while True:
+                        writer.writerows(rows)
+                        total += len(rows)
+                        if not cursor:
+                            break
+                        _, rows, cursor = _sql_page({"cursor": cursor})
+                        pages += 1
+            finally:
+                if cursor:
+                    sql_close(cursor)
+            return {"columns": columns, "rows": total, "pages": pages, "output_file": output_file}
+        
+        if fetch_all:
+            rows = list(rows)
+            try:
+                while cursor and len(rows) < max_rows:
+                    _, page, cursor = _sql_page({"cursor": cursor})
+                    rows.extend(page)
+                    pages += 1
+            except Exception:
+                sql_close(cursor)
+                raise
+        response = _sql_result(columns, rows, columnar)
+        response["pages"] = pages
+        response["cursor"] = cursor
+        return response
+    
+    @mcp.tool()
+    def sql_next(cursor: str, columnar: bool = False) -> dict:
+        """
+        使用 cursor 获取 SQL 查询的下一页
+        
+        参数:
+            cursor: sql_query/sql_next 返回的 cursor
+            columnar: 按列输出
+        
+        返回的 cursor 为空表示已读完（服务端会自动释放）
+        """
+        columns, rows, next_cursor = _sql_page({"cursor": cursor})
+        response = _sql_result(columns, rows, columnar)
+        response["cursor"] = next_cursor
+        return response
+    
+    @mcp.tool()
+    def sql_close(cursor: str) -> dict:
+        """
+        关闭 SQL cursor，释放服务端资源
+        
+        参数:
+            cursor: 要关闭的 cursor
+        """
+        client = get_client()
+        return client.post("/_sql/close", {"cursor": cursor})
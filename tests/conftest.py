@@ -0,0 +1,28 @@
+"""
+测试共用的夹具
+"""
+
+import pytest
+
+
+class MappingCacheStub:
+    """代替映射缓存：indices 为空时所有索引使用同一个字段表，否则未列出的索引抛出 KeyError"""
+
+    def __init__(self, table: dict, indices=None):
+        self.table = table
+        self.indices = indices
+
+    def fields(self, index: str) -> dict:
+        if self.indices is not None and index not in self.indices:
+            raise KeyError(index)
+        return self.table
+
+
+@pytest.fixture
+def mapping_cache(monkeypatch):
+    """用给定字段表替换模块中的 get_mapping_cache，返回桩对象"""
+    def install(module, table: dict, indices=None) -> MappingCacheStub:
+        stub = MappingCacheStub(table, indices)
+        monkeypatch.setattr(module, "get_mapping_cache", lambda: stub)
+        return stub
+    return install
@@ -0,0 +1,94 @@
+"""
+bulk_mode 状态记录与恢复的单元测试（不访问集群）
+"""
+
+import json
+import pytest
+from easysearch_mcp import bulk_mode
+
+
+class _Client:
+    url = "http://es:9200"
+
+    def __init__(self):
+        self.settings = {"logs": {"index.refresh_interval": "5s", "index.number_of_replicas": "1"},
+                         "metrics": {"index.number_of_replicas": "2"}}
+        self.puts = []
+
+    def get(self, path, params=None):
+        names = path.strip("/").split("/")[0].split(",")
+        return {n: {"settings": dict(self.settings[n])} for n in names if n in self.settings}
+
+    def put(self, path, body=None):
+        self.puts.append((path.strip("/").split("/")[0], body))
+        return {"acknowledged": True}
+
+    def post(self, path, body=None, params=None):
+        return {}
+
+    def health(self, index, params=None):
+        return {"status": "green", "timed_out": False}
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    fake = _Client()
+    monkeypatch.setattr(bulk_mode, "get_client", lambda: fake)
+    monkeypatch.setattr(bulk_mode, "install_exit_hooks", lambda: None)
+    monkeypatch.setenv("EASYSEARCH_BULK_STATE", str(tmp_path / "state.json"))
+    yield fake
+    for timer in bulk_mode._timers.values():
+        timer.cancel()
+    bulk_mode._timers.clear()
+
+
+def stored(tmp_path):
+    path = tmp_path / "state.json"
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+def test_override_keys_are_normalized(client, tmp_path):
+    result = bulk_mode.enter_bulk("logs", settings={"refresh_interval": "30s", "index": {"codec": "x"}}, lease=0)
+    assert result["applied"]["index.refresh_interval"] == "30s"
+    assert result["previous"]["logs"]["index.refresh_interval"] == "5s"
+    assert result["previous"]["logs"]["index.codec"] is None
+    assert "refresh_interval" not in result["applied"]
+
+
+def test_sessions_do_not_overwrite_each_other(client, tmp_path, monkeypatch):
+    bulk_mode.enter_bulk("logs", lease=0)
+    # 另一个会话进程写入自己的记录
+    monkeypatch.setattr(bulk_mode, "_token", "other-session")
+    bulk_mode.enter_bulk("metrics", lease=0)
+    assert sorted(e["index"] for e in stored(tmp_path).values()) == ["logs", "metrics"]
+    assert bulk_mode.exit_bulk("metrics", wait_for_green=False)["restored"] == ["metrics"]
+    assert [e["index"] for e in stored(tmp_path).values()] == ["logs"]
+
+
+def test_reentry_keeps_original_settings(client, tmp_path):
+    bulk_mode.enter_bulk("logs", lease=0)
+    client.settings["logs"]["index.refresh_interval"] = "-1"
+    result = bulk_mode.enter_bulk("logs", lease=0)
+    assert result["previous"]["logs"]["index.refresh_interval"] == "5s"
+
+
+def test_exit_restores_previous_and_removes_state(client, tmp_path):
+    bulk_mode.enter_bulk("logs", lease=0)
+    result = bulk_mode.exit_bulk("logs")
+    assert result["restored"] == ["logs"] and result["green"]
+    assert client.puts[-1] == ("logs", {"index.refresh_interval": "5s", "index.number_of_replicas": "1",
+                                        "index.translog.durability": None,
+                                        "index.translog.flush_threshold_size": None})
+    assert not (tmp_path / "state.json").exists()
+
+
+def test_recover_restores_entries_of_dead_sessions(client, tmp_path, monkeypatch):
+    bulk_mode.enter_bulk("logs", lease=0)
+    bulk_mode.enter_bulk("metrics", lease=0)
+    state = stored(tmp_path)
+    for entry in state.values():
+        if entry["index"] == "logs":
+            entry.update(token="crashed", pid=2 ** 22 + 1)
+    (tmp_path / "state.json").write_text(json.dumps(state))
+    assert bulk_mode.recover()["restored"] == ["logs"]
+    assert [e["index"] for e in stored(tmp_path).values()] == ["metrics"]
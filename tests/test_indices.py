@@ -0,0 +1,23 @@
+"""
+索引工具中本地计算部分的单元测试（不访问集群）
+"""
+
+from easysearch_mcp.tools import indices
+
+# GET /logs-*/_settings/index.blocks.*?flat_settings=true（7.x 集群的实际响应）
+BLOCKS_RESPONSE = {
+    "logs-2024.01": {"settings": {"index.blocks.write": "true"}},
+    "logs-2024.02": {"settings": {"index.blocks.read_only": "true", "index.blocks.metadata": "true"}},
+    "logs-2024.03": {"settings": {"index.blocks.read_only_allow_delete": "true"}},
+    "logs-2024.04": {"settings": {"index.blocks.write": "false"}},
+    "logs-2024.05": {"settings": {"index.blocks.read": "true"}},
+    "logs-2024.06": {"settings": {}}
+}
+
+
+def test_write_blocked_only_counts_write_and_read_only_blocks():
+    assert indices._write_blocked(BLOCKS_RESPONSE) == {"logs-2024.01", "logs-2024.02"}
+
+
+def test_write_blocked_empty_response():
+    assert indices._write_blocked({}) == set()
@@ -0,0 +1,109 @@
+"""
+query_guard 成本评估与保护的单元测试（不访问集群）
+"""
+
+import pytest
+from easysearch_mcp import query_guard
+from easysearch_mcp.query_guard import estimate_cost, guard, rewrite_body
+
+FIELDS = {
+    "title": {"type": "text", "aggregatable": False},
+    "title.keyword": {"type": "keyword", "aggregatable": True},
+    "status": {"type": "keyword", "aggregatable": True},
+    "ts": {"type": "date", "aggregatable": True},
+}
+
+
+@pytest.fixture(autouse=True)
+def cache(mapping_cache, monkeypatch):
+    mapping_cache(query_guard, FIELDS)
+    monkeypatch.delenv("EASYSEARCH_QUERY_GUARD", raising=False)
+    monkeypatch.delenv("EASYSEARCH_QUERY_BUDGET", raising=False)
+
+
+def reasons(body):
+    return [(item["path"], item["cost"]) for item in estimate_cost("logs", body)["breakdown"]]
+
+
+def test_cheap_query_within_budget():
+    report = estimate_cost("logs", {"query": {"bool": {"filter": [{"term": {"status": "ok"}}]}}})
+    assert report == {"cost": 1.0, "budget": 100.0, "over_budget": False, "breakdown": []}
+
+
+@pytest.mark.parametrize("body, path, cost", [
+    ({"query": {"wildcard": {"status": "*ok"}}}, "query.wildcard", 100),
+    ({"query": {"wildcard": {"status": {"value": "?k"}}}}, "query.wildcard", 100),
+    ({"query": {"regexp": {"status": ".*ok"}}}, "query.regexp", 100),
+    ({"query": {"prefix": {"status": "o"}}}, "query.prefix", 10),
+    ({"query": {"term": {"title": "Error"}}}, "query.term", 10),
+    ({"query": {"term": {"nope": 1}}}, "query.term", 2),
+    ({"query": {"query_string": {"query": "status:*ok", "default_field": "status"}}}, "query.query_string", 100),
+    ({"query": {"query_string": {"query": "ok"}}}, "query.query_string", 5),
+    ({"query": {"bool": {"filter": [{"script": {"script": "true"}}]}}}, "query.bool.filter[0].script", 30),
+    ({"from": 9995, "size": 10}, "from", 100),
+    ({"from": 2000}, "from", 10),
+    ({"size": 2000}, "size", 10),
+    ({"sort": [{"title": "asc"}]}, "sort[0]", 50),
+    ({"sort": [{"_script": {}}]}, "sort[0]", 30),
+    ({"aggs": {"a": {"terms": {"field": "title"}}}}, "aggs.a", 50),
+    ({"script_fields": {}}, "script_fields", 10),
+])
+def test_cost_items(body, path, cost):
+    assert (path, cost) in reasons(body)
+
+
+def test_nested_terms_multiply_bucket_counts():
+    body = {"aggs": {"a": {"terms": {"field": "status", "size": 100},
+                           "aggs": {"b": {"terms": {"field": "ts", "size": 50}}}}}}
+    assert reasons(body) == [("aggs.a.b", 50.0)]
+
+
+def test_rewrite_caps_size_from_and_buckets():
+    body = {"from": 9500, "size": 5000, "aggs": {"a": {"terms": {"field": "status", "size": 5000},
+                                                        "aggs": {"b": {"significant_terms": {"size": 2000}}}}}}
+    new, changes = rewrite_body(body)
+    assert new["size"] == 1000 and new["from"] == 9000
+    assert new["aggs"]["a"]["terms"]["size"] == 1000
+    assert new["aggs"]["a"]["aggs"]["b"]["significant_terms"]["size"] == 1000
+    assert len(changes) == 4
+    assert body["size"] == 5000
+
+
+@pytest.mark.parametrize("mode", ["off", "warn", "throttle"])
+def test_guard_passes_body_through(monkeypatch, mode):
+    monkeypatch.setenv("EASYSEARCH_QUERY_GUARD", mode)
+    body = {"query": {"wildcard": {"status": "*ok"}}}
+    with guard("logs", body) as (actual, report):
+        assert actual is body
+        assert (report is None) is (mode == "off")
+
+
+def test_guard_reject(monkeypatch):
+    monkeypatch.setenv("EASYSEARCH_QUERY_GUARD", "reject")
+    with guard("logs", {"query": {"term": {"status": "ok"}}}) as (_, report):
+        assert report is None
+    with pytest.raises(ValueError):
+        with guard("logs", {"query": {"wildcard": {"status": "*ok"}}}):
+            pass
+
+
+def test_guard_rewrite(monkeypatch):
+    monkeypatch.setenv("EASYSEARCH_QUERY_GUARD", "rewrite")
+    monkeypatch.setenv("EASYSEARCH_QUERY_BUDGET", "20")
+    with guard("logs", {"size": 5000}) as (body, report):
+        assert body == {"size": 1000}
+        assert report["rewrites"] == ["size: 5000 -> 1000"]
+        assert report["cost_after_rewrite"] == 1.0
+    # 改写不能消除的成本（前导通配符）仍然拒绝
+    with pytest.raises(ValueError):
+        with guard("logs", {"query": {"wildcard": {"status": "*ok"}}}):
+            pass
+
+
+def test_guard_is_off_by_default():
+    assert query_guard.guard_mode() == "off"
+
+
+def test_unknown_mode_falls_back_to_off(monkeypatch):
+    monkeypatch.setenv("EASYSEARCH_QUERY_GUARD", "bogus")
+    assert query_guard.guard_mode() == "off"
@@ -0,0 +1,106 @@
+"""
+query_rewrite 查询改写的单元测试（不访问集群）
+"""
+
+import pytest
+from easysearch_mcp import query_rewrite
+from easysearch_mcp.query_rewrite import rewrite_query, scoring_matters
+
+FIELDS = {
+    "title": {"type": "text", "searchable": True},
+    "title.keyword": {"type": "keyword", "searchable": True},
+    "body": {"type": "text", "searchable": True},
+    "status": {"type": "keyword", "searchable": True},
+    "bytes": {"type": "long", "searchable": True},
+    "ts": {"type": "date", "searchable": True},
+    "archived_at": {"type": "date", "searchable": False},
+}
+
+
+@pytest.fixture(autouse=True)
+def cache(mapping_cache):
+    return mapping_cache(query_rewrite, FIELDS, indices={"logs"})
+
+
+def test_scoring_keeps_scored_clauses_in_must():
+    query = {"bool": {"must": [{"match": {"title": "error"}}, {"range": {"ts": {"gte": "now-1d"}}},
+                               {"term": {"status": "ok"}}]}}
+    result = rewrite_query("logs", query)
+    assert result["query"] == {"bool": {
+        "must": [{"match": {"title": "error"}}, {"term": {"status": "ok"}}],
+        "filter": [{"range": {"ts": {"gte": "now-1d"}}}]}}
+    assert len(result["changes"]) == 1
+
+
+def test_without_scoring_all_filterable_clauses_move():
+    query = {"bool": {"must": [{"term": {"status": "ok"}}, {"match": {"title": "error"}}],
+                      "filter": {"exists": {"field": "ts"}}}}
+    result = rewrite_query("logs", query, scoring=False)
+    assert result["query"] == {"bool": {
+        "must": [{"match": {"title": "error"}}],
+        "filter": [{"exists": {"field": "ts"}}, {"term": {"status": "ok"}}]}}
+
+
+def test_must_removed_when_empty():
+    result = rewrite_query("logs", {"bool": {"must": {"range": {"bytes": {"gt": 0}}}}})
+    assert result["query"] == {"bool": {"filter": [{"range": {"bytes": {"gt": 0}}}]}}
+
+
+def test_input_is_not_modified():
+    query = {"bool": {"must": [{"range": {"bytes": {"gt": 0}}}]}}
+    rewrite_query("logs", query)
+    assert query == {"bool": {"must": [{"range": {"bytes": {"gt": 0}}}]}}
+
+
+@pytest.mark.parametrize("query, expected", [
+    ({"match": {"status": "ok"}}, {"term": {"status": "ok"}}),
+    ({"match": {"bytes": {"query": 5, "boost": 2}}}, {"term": {"bytes": {"value": 5, "boost": 2}}}),
+    ({"match_phrase": {"ts": "2024-01-01"}}, {"term": {"ts": "2024-01-01"}}),
+    ({"match": {"title": "ok"}}, {"match": {"title": "ok"}}),
+    ({"match": {"status": {"query": "ok", "operator": "and"}}}, {"match": {"status": {"query": "ok", "operator": "and"}}}),
+])
+def test_match_on_exact_fields(query, expected):
+    assert rewrite_query("logs", query)["query"] == expected
+
+
+@pytest.mark.parametrize("query, flag", [
+    ({"term": {"title": "Error"}}, "title.keyword"),
+    ({"wildcard": {"body": "err*"}}, "text 字段 body"),
+    ({"range": {"archived_at": {"gte": 0}}}, "未建立索引"),
+    ({"term": {"nope": 1}}, "不在映射中"),
+    ({"match": {"status": {"query": "ok", "operator": "and"}}}, "额外参数"),
+])
+def test_flags_are_not_rewritten(query, flag):
+    result = rewrite_query("logs", query)
+    assert result["query"] == query
+    assert any(flag in f for f in result["flags"]), result["flags"]
+
+
+def test_nested_scoring_contexts():
+    query = {"constant_score": {"filter": {"bool": {"must": [{"term": {"status": "ok"}}]}}}}
+    assert rewrite_query("logs", query)["query"] == {
+        "constant_score": {"filter": {"bool": {"filter": [{"term": {"status": "ok"}}]}}}}
+    query = {"has_child": {"type": "c", "score_mode": "none", "query": {"bool": {"must": [{"term": {"status": "ok"}}]}}}}
+    assert rewrite_query("logs", query)["query"]["has_child"]["query"] == {"bool": {"filter": [{"term": {"status": "ok"}}]}}
+
+
+def test_top_level_filter_wrapped_without_scoring():
+    assert rewrite_query("logs", {"term": {"status": "ok"}}, scoring=False)["query"] == {
+        "bool": {"filter": [{"term": {"status": "ok"}}]}}
+    assert rewrite_query("logs", {"match_all": {}}, scoring=False)["query"] == {"match_all": {}}
+
+
+def test_unknown_index_only_applies_structural_rewrites():
+    result = rewrite_query("other", {"bool": {"must": [{"range": {"x": {"gt": 1}}}, {"match": {"y": 1}}]}})
+    assert result["query"] == {"bool": {"must": [{"match": {"y": 1}}], "filter": [{"range": {"x": {"gt": 1}}}]}}
+    assert result["flags"] == []
+
+
+@pytest.mark.parametrize("size, sort, expected", [
+    (0, None, False),
+    (10, None, True),
+    (10, ["ts"], False),
+    (10, [{"ts": "desc"}, "_score"], True),
+])
+def test_scoring_matters(size, sort, expected):
+    assert scoring_matters(size, sort) is expected
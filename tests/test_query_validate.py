@@ -0,0 +1,126 @@
+"""
+query_validate 本地校验的单元测试（不访问集群）
+"""
+
+import pytest
+from easysearch_mcp import query_validate
+
+FIELDS = {
+    "title": {"type": "text", "searchable": True, "aggregatable": False},
+    "title.keyword": {"type": "keyword", "searchable": True, "aggregatable": True},
+    "status": {"type": "keyword", "searchable": True, "aggregatable": True},
+    "bytes": {"type": "long", "searchable": True, "aggregatable": True},
+    "ts": {"type": "date", "searchable": True, "aggregatable": True},
+    "ok": {"type": "boolean", "searchable": True, "aggregatable": True},
+    "loc": {"type": "geo_point", "searchable": True, "aggregatable": True},
+    "notes": {"type": "text", "searchable": False, "aggregatable": False},
+    "tags": {"type": "nested", "searchable": False, "aggregatable": False},
+    "tags.name": {"type": "text", "searchable": True, "aggregatable": False},
+    "tags.code": {"type": "keyword", "searchable": True, "aggregatable": True},
+}
+
+
+@pytest.fixture(autouse=True)
+def cache(mapping_cache):
+    return mapping_cache(query_validate, FIELDS)
+
+
+def messages(result, level="errors"):
+    return [(e["field"], e["message"]) for e in result[level]]
+
+
+def test_valid_query():
+    result = query_validate.validate("logs", query={"bool": {
+        "must": [{"match": {"title": "error"}}],
+        "filter": [{"term": {"status": "ok"}}, {"range": {"bytes": {"gte": "10"}}}]}})
+    assert result["valid"] and not result["warnings"]
+    assert result["fields_checked"] == ["bytes", "status", "title"]
+
+
+def test_unknown_field_suggests_close_match():
+    result = query_validate.validate("logs", query={"term": {"statu": "ok"}})
+    assert not result["valid"]
+    assert result["errors"][0]["suggestion"] == ["status"]
+
+
+@pytest.mark.parametrize("query, level, field", [
+    ({"term": {"title": "Error"}}, "warnings", "title"),
+    ({"prefix": {"bytes": "1"}}, "errors", "bytes"),
+    ({"range": {"ok": {"gte": 1}}}, "errors", "ok"),
+    ({"term": {"bytes": "ten"}}, "errors", "bytes"),
+    ({"term": {"ok": "yes"}}, "errors", "ok"),
+    ({"geo_distance": {"distance": "1km", "status": [0, 0]}}, "errors", "status"),
+    ({"match": {"notes": "x"}}, "warnings", "notes"),
+    ({"exists": {"field": "nope"}}, "warnings", "nope"),
+])
+def test_query_type_mismatch(query, level, field):
+    result = query_validate.validate("logs", query=query)
+    assert field in [f for f, _ in messages(result, level)]
+
+
+def test_nested_field_requires_nested_query():
+    assert not query_validate.validate("logs", query={"term": {"tags.code": "a"}})["valid"]
+    wrapped = {"nested": {"path": "tags", "query": {"term": {"tags.code": "a"}}}}
+    assert query_validate.validate("logs", query=wrapped)["valid"]
+    assert not query_validate.validate("logs", query={"nested": {"path": "status", "query": {}}})["valid"]
+
+
+@pytest.mark.parametrize("aggs, valid", [
+    ({"a": {"terms": {"field": "status"}}}, True),
+    ({"a": {"terms": {"field": "title"}}}, False),
+    ({"a": {"avg": {"field": "status"}}}, False),
+    ({"a": {"date_histogram": {"field": "bytes", "fixed_interval": "1h"}}}, False),
+    ({"a": {"geo_bounds": {"field": "ts"}}}, False),
+    ({"a": {"composite": {"sources": [{"s": {"terms": {"field": "title"}}}]}}}, False),
+    ({"a": {"nested": {"path": "tags"}, "aggs": {"b": {"terms": {"field": "tags.code"}}}}}, True),
+    ({"a": {"terms": {"field": "tags.code"}}}, False),
+    ({"a": {"filter": {"term": {"statu": "x"}}}}, False),
+])
+def test_aggs(aggs, valid):
+    assert query_validate.validate("logs", aggs=aggs)["valid"] is valid
+
+
+@pytest.mark.parametrize("params, children, error", [
+    ({"field": "title"}, None, None),
+    ({"field": "status"}, None, None),
+    ({"field": "bytes"}, None, "需要 text 字段"),
+    ({"field": "bytes", "source_fields": ["title"]}, None, None),
+    ({"field": "notes"}, None, "必须建立索引"),
+    ({"field": "title"}, {"c": {"terms": {"field": "status"}}}, "不支持子聚合"),
+])
+def test_significant_text_not_required_to_be_aggregatable(params, children, error):
+    agg = {"significant_text": params}
+    if children:
+        agg["aggs"] = children
+    result = query_validate.validate("logs", aggs={"s": {"sampler": {"shard_size": 100}, "aggs": {"t": agg}}})
+    found = [m for _, m in messages(result)]
+    if error is None:
+        assert result["valid"], found
+    else:
+        assert any(error in m for m in found), found
+
+
+def test_significant_text_in_nested_context():
+    aggs = {"n": {"nested": {"path": "tags"}, "aggs": {"t": {"significant_text": {"field": "tags.name"}}}}}
+    assert "significant_text 不支持 nested 字段" in [m for _, m in messages(query_validate.validate("logs", aggs=aggs))]
+
+
+@pytest.mark.parametrize("sort, valid", [
+    (["ts", {"bytes": "desc"}, "_score"], True),
+    ([{"title": {"order": "asc"}}], False),
+    ([{"tags.code": {"order": "asc", "nested": {"path": "tags"}}}], True),
+    ("tags.code", False),
+])
+def test_sort(sort, valid):
+    assert query_validate.validate("logs", sort=sort)["valid"] is valid
+
+
+def test_sort_suggests_keyword_subfield():
+    result = query_validate.validate("logs", sort=["title"])
+    assert result["errors"][0]["suggestion"] == ["title.keyword"]
+
+
+def test_without_mapping_nothing_is_checked(cache):
+    cache.table = {}
+    result = query_validate.validate("logs", query={"term": {"anything": 1}}, sort=["x"])
+    assert result == {"valid": True, "errors": [], "warnings": [], "fields_checked": []}
@@ -0,0 +1,69 @@
+"""
+reindexing 后台任务收尾的单元测试（不访问集群）
+"""
+
+import time
+import pytest
+from easysearch_mcp import reindexing
+
+
+class _Client:
+    def __init__(self):
+        self.polls = 0
+        self.done_after = 2
+        self.calls = []
+        self.restored = []
+
+    def head(self, path):
+        return True
+
+    def put(self, path, body=None):
+        return {}
+
+    def post(self, path, body=None, params=None):
+        self.calls.append(path)
+        return {"task": "node:1"} if path == "/_reindex" else {}
+
+    def get(self, path, params=None):
+        self.polls += 1
+        completed = self.polls >= self.done_after
+        return {"completed": completed, "task": {"status": {"total": 10, "created": 10 if completed else 5}},
+                "response": {"total": 10, "created": 10, "failures": []} if completed else None}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    fake = _Client()
+    monkeypatch.setattr(reindexing, "get_client", lambda: fake)
+    monkeypatch.setattr(reindexing, "WATCH_POLL_S", 0.01)
+    monkeypatch.setattr(reindexing.bulk_mode, "enter_bulk", lambda index, lease=3600: {"indices": [index]})
+    monkeypatch.setattr(reindexing.bulk_mode, "exit_bulk",
+                        lambda index, wait_for_green=True: fake.restored.append(index) or {"restored": [index]})
+    return fake
+
+
+def wait_for(job_id: str, timeout: float = 2):
+    deadline = time.monotonic() + timeout
+    while reindexing._jobs[job_id]["state"] == "running" and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return reindexing._jobs[job_id]
+
+
+def test_watcher_restores_settings_without_progress_calls(client):
+    job_id = reindexing.start({"index": "src"}, {"index": "dst"}, swap_alias="live")["job_id"]
+    job = wait_for(job_id)
+    assert job["state"] == "completed"
+    assert client.restored == ["dst"]
+    assert job["finished"]["alias_swapped"]["to"] == "dst"
+    # 之后再查询进度不会重复收尾
+    assert reindexing.progress(job_id)["state"] == "completed"
+    assert client.restored == ["dst"]
+
+
+def test_cancel_finishes_once(client):
+    client.done_after = 10 ** 6
+    job_id = reindexing.start({"index": "src"}, {"index": "dst"})["job_id"]
+    assert reindexing.cancel(job_id)["state"] == "canceled"
+    time.sleep(0.05)
+    assert client.restored == ["dst"]
+    assert "/_tasks/node:1/_cancel" in client.calls
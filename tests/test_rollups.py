@@ -0,0 +1,159 @@
+"""
+rollups 规划与合并逻辑的单元测试（不访问集群）
+"""
+
+import json
+import pytest
+from easysearch_mcp import rollups
+
+H = 3600000
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """内存中的 rollup：1h 间隔，按 svc 分组，预聚合 bytes"""
+    buckets = {
+        json.dumps([0, "a"]): [3, {"bytes": [6, 1, 3, 3]}],
+        json.dumps([0, None]): [2, {"bytes": [2, 1, 1, 2]}],
+        json.dumps([0, "b"]): [3, {"bytes": [3, 1, 1, 3]}],
+        json.dumps([3 * H, "b"]): [1, {"bytes": [5, 5, 5, 1]}],
+    }
+    monkeypatch.setattr(rollups, "_rollups", {"hourly": {
+        "index": "logs", "timestamp_field": "ts", "interval": "1h", "metrics": ["bytes"],
+        "group_by": ["svc"], "query": None, "delay": "1m", "start": 0,
+        "watermark": 10 * H, "buckets": buckets
+    }})
+    monkeypatch.setattr(rollups, "update", lambda name: None)
+    monkeypatch.setattr(rollups, "_collect", lambda config, start, end: {})
+
+
+def histogram(children=None, **params):
+    spec = {"date_histogram": dict({"field": "ts", "fixed_interval": "1h"}, **params)}
+    if children:
+        spec["aggs"] = children
+    return {"t": spec}
+
+
+def ts_range(**bounds):
+    return {"range": {"ts": bounds}}
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("30s", 30000), ("5m", 300000), ("1h", H), ("2d", 2 * 86400000), ("250ms", 250),
+])
+def test_parse_interval(value, expected):
+    assert rollups.parse_interval(value) == expected
+
+
+@pytest.mark.parametrize("value", ["1w", "h", "1.5h", ""])
+def test_parse_interval_rejects(value):
+    with pytest.raises(ValueError):
+        rollups.parse_interval(value)
+
+
+@pytest.mark.parametrize("value, expected", [
+    (1000, 1000),
+    ("1000", 1000),
+    ("now", 50 * H),
+    ("now-1h", 49 * H),
+    ("now+30m", 50 * H + 1800000),
+    ("1970-01-01T01:00:00Z", H),
+    ("not a date", None),
+])
+def test_parse_time(value, expected):
+    assert rollups.parse_time(value, now_ms=50 * H) == expected
+
+
+def test_merge_combines_metrics():
+    target = {"k": [2, {"f": [3, 1, 2, 2]}]}
+    rollups._merge(target, {"k": [1, {"f": [5, 0, 5, 1]}], "n": [1, {"f": [1, None, None, 0]}]})
+    assert target == {"k": [3, {"f": [8, 0, 5, 3]}], "n": [1, {"f": [1, None, None, 0]}]}
+
+
+@pytest.mark.parametrize("query, step, expected", [
+    (None, H, (None, None)),
+    (ts_range(gte=0, lt=5 * H), H, (0, 5 * H)),
+    (ts_range(gte="1970-01-01T02:00:00Z"), H, (2 * H, None)),
+    ({"bool": {"filter": [ts_range(gte=H)]}}, H, (H, None)),
+    # 未对齐的边界：rollup 只能整桶取舍
+    (ts_range(gte=7 * 60000), H, None),
+    (ts_range(lt=5 * H + 1), H, None),
+    (ts_range(gte=H), 2 * H, None),
+    # gt/lte、相对时间、其他条件
+    (ts_range(gt=0), H, None),
+    (ts_range(lte=H), H, None),
+    (ts_range(gte="now-1d"), H, None),
+    (ts_range(gte=0, format="epoch_second"), H, None),
+    ({"term": {"svc": "a"}}, H, None),
+    ({"bool": {"filter": [ts_range(gte=0), {"term": {"svc": "a"}}]}}, H, None),
+])
+def test_time_range_requires_alignment(query, step, expected):
+    assert rollups._time_range(query, "ts", step) == expected
+
+
+@pytest.mark.parametrize("aggs, query, matches", [
+    (histogram({"x": {"sum": {"field": "bytes"}}}), None, True),
+    (histogram({"x": {"avg": {"field": "bytes"}}}, fixed_interval="2h"), ts_range(gte=0, lt=4 * H), True),
+    (histogram({"s": {"terms": {"field": "svc", "size": 5}}}), None, True),
+    (histogram(calendar_interval="hour", fixed_interval=None), None, True),
+    (histogram(calendar_interval="month", fixed_interval=None), None, False),
+    (histogram(fixed_interval="30m"), None, False),
+    (histogram(time_zone="+08:00"), None, False),
+    (histogram(extended_bounds={"min": 0, "max": H}), None, False),
+    (histogram({"x": {"sum": {"field": "other"}}}), None, False),
+    (histogram({"x": {"sum": {"field": "bytes", "missing": 0}}}), None, False),
+    (histogram({"s": {"terms": {"field": "host"}}}), None, False),
+    (histogram({"s": {"terms": {"field": "svc", "order": {"_key": "asc"}}}}), None, False),
+    (histogram({"s": {"terms": {"field": "svc", "missing": "n/a"}}}), None, False),
+    (histogram({"s": {"terms": {"field": "svc", "min_doc_count": 0}}}), None, False),
+    (histogram({"s": {"terms": {"field": "svc", "include": "a.*"}}}), None, False),
+    (histogram(), ts_range(gte=7 * 60000), False),
+])
+def test_match_aggregate(registry, aggs, query, matches):
+    spec = aggs["t"]["date_histogram"]
+    for key in [k for k, v in spec.items() if v is None]:
+        del spec[key]
+    name, plan = rollups.match_aggregate("logs", aggs, query)
+    assert (name == "hourly") is matches
+
+
+def test_match_aggregate_other_index(registry):
+    assert rollups.match_aggregate("metrics", histogram(), None) == (None, None)
+
+
+def test_answer_terms_drops_null_keys_and_orders_like_es(registry):
+    aggs = histogram({"s": {"terms": {"field": "svc", "size": 1}, "aggs": {"x": {"sum": {"field": "bytes"}}}}})
+    name, plan = rollups.match_aggregate("logs", aggs, None)
+    buckets = rollups.answer_aggregate(name, plan)["t"]["buckets"]
+    first = buckets[0]
+    # 时间桶包含分组字段缺失的文档，terms 桶中不出现 null 键
+    assert first["doc_count"] == 8
+    assert [b["key"] for b in first["s"]["buckets"]] == ["a"]
+    # 文档数相同时按键升序，b 计入 sum_other_doc_count，null 键不计入
+    assert first["s"]["sum_other_doc_count"] == 3
+    assert first["s"]["buckets"][0]["x"] == {"value": 6}
+
+
+def test_answer_fills_empty_buckets(registry):
+    aggs = histogram({"x": {"sum": {"field": "bytes"}}, "m": {"min": {"field": "bytes"}},
+                      "c": {"value_count": {"field": "bytes"}}, "a": {"avg": {"field": "bytes"}}})
+    name, plan = rollups.match_aggregate("logs", aggs, None)
+    buckets = rollups.answer_aggregate(name, plan)["t"]["buckets"]
+    assert [b["key"] for b in buckets] == [0, H, 2 * H, 3 * H]
+    assert buckets[1] == {"key_as_string": "1970-01-01T01:00:00.000Z", "key": H, "doc_count": 0,
+                          "x": {"value": 0}, "m": {"value": None}, "c": {"value": 0}, "a": {"value": None}}
+    assert buckets[0]["x"] == {"value": 11}
+    assert buckets[0]["a"] == {"value": 11 / 8}
+
+
+def test_answer_min_doc_count_one_skips_empty(registry):
+    aggs = histogram({"x": {"sum": {"field": "bytes"}}}, min_doc_count=1)
+    name, plan = rollups.match_aggregate("logs", aggs, None)
+    assert [b["key"] for b in rollups.answer_aggregate(name, plan)["t"]["buckets"]] == [0, 3 * H]
+
+
+def test_answer_respects_range(registry):
+    aggs = histogram({"x": {"sum": {"field": "bytes"}}}, fixed_interval="2h")
+    name, plan = rollups.match_aggregate("logs", aggs, ts_range(gte=2 * H, lt=4 * H))
+    buckets = rollups.answer_aggregate(name, plan)["t"]["buckets"]
+    assert [(b["key"], b["doc_count"]) for b in buckets] == [(2 * H, 1)]
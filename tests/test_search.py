@@ -0,0 +1,35 @@
+"""
+搜索工具中本地计算部分的单元测试（不访问集群）
+"""
+
+from easysearch_mcp.tools import search
+
+AGGS = {
+    "total": {"sum": {"field": "amount"}},
+    "s": {"stats": {"field": "amount"}},
+    "p": {"percentiles": {"field": "latency", "percents": [50, 99.9]}},
+    "paid": {"filter": {"term": {"status": "paid"}}, "aggs": {"n": {"value_count": {"field": "id"}}}},
+    "by_day": {"date_histogram": {"field": "ts", "calendar_interval": "day"}},
+    "top": {"top_hits": {"size": 1}}
+}
+
+# 一个 composite 桶的实际响应
+BUCKET = {
+    "key": {"customer": "c1"}, "doc_count": 3,
+    "total": {"value": 30.0},
+    "s": {"count": 3, "min": 5.0, "max": 15.0, "avg": 10.0, "sum": 30.0},
+    "p": {"values": {"50.0": 12.0, "99.9": 40.0}},
+    "paid": {"doc_count": 2, "n": {"value": 2}},
+    "by_day": {"buckets": [{"key": 0, "doc_count": 3}]},
+    "top": {"hits": {"total": {"value": 3}, "hits": []}}
+}
+
+
+def test_metric_columns_match_bucket_metrics():
+    assert search._metric_columns(AGGS) == list(search._bucket_metrics(BUCKET))
+
+
+def test_metric_columns_without_aggs():
+    assert search._metric_columns(None) == []
+    assert search._metric_columns({"p": {"percentiles": {"field": "x"}}}) == [
+        "p.1.0", "p.5.0", "p.25.0", "p.50.0", "p.75.0", "p.95.0", "p.99.0"]
@@ -0,0 +1,87 @@
+"""
+templates 模式匹配与合并逻辑的单元测试（不访问集群）
+"""
+
+import pytest
+from easysearch_mcp import templates
+from easysearch_mcp.templates import TemplateIndex, patterns_overlap
+
+TEMPLATES = {
+    "base": {"order": 0, "index_patterns": ["*"],
+             "settings": {"index.number_of_shards": "1", "index.refresh_interval": "1s"},
+             "mappings": {"properties": {"msg": {"type": "text"}, "ts": {"type": "date"}}}},
+    "logs": {"order": 1, "index_patterns": ["logs-*"],
+             "settings": {"index.number_of_shards": "3"},
+             "mappings": {"_doc": {"properties": {"msg": {"type": "keyword"}}}},
+             "aliases": {"all-logs": {}}},
+    "logs-app": {"order": 1, "index_patterns": "logs-app-*-prod",
+                 "settings": {"index.number_of_shards": "5"}},
+    "exact": {"order": 2, "template": "metrics", "settings": {"index.codec": "best_compression"}},
+}
+
+
+@pytest.fixture
+def index():
+    return TemplateIndex(TEMPLATES)
+
+
+@pytest.mark.parametrize("a, b, expected", [
+    ("logs-*", "logs-app-*", True),
+    ("logs-*", "metrics-*", False),
+    ("*-prod", "logs-*", True),
+    ("a*c", "ab*", True),
+    ("a*c", "*d", False),
+    ("abc", "abc", True),
+    ("abc", "abd", False),
+    ("*", "", True),
+    ("a*", "", False),
+])
+def test_patterns_overlap(a, b, expected):
+    assert patterns_overlap(a, b) is expected
+    assert patterns_overlap(b, a) is expected
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("logs-web", ["base", "logs"]),
+    ("logs-app-eu-prod", ["base", "logs", "logs-app"]),
+    ("logs-app-eu-dev", ["base", "logs"]),
+    ("metrics", ["base", "exact"]),
+    ("metrics-1", ["base"]),
+])
+def test_match_orders_by_order_then_name(index, name, expected):
+    assert index.match(name) == expected
+
+
+def test_resolve_merges_and_records_overrides(index):
+    result = index.resolve("logs-app-eu-prod")
+    assert result["settings"] == {"index.number_of_shards": "5", "index.refresh_interval": "1s"}
+    # 旧版带 type 名称的映射被展开后合并
+    assert result["mappings"] == {"properties": {"msg": {"type": "keyword"}, "ts": {"type": "date"}}}
+    assert result["aliases"] == {"all-logs": {}}
+    assert {"key": "mappings.properties.msg.type", "from": "base", "overridden_by": "logs"} in result["overridden"]
+    shards = [o for o in result["overridden"] if o["key"] == "settings.index.number_of_shards"]
+    assert [(o["value"], o["from"], o["overridden_by"]) for o in shards] == [("1", "base", "logs"),
+                                                                            ("3", "logs", "logs-app")]
+
+
+def test_resolve_does_not_share_template_objects(index):
+    result = index.resolve("logs-web")
+    result["mappings"]["properties"]["msg"]["type"] = "long"
+    assert TEMPLATES["logs"]["mappings"]["_doc"]["properties"]["msg"]["type"] == "keyword"
+
+
+def test_overlaps_flags_equal_orders_as_ambiguous(index):
+    result = index.overlaps()
+    assert result[0]["templates"] == ["logs", "logs-app"]
+    assert result[0]["ambiguous"] and result[0]["winner"] is None
+    assert result[0]["conflicting_settings"] == ["index.number_of_shards"]
+    pairs = {tuple(r["templates"]): r for r in result}
+    assert pairs[("base", "exact")]["winner"] == "exact"
+    assert ("exact", "logs") not in pairs
+
+
+def test_deep_merge_replaces_non_dict_and_empty_values():
+    target, origin = {"a": {"b": 1, "c": [1]}}, {}
+    templates._deep_merge(target, {"a": {"c": [2], "d": {}}, "e": 3}, "", origin, "t")
+    assert target == {"a": {"b": 1, "c": [2], "d": {}}, "e": 3}
+    assert origin == {"a.c": "t", "a.d": "t", "e": "t"}